@@ -0,0 +1,151 @@
+"""
+Throughput benchmark: the DRF (WSGI) read endpoints against their async (ASGI)
+counterparts under /api/async/, with simulated database latency.
+
+Each path serves the same requests for one user: the invoice and subscription
+lists, the pending invoices and the profile. WSGI requests are spread over a
+pool of worker threads, the way gunicorn/uwsgi threads would serve them; ASGI
+requests run concurrently on a single event loop, the way uvicorn would. The
+database is a throwaway SQLite file, and every query sleeps --latency ms to stand
+in for a network round trip to PostgreSQL.
+
+Run from the subscription_billing directory:
+    python benchmarks/bench_async_api.py [--requests 400] [--threads 8] [--concurrency 64] [--latency 5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'subscription_billing.settings')
+os.environ['DEBUG'] = 'False'
+DATABASE = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+os.environ['DATABASE_URL'] = f'sqlite:///{DATABASE}'
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management import call_command
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from billing.models import Plan, Subscription, Invoice
+
+PATHS = ['invoices/', 'invoices/pending/', 'subscriptions/', 'auth/profile/']
+
+def seed():
+    user = User.objects.create_user(username='bench', email='bench@example.com')
+    plan = Plan.objects.create(name='pro', price=Decimal('19.99'), description='Pro plan')
+    today = timezone.localdate()
+    subscription = Subscription.objects.create(user=user, plan=plan, status='active', start_date=today, end_date=today + timedelta(days=365))
+    Invoice.objects.bulk_create([
+        Invoice(user=user, subscription=subscription, plan=plan, email=user.email, amount=plan.price,
+                issue_date=today - timedelta(days=30 * i), due_date=today - timedelta(days=30 * i - 15),
+                billing_period=today - timedelta(days=30 * i), status='paid' if i % 3 else 'pending')
+        for i in range(40)
+    ])
+    return str(RefreshToken.for_user(user).access_token)
+
+def add_latency(seconds):
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.append(wrapper)
+
+    # Connections are per thread, so hook every one as it is opened
+    connection_created.connect(install, weak=False)
+
+def wsgi_run(prefix, token, requests, threads):
+    application = get_wsgi_application()
+
+    def call(index):
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': f'{prefix}{PATHS[index % len(PATHS)]}', 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'wsgi.url_scheme': 'http',
+            'wsgi.input': sys.stdin.buffer, 'HTTP_AUTHORIZATION': f'Bearer {token}',
+        }
+        statuses = []
+        response = application(environ, lambda status, headers: statuses.append(status))
+        b''.join(response)
+        response.close()
+        return statuses[0]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        statuses = list(pool.map(call, range(requests)))
+    return time.perf_counter() - start, statuses
+
+async def asgi_run(prefix, token, requests, concurrency):
+    application = get_asgi_application()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def call(index):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': f'{prefix}{PATHS[index % len(PATHS)]}', 'raw_path': b'', 'query_string': b'',
+            'headers': [(b'host', b'localhost'), (b'authorization', f'Bearer {token}'.encode())],
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 50000),
+        }
+        statuses = []
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        done = asyncio.Event()
+
+        async def receive():
+            # The request body once, then a disconnect after the response, like a server
+            if messages:
+                return messages.pop()
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+            elif not message.get('more_body'):
+                done.set()
+
+        async with limit:
+            await application(scope, receive, send)
+        return statuses[0]
+
+    start = time.perf_counter()
+    statuses = await asyncio.gather(*(call(index) for index in range(requests)))
+    return time.perf_counter() - start, statuses
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads')
+    parser.add_argument('--concurrency', type=int, default=64, help='Concurrent ASGI requests')
+    parser.add_argument('--latency', type=float, default=5, help='Simulated per-query latency in ms')
+    options = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    token = seed()
+    add_latency(options.latency / 1000)
+
+    wsgi_seconds, wsgi_statuses = wsgi_run('/api/', token, options.requests, options.threads)
+    asgi_seconds, asgi_statuses = asyncio.run(asgi_run('/api/async/', token, options.requests, options.concurrency))
+
+    print(f"{options.requests} requests, {options.latency:g} ms per query")
+    print(f"{'path':<40} {'req/s':>10} {'errors':>8}")
+    for label, seconds, statuses in [
+        (f'WSGI /api/ ({options.threads} threads)', wsgi_seconds, wsgi_statuses),
+        (f'ASGI /api/async/ ({options.concurrency} concurrent)', asgi_seconds, asgi_statuses),
+    ]:
+        errors = sum(1 for status in statuses if not str(status).startswith('200'))
+        print(f"{label:<40} {options.requests / seconds:>10.1f} {errors:>8}")
+    os.remove(DATABASE)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark: per-message email render time before and after the cached
+template / text template changes in billing.utils.
+
+Run from the subscription_billing directory:
+    python benchmarks/bench_email_render.py [iterations]
+"""
+import os
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'subscription_billing.settings')
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+from billing.models import Plan, Subscription, Invoice
+from billing.utils import build_email_message
+
+def legacy_render(template, context):
+    # What every message paid before: template lookup, render, then strip_tags
+    html_content = render_to_string(template, context)
+    return html_content, strip_tags(html_content)
+
+def sample_contexts():
+    # Unsaved instances, so no database is needed
+    user = User(id=1, username='bench', first_name='Bench', email='bench@example.com')
+    plan = Plan(id=1, name='pro', price=Decimal('19.99'), description='Pro plan')
+    subscription = Subscription(id=1, user=user, plan=plan, start_date=date(2026, 1, 1), end_date=date(2026, 12, 31), status='active')
+    invoices = [
+        Invoice(id=i, user=user, subscription=subscription, email=user.email, amount=plan.price,
+                issue_date=date(2026, 1, 1) + timedelta(days=30 * i), due_date=date(2026, 1, 16) + timedelta(days=30 * i),
+                status='overdue' if i % 2 else 'pending')
+        for i in range(1, 13)
+    ]
+    return [
+        ('billing/emails/invoice_created.html', {'invoice': invoices[0], 'user': user}),
+        ('billing/emails/payment_reminder.html', {'invoice': invoices[0], 'user': user}),
+        ('billing/emails/unpaid_invoice_reminder.html', {
+            'user': user, 'invoices': invoices, 'total_amount': sum(i.amount for i in invoices), 'invoice_count': len(invoices),
+        }),
+        ('billing/emails/monthly_billing_summary.html', {
+            'user': user, 'month_year': 'January 2026', 'last_month_invoices': invoices,
+            'active_subscriptions': [subscription], 'total_amount': Decimal('239.88'),
+            'total_paid': Decimal('119.94'), 'total_pending': Decimal('119.94'), 'invoice_count': len(invoices),
+        }),
+    ]
+
+def measure(func, iterations):
+    func()  # warm up caches
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(f"{'template':<45} {'before (us)':>12} {'after (us)':>12} {'speedup':>8}")
+    for template, context in sample_contexts():
+        before = measure(lambda: legacy_render(template, context), iterations)
+        after = measure(lambda: build_email_message('Benchmark', template, context, ['bench@example.com']), iterations)
+        print(f"{template.rsplit('/', 1)[-1]:<45} {before:>12.1f} {after:>12.1f} {before / after:>7.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Micro-benchmark: encode and decode time and bytes for realistic invoice pages,
+DRF's JSONRenderer / JSONParser against billing.renderers' orjson-backed classes.
+
+Pages are what /api/invoices/ returns (serializer output, mostly strings) and
+raw value rows like the exports read (Decimal, date, datetime, UUID objects).
+
+Run from the subscription_billing directory:
+    python benchmarks/bench_json_render.py [iterations]
+"""
+import os
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'subscription_billing.settings')
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from billing.exports import INVOICE_EXPORT_COLUMNS
+from billing.models import Plan, Subscription, Invoice
+from billing.renderers import FastJSONRenderer, FastJSONParser, orjson
+from billing.serializers import InvoiceSerializer
+
+def sample_invoices(count):
+    # Unsaved instances, so no database is needed
+    user = User(id=1, username='bench', email='bench@example.com')
+    plan = Plan(id=1, name='pro', price=Decimal('19.99'), description='Pro plan')
+    now = timezone.now()
+    subscription = Subscription(id=1, user=user, plan=plan, start_date=date(2026, 1, 1), end_date=date(2026, 12, 31),
+                                status='active', created_at=now, updated_at=now)
+    return [
+        Invoice(id=i, user=user, subscription=subscription, email=user.email, amount=plan.price,
+                issue_date=date(2026, 1, 1) + timedelta(days=i), due_date=date(2026, 1, 16) + timedelta(days=i),
+                billing_period=date(2026, 1, 1) + timedelta(days=i), status='paid' if i % 3 else 'pending',
+                created_at=now, updated_at=now)
+        for i in range(1, count + 1)
+    ]
+
+def api_page(invoices):
+    return {'count': 1000, 'next': 'http://localhost/api/invoices/?page=2', 'previous': None,
+            'results': InvoiceSerializer(invoices, many=True).data}
+
+def raw_rows(invoices):
+    return [
+        dict(zip(INVOICE_EXPORT_COLUMNS, (
+            invoice.id, invoice.uuid, invoice.user_id, invoice.email, invoice.subscription_id, 'pro', invoice.amount,
+            invoice.issue_date, invoice.due_date, invoice.billing_period, invoice.status, invoice.created_at,
+        )))
+        for invoice in invoices
+    ]
+
+def measure(func, iterations):
+    func()  # warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    print(f"orjson {'installed' if orjson else 'not installed (fast classes fall back to the stdlib)'}")
+    print(f"{'payload':<26} {'DRF (us)':>10} {'fast (us)':>10} {'speedup':>8} {'bytes':>9} {'same':>5}")
+    for size in (20, 100):
+        invoices = sample_invoices(size)
+        for label, data in [(f'api page x{size}', api_page(invoices)), (f'raw rows x{size}', raw_rows(invoices))]:
+            before_bytes, after_bytes = JSONRenderer().render(data), FastJSONRenderer().render(data)
+            before = measure(lambda: JSONRenderer().render(data), iterations)
+            after = measure(lambda: FastJSONRenderer().render(data), iterations)
+            print(f"{'encode ' + label:<26} {before:>10.1f} {after:>10.1f} {before / after:>7.2f}x "
+                  f"{len(after_bytes):>9} {str(before_bytes == after_bytes):>5}")
+
+            before = measure(lambda: JSONParser().parse(BytesIO(before_bytes)), iterations)
+            after = measure(lambda: FastJSONParser().parse(BytesIO(before_bytes)), iterations)
+            print(f"{'decode ' + label:<26} {before:>10.1f} {after:>10.1f} {before / after:>7.2f}x {len(before_bytes):>9} {'':>5}")
+
+if __name__ == '__main__':
+    main()
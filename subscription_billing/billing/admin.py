@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Plan, Subscription, Invoice
+from django.db import transaction
+from .models import Plan, Subscription, SubscriptionChange, Invoice, BillingRun, EmailOutbox, RevenueRollup, MrrSnapshot, UserBillingStats
+from .rollups import record_invoices_created, record_invoices_deleted
+from .stats import record_subscriptions_created, record_subscriptions_deleted
 
 @admin.register(Plan)
 class PlanAdmin(admin.ModelAdmin):
@@ -8,7 +11,7 @@ class PlanAdmin(admin.ModelAdmin):
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
-    list_display = ('user', 'email', 'plan', 'start_date', 'end_date', 'status')
+    list_display = ('user', 'email', 'plan', 'start_date', 'end_date', 'next_billing_date', 'status', 'cancelled_at')
     list_filter = ('status', 'plan')
     search_fields = ('user__username', 'user__email', 'email')
     date_hierarchy = 'start_date'
@@ -18,11 +21,30 @@ class SubscriptionAdmin(admin.ModelAdmin):
         # Ensure email is auto-populated when saving through admin
         if not obj.email and obj.user and obj.user.email:
             obj.email = obj.user.email
-        super().save_model(request, obj, form, change)
+        with transaction.atomic():
+            if change:
+                # The user or the status may have been edited, so the stored
+                # subscription is taken out of the stats and the edited one added back
+                record_subscriptions_deleted(Subscription.objects.select_for_update().filter(pk=obj.pk))
+            super().save_model(request, obj, form, change)
+            record_subscriptions_created([obj])
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            # The subscription's invoices go with it
+            record_invoices_deleted(obj.invoices.all())
+            record_subscriptions_deleted([obj])
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            record_invoices_deleted(Invoice.objects.filter(subscription__in=queryset))
+            record_subscriptions_deleted(queryset)
+            super().delete_queryset(request, queryset)
 
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
-    list_display = ('uuid', 'user', 'email', 'amount', 'issue_date', 'due_date', 'status')
+    list_display = ('uuid', 'user', 'email', 'amount', 'issue_date', 'due_date', 'billing_period', 'status')
     list_filter = ('status',)
     search_fields = ('user__username', 'user__email', 'email', 'uuid')
     date_hierarchy = 'issue_date'
@@ -33,4 +55,58 @@ class InvoiceAdmin(admin.ModelAdmin):
         # Ensure email is auto-populated when saving through admin
         if not obj.email and obj.user and obj.user.email:
             obj.email = obj.user.email
-        super().save_model(request, obj, form, change)
+        with transaction.atomic():
+            if change:
+                # Any of the rollup and stats keys may have been edited, so the
+                # stored invoice is taken out and the edited one added back
+                record_invoices_deleted(Invoice.objects.select_for_update().filter(pk=obj.pk))
+            super().save_model(request, obj, form, change)
+            record_invoices_created([obj])
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            record_invoices_deleted([obj])
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            record_invoices_deleted(queryset)
+            super().delete_queryset(request, queryset)
+
+@admin.register(BillingRun)
+class BillingRunAdmin(admin.ModelAdmin):
+    list_display = ('billing_date', 'scope', 'status', 'last_subscription_id', 'invoices_created', 'emails_sent', 'started_at', 'completed_at')
+    list_filter = ('status',)
+    date_hierarchy = 'billing_date'
+    readonly_fields = ('started_at', 'updated_at', 'completed_at')
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('created_at', 'sent_at')
+
+@admin.register(RevenueRollup)
+class RevenueRollupAdmin(admin.ModelAdmin):
+    list_display = ('month', 'plan', 'status', 'invoice_count', 'amount', 'updated_at')
+    list_filter = ('status', 'plan')
+    date_hierarchy = 'month'
+    readonly_fields = ('updated_at',)
+
+@admin.register(MrrSnapshot)
+class MrrSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('date', 'plan', 'active_subscriptions', 'mrr', 'new_mrr', 'expansion_mrr', 'churned_mrr')
+    list_filter = ('plan',)
+    date_hierarchy = 'date'
+
+@admin.register(SubscriptionChange)
+class SubscriptionChangeAdmin(admin.ModelAdmin):
+    list_display = ('subscription', 'changed_at', 'old_plan', 'new_plan', 'old_status', 'new_status')
+    list_filter = ('new_status', 'new_plan')
+    date_hierarchy = 'changed_at'
+
+@admin.register(UserBillingStats)
+class UserBillingStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'active_subscriptions', 'pending_invoices', 'overdue_invoices', 'outstanding_amount', 'updated_at')
+    search_fields = ('user__username', 'user__email')
+    readonly_fields = ('updated_at',)
@@ -0,0 +1,166 @@
+from django.core.paginator import InvalidPage, Paginator
+from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from functools import wraps
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from .authentication import CachedJWTAuthentication
+from .catalog import plan_catalog
+from .models import Subscription, Invoice
+from .serializers import plan_data, subscription_data, invoice_data
+
+# Async (ASGI) versions of the hot read endpoints, mounted under /api/async/.
+#
+# Responses match the DRF endpoints field for field (they are built by the same
+# representation functions), but the views are native coroutines using the async
+# ORM, so a request waiting on the database does not hold a worker thread. Only
+# GET is served; writes stay on the DRF endpoints.
+
+_jwt = CachedJWTAuthentication()
+
+def _error(detail, status, headers=None):
+    return JsonResponse({'detail': detail}, status=status, headers=headers)
+
+async def authenticate(request):
+    """
+    The user a request is authenticated as: a Bearer access token, else the session
+
+    Token validation is pure computation and the user usually comes from the
+    cache; a cache miss reads it through the async ORM.
+
+    Returns:
+        User: The user, or None if the request is anonymous
+
+    Raises:
+        AuthenticationFailed: If a Bearer token is present but invalid, or its
+            user is not found or inactive
+    """
+    header = _jwt.get_header(request)
+    if header is not None:
+        raw_token = _jwt.get_raw_token(header)
+        if raw_token is not None:
+            return await _jwt.aget_user(_jwt.get_validated_token(raw_token))
+
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+def async_api_view(login_required=True):
+    """
+    Decorator for async GET endpoints: method check and authentication, with the
+    same status codes and error bodies as the DRF views
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return _error(f'Method "{request.method}" not allowed.', 405, {'Allow': 'GET, HEAD'})
+            try:
+                request.api_user = await authenticate(request)
+            except AuthenticationFailed as e:
+                body = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+                return JsonResponse(body, status=401, headers={'WWW-Authenticate': 'Bearer realm="api"'})
+            if login_required and request.api_user is None:
+                return _error('Authentication credentials were not provided.', 401, {'WWW-Authenticate': 'Bearer realm="api"'})
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def _page_links(request, page_number, has_next):
+    url = request.build_absolute_uri()
+    next_url = replace_query_param(url, 'page', page_number + 1) if has_next else None
+    previous_url = None
+    if page_number > 1:
+        previous_url = remove_query_param(url, 'page') if page_number == 2 else replace_query_param(url, 'page', page_number - 1)
+    return next_url, previous_url
+
+def _page_size():
+    # Whatever the DRF endpoints page with, so both return the same pages
+    return api_settings.DEFAULT_PAGINATION_CLASS.page_size
+
+def _page_number(request):
+    value = request.GET.get('page', 1)
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise InvalidPage(value)
+    if number < 1:
+        raise InvalidPage(value)
+    return number
+
+async def _paginated(request, queryset, represent):
+    """
+    PageNumberPagination's response for a queryset: one COUNT, then one page read
+    """
+    size = _page_size()
+    try:
+        number = _page_number(request)
+    except InvalidPage:
+        return _error('Invalid page.', 404)
+    count = await queryset.acount()
+    if number > 1 and (number - 1) * size >= count:
+        return _error('Invalid page.', 404)
+    offset = (number - 1) * size
+    results = [represent(item) async for item in queryset[offset:offset + size]]
+    next_url, previous_url = _page_links(request, number, offset + size < count)
+    return JsonResponse({'count': count, 'next': next_url, 'previous': previous_url, 'results': results})
+
+def _subscriptions(user):
+    return Subscription.objects.filter(user=user).select_related('plan').order_by('id')
+
+def _invoices(user):
+    return Invoice.objects.filter(user=user).select_related('subscription__plan').order_by('id')
+
+@async_api_view(login_required=False)
+async def plan_list(request):
+    catalog = await sync_to_async(plan_catalog)()
+    paginator = Paginator(catalog['plans'], _page_size())
+    try:
+        page = paginator.page(_page_number(request))
+    except InvalidPage:
+        return _error('Invalid page.', 404)
+    next_url, previous_url = _page_links(request, page.number, page.has_next())
+    return JsonResponse({
+        'count': paginator.count,
+        'next': next_url,
+        'previous': previous_url,
+        'results': [plan_data(plan) for plan in page.object_list],
+    })
+
+@async_api_view()
+async def subscription_list(request):
+    return await _paginated(request, _subscriptions(request.api_user), subscription_data)
+
+@async_api_view()
+async def subscription_detail(request, pk):
+    subscription = await _subscriptions(request.api_user).filter(pk=pk).afirst()
+    if subscription is None:
+        return _error('No Subscription matches the given query.', 404)
+    return JsonResponse(subscription_data(subscription))
+
+@async_api_view()
+async def invoice_list(request):
+    return await _paginated(request, _invoices(request.api_user), invoice_data)
+
+@async_api_view()
+async def invoice_detail(request, pk):
+    invoice = await _invoices(request.api_user).filter(pk=pk).afirst()
+    if invoice is None:
+        return _error('No Invoice matches the given query.', 404)
+    return JsonResponse(invoice_data(invoice))
+
+@async_api_view()
+async def pending_invoices(request):
+    queryset = _invoices(request.api_user).filter(status='pending')
+    return JsonResponse([invoice_data(invoice) async for invoice in queryset], safe=False)
+
+@async_api_view()
+async def profile(request):
+    user = request.api_user
+    return JsonResponse({
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+    })
@@ -0,0 +1,269 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch, get_md5_hash_password
+from datetime import timedelta
+import atexit
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_KEY = 'billing:auth:user:{user_id}'
+BLACKLIST_VERSION_KEY = 'billing:auth:blacklist-version'
+# Blacklist rows are reloaded from slightly before the previous load, so a row
+# committed a little after its blacklisted_at timestamp is not missed
+BLACKLIST_OVERLAP = timedelta(minutes=1)
+
+def shared_cache():
+    """
+    Whether the default cache is shared by every process (Redis, Memcached, ...)
+    rather than kept in this process's memory
+    """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+# Users
+
+def _user_cache_key(user_id):
+    return USER_CACHE_KEY.format(user_id=user_id)
+
+def cached_user(user_id):
+    """
+    The user with this id, cached for AUTH_USER_CACHE_TIMEOUT seconds and dropped when the user is saved
+
+    Returns:
+        User: The user, or None if there is none
+    """
+    key = _user_cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        User = get_user_model()
+        user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is not None:
+            cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+    return user
+
+async def acached_user(user_id):
+    """
+    cached_user for async views, through the async cache and ORM
+    """
+    key = _user_cache_key(user_id)
+    user = await cache.aget(key)
+    if user is None:
+        User = get_user_model()
+        user = await User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).afirst()
+        if user is not None:
+            await cache.aset(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+    return user
+
+def invalidate_cached_user(user_id):
+    cache.delete(_user_cache_key(user_id))
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication resolving the token's user from the cache instead of a
+    SELECT per request
+
+    The checks are JWTAuthentication's: the user must exist, be active and, with
+    CHECK_REVOKE_TOKEN, still have the password the token was issued for. Saving
+    or deleting a user drops their entry, so with a shared cache deactivation and
+    password changes apply on the next request. With the per-process LocMem cache
+    only the saving process drops it, and other processes (like changes made
+    without save()) apply them within AUTH_USER_CACHE_TIMEOUT.
+    """
+    def get_user(self, validated_token):
+        return self._check_user(cached_user(self._user_id(validated_token)), validated_token)
+
+    async def aget_user(self, validated_token):
+        return self._check_user(await acached_user(self._user_id(validated_token)), validated_token)
+
+    def _user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+    def _check_user(self, user, validated_token):
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
+
+# Blacklisted refresh tokens
+
+def bump_blacklist_version():
+    """
+    Tell every process's BlacklistedJTIs that a token was blacklisted
+    """
+    cache.set(BLACKLIST_VERSION_KEY, uuid.uuid4().hex, None)
+
+class BlacklistedJTIs:
+    """
+    In-memory copy of the unexpired blacklisted token JTIs, topped up from the
+    database at most every AUTH_BLACKLIST_REFRESH_INTERVAL seconds
+
+    Only rows blacklisted since the previous load are read, and expired JTIs are
+    dropped. Tokens blacklisted in this process are added immediately. With a
+    shared cache, a version changed whenever any process blacklists a token
+    makes the set reload as soon as it differs from the one it was loaded at (or
+    is missing), so a check costs a cache read. With a per-process cache, tokens
+    blacklisted by other processes are seen after the next periodic reload.
+    """
+    def __init__(self):
+        self._jtis = {}  # jti -> expires_at
+        self._lock = threading.Lock()
+        self._loaded_at = None  # time.monotonic() of the last load
+        self._since = None  # blacklisted_at to reload from
+        self._version = None  # BLACKLIST_VERSION_KEY value the last load saw
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and self._loaded_at is not None and time.monotonic() - self._loaded_at < settings.AUTH_BLACKLIST_REFRESH_INTERVAL:
+                return
+            # Read before the rows, so a blacklisting between the two reloads again
+            version = self._current_version() if shared_cache() else None
+            now = timezone.now()
+            rows = BlacklistedToken.objects.filter(token__expires_at__gt=now)
+            if self._since is not None:
+                rows = rows.filter(blacklisted_at__gte=self._since)
+            jtis = {jti: expires_at for jti, expires_at in rows.values_list('token__jti', 'token__expires_at').order_by()}
+            self._jtis = {jti: expires_at for jti, expires_at in self._jtis.items() if expires_at > now}
+            self._jtis.update(jtis)
+            self._loaded_at = time.monotonic()
+            self._since = now - BLACKLIST_OVERLAP
+            self._version = version
+
+    def _current_version(self):
+        version = cache.get(BLACKLIST_VERSION_KEY)
+        if version is None:
+            # Evicted or never set: start one, so later checks compare against it
+            cache.add(BLACKLIST_VERSION_KEY, uuid.uuid4().hex, None)
+            version = cache.get(BLACKLIST_VERSION_KEY)
+        return version
+
+    def add(self, jti, expires_at):
+        with self._lock:
+            self._jtis[jti] = expires_at
+
+    def clear(self):
+        with self._lock:
+            self._jtis = {}
+            self._loaded_at = self._since = self._version = None
+
+    def __contains__(self, jti):
+        self.refresh()
+        if jti not in self._jtis and shared_cache() and cache.get(BLACKLIST_VERSION_KEY) != self._version:
+            self.refresh(force=True)
+        return jti in self._jtis
+
+blacklisted_jtis = BlacklistedJTIs()
+
+class CachedRefreshToken(RefreshToken):
+    """
+    RefreshToken checked against BlacklistedJTIs rather than with a query
+    """
+    def check_blacklist(self):
+        if self.payload[api_settings.JTI_CLAIM] in blacklisted_jtis:
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        blacklisted = super().blacklist()
+        blacklisted_jtis.add(self.payload[api_settings.JTI_CLAIM], datetime_from_epoch(self.payload['exp']))
+        return blacklisted
+
+class CachedTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    TOKEN_REFRESH_SERIALIZER checking the blacklist in memory
+    """
+    token_class = CachedRefreshToken
+
+# Last logins
+
+class LastLoginBatch:
+    """
+    Last-login times buffered in memory and written with one UPDATE per batch
+
+    A batch is written once LAST_LOGIN_BATCH_SIZE users have logged in, by a
+    timer thread LAST_LOGIN_FLUSH_INTERVAL seconds after its first login (so a
+    quiet process does not hold it until the next login), and at exit. A user
+    logging in twice in a batch is written once, with the later time.
+    """
+    def __init__(self):
+        self._pending = {}  # user id -> last login
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def record(self, user, when=None):
+        with self._lock:
+            if not self._pending:
+                self._timer = threading.Timer(settings.LAST_LOGIN_FLUSH_INTERVAL, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+            self._pending[user.pk] = when or timezone.now()
+            due = len(self._pending) >= settings.LAST_LOGIN_BATCH_SIZE
+        if due:
+            self.flush()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not write buffered last logins")
+        finally:
+            # Database connections are per thread; close the one this timer opened
+            connections.close_all()
+
+    def flush(self):
+        """
+        Write the buffered last logins
+
+        Returns:
+            int: Number of users updated
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            timer, self._timer = self._timer, None
+        if timer is not None and timer is not threading.current_thread():
+            timer.cancel()
+        if not pending:
+            return 0
+        User = get_user_model()
+        # A queryset update: no save() signals, so the cached users are kept
+        with transaction.atomic():
+            User.objects.bulk_update([User(pk=pk, last_login=when) for pk, when in pending.items()], ['last_login'])
+        return len(pending)
+
+last_logins = LastLoginBatch()
+
+def record_last_login(user):
+    """
+    Queue a last_login update for user if UPDATE_LAST_LOGIN is on
+    """
+    if api_settings.UPDATE_LAST_LOGIN:
+        last_logins.record(user)
+
+def _flush_at_exit():
+    try:
+        last_logins.flush()
+    except Exception:
+        logger.exception("Could not write buffered last logins at exit")
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.cache import cache
+import hashlib
+from .models import Plan
+
+CACHE_KEY = 'billing:plans:catalog'
+
+def _build_catalog():
+    plans = list(Plan.objects.order_by('id'))
+    fingerprint = hashlib.sha1(
+        repr([(plan.id, plan.name, str(plan.price), plan.description, plan.updated_at) for plan in plans]).encode()
+    ).hexdigest()
+    return {
+        'plans': plans,
+        'by_id': {plan.id: plan for plan in plans},
+        'etag': f'"{fingerprint}"',
+        'last_modified': max((plan.updated_at for plan in plans), default=None),
+    }
+
+def plan_catalog():
+    """
+    Every plan, cached for PLAN_CATALOG_TIMEOUT seconds and dropped whenever a plan changes
+
+    Plans change rarely and are read on every page load and subscribe, so the
+    catalog is built with one query and then served from the cache. Without a
+    shared cache configured this is Django's per-process local-memory cache;
+    other processes then see a change once their copy times out.
+
+    Returns:
+        dict: plans (ordered by id), by_id, etag and last_modified
+    """
+    catalog = cache.get(CACHE_KEY)
+    if catalog is None:
+        catalog = _build_catalog()
+        cache.set(CACHE_KEY, catalog, settings.PLAN_CATALOG_TIMEOUT)
+    return catalog
+
+def get_plan(plan_id):
+    """
+    The Plan with this id from the catalog
+
+    Raises:
+        Plan.DoesNotExist: If there is no such plan
+    """
+    try:
+        return plan_catalog()['by_id'][int(plan_id)]
+    except (KeyError, TypeError, ValueError):
+        raise Plan.DoesNotExist(f"Plan {plan_id} does not exist")
+
+def invalidate_plan_catalog():
+    cache.delete(CACHE_KEY)
@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from datetime import date
+import csv
+
+INVOICE_EXPORT_FIELDS = (
+    'id', 'uuid', 'user_id', 'email', 'subscription_id', 'subscription__plan__name',
+    'amount', 'issue_date', 'due_date', 'billing_period', 'status', 'created_at',
+)
+# Column names as they appear in the export
+INVOICE_EXPORT_COLUMNS = (
+    'id', 'uuid', 'user_id', 'email', 'subscription_id', 'plan',
+    'amount', 'issue_date', 'due_date', 'billing_period', 'status', 'created_at',
+)
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+class _Echo:
+    """
+    File-like object whose write() returns the value, so csv.writer rows can be yielded
+    """
+    def write(self, value):
+        return value
+
+def filter_invoices(queryset, params):
+    """
+    Apply the export filters from query params: `from`/`to` issue dates and `status`
+
+    Raises:
+        ValueError: If a date or status is invalid
+    """
+    if params.get('from'):
+        queryset = queryset.filter(issue_date__gte=date.fromisoformat(params['from']))
+    if params.get('to'):
+        queryset = queryset.filter(issue_date__lte=date.fromisoformat(params['to']))
+    if params.get('status'):
+        statuses = params['status'].split(',')
+        valid = {choice for choice, _ in queryset.model.STATUS_CHOICES}
+        if not set(statuses) <= valid:
+            raise ValueError(f"status must be one of {', '.join(sorted(valid))}")
+        queryset = queryset.filter(status__in=statuses)
+    return queryset
+
+def iter_invoice_rows(queryset, chunk_size=None):
+    """
+    Stream invoice rows as tuples of INVOICE_EXPORT_FIELDS in (issue_date, id) order
+
+    Rows are read one keyset page at a time: each page resumes strictly after the
+    last (issue_date, id) seen, so no OFFSET or COUNT is ever run and memory stays
+    bounded by chunk_size however many invoices match.
+
+    Args:
+        queryset: Filtered Invoice queryset
+        chunk_size (int, optional): Rows per page. Defaults to INVOICE_EXPORT_CHUNK_SIZE.
+
+    Yields:
+        tuple: One invoice's values
+    """
+    chunk_size = chunk_size or settings.INVOICE_EXPORT_CHUNK_SIZE
+    queryset = queryset.order_by('issue_date', 'id').values_list(*INVOICE_EXPORT_FIELDS)
+    issue_date_index = INVOICE_EXPORT_FIELDS.index('issue_date')
+
+    page = queryset
+    while True:
+        rows = 0
+        for last in page[:chunk_size].iterator(chunk_size=chunk_size):
+            rows += 1
+            yield last
+        if rows < chunk_size:
+            # A short page is the last one
+            return
+        last_date, last_id = last[issue_date_index], last[0]
+        page = queryset.filter(Q(issue_date__gt=last_date) | Q(issue_date=last_date, id__gt=last_id))
+
+def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(INVOICE_EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+def _jsonl_lines(rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(INVOICE_EXPORT_COLUMNS, row))) + '\n'
+
+def invoice_export_response(queryset, output, filename):
+    """
+    StreamingHttpResponse exporting the invoices in queryset as CSV or JSON Lines
+
+    Args:
+        queryset: Filtered Invoice queryset
+        output (str): 'csv' or 'jsonl'
+        filename (str): Download name, without extension
+
+    Returns:
+        StreamingHttpResponse: The streamed attachment
+    """
+    lines = _csv_lines if output == 'csv' else _jsonl_lines
+    response = StreamingHttpResponse(lines(iter_invoice_rows(queryset)), content_type=EXPORT_FORMATS[output])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{output}"'
+    return response
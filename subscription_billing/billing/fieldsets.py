@@ -0,0 +1,166 @@
+from django.db import models
+from rest_framework.exceptions import ValidationError
+from .pagination import KeysetPagination
+from .serializers import PlanSerializer, SubscriptionSerializer, InvoiceSerializer, _date, _datetime, _decimal
+
+# Sparse fieldsets
+#
+# `?fields=uuid,amount,status` limits a response to those fields and
+# `?expand=subscription.plan` embeds the named relations. When either is given,
+# nested objects are only included if expanded, and the queryset selects just the
+# columns and joins the response needs. Without them responses are unchanged.
+
+class Resource:
+    """
+    A serializer's fields split into plain columns and expandable relations
+    """
+    def __init__(self, serializer, relations=None):
+        self.model = serializer.Meta.model
+        # relation name -> (response key, resource name)
+        self.relations = relations or {}
+        keys = {key for key, _ in self.relations.values()}
+        self.order = list(serializer.Meta.fields)
+        self.fields = [name for name in self.order if name not in keys]
+
+RESOURCES = {
+    'plan': Resource(PlanSerializer),
+    'subscription': Resource(SubscriptionSerializer, {'plan': ('plan_details', 'plan')}),
+    'invoice': Resource(InvoiceSerializer, {'subscription': ('subscription_details', 'subscription')}),
+}
+
+def _converter(field):
+    # The same formatting as the serializers' fields, DateTimeField before its DateField base
+    if isinstance(field, models.DateTimeField):
+        return _datetime
+    if isinstance(field, models.DateField):
+        return _date
+    if isinstance(field, models.DecimalField):
+        return _decimal
+    if isinstance(field, models.UUIDField):
+        return str
+    return None
+
+class Fieldset:
+    """
+    The fields and expanded relations a request selected for one resource
+    """
+    def __init__(self, resource_name, fields=None, expand=None):
+        self.resource = RESOURCES[resource_name]
+        selected = set(fields if fields is not None else self.resource.fields)
+        expand = expand or {}
+        self.fields = [name for name in self.resource.fields if name in selected]
+        self.expand = {
+            relation: Fieldset(self.resource.relations[relation][1], expand=nested)
+            for relation, nested in expand.items()
+        }
+
+        # (response key, attribute, converter) in serializer order; an expanded
+        # relation's converter is its nested fieldset's represent
+        meta = self.resource.model._meta
+        keys = {key: relation for relation, (key, _) in self.resource.relations.items()}
+        self._plan = []
+        for name in self.resource.order:
+            if name in keys:
+                if keys[name] in self.expand:
+                    self._plan.append((name, keys[name], self.expand[keys[name]].represent))
+            elif name in selected:
+                field = meta.get_field(name)
+                self._plan.append((name, field.attname, _converter(field)))
+
+    def represent(self, instance):
+        data = {}
+        for key, attribute, convert in self._plan:
+            value = getattr(instance, attribute)
+            data[key] = convert(value) if convert and value is not None else value
+        return data
+
+    def select_related(self, prefix=''):
+        paths = []
+        for relation, fieldset in self.expand.items():
+            paths.append(prefix + relation)
+            paths += fieldset.select_related(f'{prefix}{relation}__')
+        return paths
+
+    def only(self, prefix=''):
+        # Deferred columns would cost a query per row, so everything represent() reads is listed
+        columns = [prefix + name for name in self.fields]
+        for relation, fieldset in self.expand.items():
+            columns.append(prefix + relation)
+            columns += fieldset.only(f'{prefix}{relation}__')
+        return columns
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def parse_fieldset(resource_name, fields=None, expand=None):
+    """
+    Build a Fieldset from `fields` and `expand` query parameter values
+
+    Args:
+        resource_name (str): 'plan', 'subscription' or 'invoice'
+        fields (str, optional): Comma-separated field names. Defaults to every field.
+        expand (str, optional): Comma-separated relations, dotted for nested ones
+            (e.g. 'subscription.plan')
+
+    Raises:
+        ValidationError: If a field or relation is unknown
+    """
+    resource = RESOURCES[resource_name]
+    errors = {}
+
+    names = _split(fields) if fields else None
+    if names is not None:
+        unknown = [name for name in names if name not in resource.fields]
+        if unknown:
+            errors['fields'] = f"Unknown field(s): {', '.join(unknown)}. Choose from: {', '.join(resource.fields)}."
+
+    tree = {}
+    for path in _split(expand or ''):
+        node, current = tree, resource
+        for relation in path.split('.'):
+            if relation not in current.relations:
+                errors['expand'] = f"Cannot expand {path!r}."
+                break
+            node = node.setdefault(relation, {})
+            current = RESOURCES[current.relations[relation][1]]
+
+    if errors:
+        raise ValidationError(errors)
+    return Fieldset(resource_name, names, tree)
+
+class SparseFieldsetMixin:
+    """
+    Viewset mixin applying `?fields=` / `?expand=` to fieldset_actions: the
+    serializers render the Fieldset found in their context, and filter_queryset
+    narrows the query to its columns and joins
+    """
+    fieldset_resource = None
+    fieldset_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Parsed once up front so a bad parameter is a 400 before any query
+        self.fieldset = None
+        params = request.query_params
+        if self.action in self.fieldset_actions and ('fields' in params or 'expand' in params):
+            self.fieldset = parse_fieldset(self.fieldset_resource, params.get('fields'), params.get('expand'))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fieldset'] = getattr(self, 'fieldset', None)
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fieldset = getattr(self, 'fieldset', None)
+        if fieldset is None:
+            return queryset
+        columns = fieldset.only()
+        if isinstance(self.paginator, KeysetPagination):
+            # The cursor is built from the last row's keyset columns
+            columns += [self.paginator.order_field, self.paginator.changes_field]
+        queryset = queryset.select_related(None)
+        related = fieldset.select_related()
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*columns)
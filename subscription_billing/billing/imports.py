@@ -0,0 +1,297 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import date, timedelta
+from io import StringIO
+from itertools import islice
+import csv
+import json
+import logging
+import time
+from .catalog import plan_catalog
+from .invoicing import INVOICE_DUE_DAYS
+from .models import Subscription, Invoice, EmailOutbox, next_billing_date_after
+from .rollups import record_invoices_created
+from .stats import record_subscriptions_created
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+SUBSCRIPTION_DAYS = 30
+
+def read_rows(stream, output):
+    """
+    Stream (line number, row dict) pairs from a CSV (with a header) or JSON Lines file
+
+    Raises:
+        ValueError: If a JSON line is not an object
+    """
+    if output == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {line_number}: invalid JSON ({e})")
+        if not isinstance(row, dict):
+            raise ValueError(f"Line {line_number}: expected a JSON object")
+        yield line_number, row
+
+def _user_map():
+    # username and email -> (id, email), read once; an email shared by several
+    # users maps to None so it cannot silently pick one of them
+    users = {}
+    emails = {}
+    for user_id, username, email in User.objects.values_list('id', 'username', 'email').iterator(chunk_size=10000):
+        users[username] = (user_id, email)
+        if email:
+            key = email.lower()
+            emails[key] = None if key in emails else (user_id, email)
+    return users, emails
+
+def _plan_map():
+    # Plan id or name -> Plan, from the cached catalog
+    plans = {}
+    names = {}
+    for plan in plan_catalog()['plans']:
+        plans[str(plan.id)] = plan
+        names[plan.name] = None if plan.name in names else plan
+    return plans, names
+
+def _parse_date(value, field):
+    try:
+        return date.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{field} must be a YYYY-MM-DD date, got {value!r}")
+
+class _Resolver:
+    """
+    Turns import rows into unsaved Subscriptions using in-memory user and plan maps
+    """
+    statuses = {choice for choice, _ in Subscription.STATUS_CHOICES}
+
+    def __init__(self):
+        self.users, self.emails = _user_map()
+        self.plans, self.plan_names = _plan_map()
+        self.today = timezone.localdate()
+        self.now = timezone.now()
+
+    def subscription(self, row):
+        key = str(row.get('user') or '').strip()
+        user = self.users.get(key) or self.emails.get(key.lower())
+        if not user:
+            raise ValueError(f"unknown or ambiguous user {key!r}")
+        plan_key = str(row.get('plan') or '').strip()
+        plan = self.plans.get(plan_key) or self.plan_names.get(plan_key)
+        if not plan:
+            raise ValueError(f"unknown or ambiguous plan {plan_key!r}")
+
+        start_date = _parse_date(row['start_date'], 'start_date') if row.get('start_date') else self.today
+        end_date = _parse_date(row['end_date'], 'end_date') if row.get('end_date') else start_date + timedelta(days=SUBSCRIPTION_DAYS)
+        if end_date < start_date:
+            raise ValueError("end_date is before start_date")
+        status = row.get('status') or 'active'
+        if status not in self.statuses:
+            raise ValueError(f"status must be one of {', '.join(sorted(self.statuses))}")
+
+        user_id, email = user
+        return Subscription(
+            user_id=user_id,
+            # bulk_create skips Subscription.save(), so do what it would
+            email=email or None,
+            plan=plan,
+            start_date=start_date,
+            end_date=end_date,
+            status=status,
+            # The first billing date on or after today (and after the signup
+            # period), as migration 0005 backfilled, so history is not back-billed
+            next_billing_date=next_billing_date_after(start_date, max(start_date, self.today - timedelta(days=1))),
+            cancelled_at=self.now if status == 'cancelled' else None,
+        )
+
+def _initial_invoice(subscription):
+    # The signup invoice perform_create would have issued
+    return Invoice(
+        user_id=subscription.user_id,
+        subscription=subscription,
+        plan=subscription.plan,
+        email=subscription.email,
+        amount=subscription.plan.price,
+        issue_date=subscription.start_date,
+        due_date=subscription.start_date + timedelta(days=INVOICE_DUE_DAYS),
+        billing_period=subscription.start_date,
+        status='pending'
+    )
+
+def _drop_existing(subscriptions):
+    """
+    Drop subscriptions whose (user, plan, start date) already exists, making reruns
+    after a partial import safe; one indexed query per chunk
+    """
+    if not subscriptions:
+        return subscriptions, 0
+    existing = set(
+        Subscription.objects.filter(
+            user_id__in={subscription.user_id for subscription in subscriptions},
+            start_date__in={subscription.start_date for subscription in subscriptions},
+        ).values_list('user_id', 'plan_id', 'start_date').order_by()
+    )
+    fresh = []
+    for subscription in subscriptions:
+        key = (subscription.user_id, subscription.plan_id, subscription.start_date)
+        if key not in existing:
+            existing.add(key)
+            fresh.append(subscription)
+    return fresh, len(subscriptions) - len(fresh)
+
+def _copy_value(value):
+    # PostgreSQL COPY text format: \N is NULL, backslash escapes for the separators
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def _reserve_ids(cursor, model, count):
+    table = model._meta.db_table
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)", [table, count]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def _copy_instances(cursor, instances):
+    """
+    Write model instances, ids already assigned, with a single COPY ... FROM STDIN
+    """
+    model = type(instances[0])
+    fields = model._meta.concrete_fields
+    buffer = StringIO()
+    for instance in instances:
+        values = [field.get_db_prep_save(field.pre_save(instance, True), connection) for field in fields]
+        buffer.write('\t'.join(_copy_value(value) for value in values) + '\n')
+
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    sql = f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN"
+    if hasattr(cursor, 'copy_expert'):
+        # psycopg2
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+    else:
+        # psycopg 3
+        with cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+
+def _write_with_copy(subscriptions):
+    with connection.cursor() as cursor:
+        for subscription, subscription_id in zip(subscriptions, _reserve_ids(cursor, Subscription, len(subscriptions))):
+            subscription.id = subscription_id
+        _copy_instances(cursor, subscriptions)
+
+        invoices = [_initial_invoice(subscription) for subscription in subscriptions if subscription.status == 'active']
+        if invoices:
+            for invoice, invoice_id in zip(invoices, _reserve_ids(cursor, Invoice, len(invoices))):
+                invoice.id = invoice_id
+            _copy_instances(cursor, invoices)
+    return invoices
+
+def _write_with_bulk_create(subscriptions, chunk_size):
+    Subscription.objects.bulk_create(subscriptions, batch_size=chunk_size)
+    invoices = [_initial_invoice(subscription) for subscription in subscriptions if subscription.status == 'active']
+    Invoice.objects.bulk_create(invoices, batch_size=chunk_size)
+    return invoices
+
+def _write_chunk(subscriptions, chunk_size, send_emails, use_copy):
+    with transaction.atomic():
+        if use_copy:
+            invoices = _write_with_copy(subscriptions)
+        else:
+            invoices = _write_with_bulk_create(subscriptions, chunk_size)
+        record_subscriptions_created(subscriptions)
+        record_invoices_created(invoices)
+        if send_emails:
+            # Confirmations go through the outbox like API signups, never inline
+            EmailOutbox.objects.bulk_create([
+                EmailOutbox(kind='subscription_confirmation', payload={'subscription_id': subscription.id})
+                for subscription in subscriptions
+            ], batch_size=chunk_size)
+    return invoices
+
+def import_subscriptions(rows, chunk_size=None, dry_run=False, send_emails=True, use_copy=None, on_chunk=None):
+    """
+    Create subscriptions, and an initial invoice for each active one, from import rows
+
+    Rows are dicts with `user` (username or email), `plan` (id or name) and
+    optional `start_date`, `end_date` (default start + 30 days) and `status`
+    (default active). Users and plans are resolved from maps read once up front,
+    and each chunk is written in one transaction: with COPY on PostgreSQL, with
+    bulk_create elsewhere. The revenue rollup and user stats are updated in the
+    same transaction and confirmation emails are queued in the outbox. Rows whose
+    user, plan and start date already exist are skipped, so an interrupted import
+    can simply be rerun.
+
+    Args:
+        rows: Iterable of (line number, row dict), e.g. from read_rows()
+        chunk_size (int, optional): Rows per transaction. Defaults to IMPORT_CHUNK_SIZE.
+        dry_run (bool): Validate and count without writing anything
+        send_emails (bool): Queue a subscription confirmation per created subscription
+        use_copy (bool, optional): Force the COPY path on or off. Defaults to on for PostgreSQL.
+        on_chunk (callable, optional): Called with each chunk's stats dict
+
+    Returns:
+        dict: rows, created, invoices, skipped, chunks, seconds and errors
+        (a list of (line number, message))
+    """
+    chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+    if use_copy is None:
+        use_copy = connection.vendor == 'postgresql'
+    stats = {'rows': 0, 'created': 0, 'invoices': 0, 'skipped': 0, 'chunks': 0, 'seconds': 0.0, 'errors': []}
+    started = time.monotonic()
+    resolver = _Resolver()
+
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        chunk_started = time.monotonic()
+        subscriptions = []
+        errors = []
+        for line_number, row in chunk:
+            try:
+                subscriptions.append(resolver.subscription(row))
+            except (KeyError, TypeError, ValueError) as e:
+                # TypeError: a JSON value of the wrong shape, such as a list
+                errors.append((line_number, str(e)))
+        subscriptions, skipped = _drop_existing(subscriptions)
+
+        if subscriptions and not dry_run:
+            invoice_count = len(_write_chunk(subscriptions, chunk_size, send_emails, use_copy))
+        else:
+            invoice_count = sum(1 for subscription in subscriptions if subscription.status == 'active')
+
+        chunk_stats = {
+            'chunk': stats['chunks'] + 1,
+            'rows': len(chunk),
+            'created': len(subscriptions),
+            'invoices': invoice_count,
+            'skipped': skipped,
+            'errors': errors,
+            'seconds': time.monotonic() - chunk_started,
+        }
+        for key in ('rows', 'created', 'invoices', 'skipped'):
+            stats[key] += chunk_stats[key]
+        stats['errors'] += errors
+        stats['chunks'] += 1
+        if on_chunk:
+            on_chunk(chunk_stats)
+
+    stats['seconds'] = time.monotonic() - started
+    logger.info(
+        f"{'Validated' if dry_run else 'Imported'} {stats['created']} subscriptions from {stats['rows']} rows "
+        f"({stats['skipped']} existing, {len(stats['errors'])} rejected) in {stats['seconds']:.2f}s"
+    )
+    return stats
@@ -0,0 +1,238 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Min, Max
+from django.utils import timezone
+from datetime import timedelta
+from functools import partial
+from itertools import islice
+import logging
+from .models import Subscription, Invoice, BillingRun
+from .rollups import record_invoices_created
+from .utils import build_invoice_created_email, send_email_batch
+
+logger = logging.getLogger(__name__)
+
+INVOICE_DUE_DAYS = 15
+
+class QueryCounter:
+    """
+    Context manager counting the SQL statements executed on the default connection
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._wrapper.__exit__(*exc_info)
+
+def due_subscriptions(billing_date, first_id=None, last_id=None):
+    """
+    Active subscriptions with a billing date on or before billing_date, ordered by id
+    This includes periods missed while the scheduler was down. Served by the
+    (status, next_billing_date) index, and user/plan are joined so no lazy lookups
+    happen per row
+    first_id/last_id optionally restrict the scan to an inclusive id range (one shard)
+    """
+    queryset = Subscription.objects.filter(
+        status='active',
+        next_billing_date__lte=billing_date,
+        end_date__gte=F('next_billing_date')
+    )
+    if first_id is not None:
+        queryset = queryset.filter(id__gte=first_id)
+    if last_id is not None:
+        queryset = queryset.filter(id__lte=last_id)
+    return queryset.select_related('user', 'plan').order_by('id')
+
+def shard_ranges(billing_date, shard_count=None, shard_size=None):
+    """
+    Split the id space of the subscriptions due on billing_date into contiguous ranges
+
+    Args:
+        billing_date (date): The billing day being sharded
+        shard_count (int, optional): Number of shards. Defaults to BILLING_SHARD_COUNT.
+        shard_size (int, optional): Ids per shard; takes precedence over shard_count.
+            Defaults to BILLING_SHARD_SIZE.
+
+    Returns:
+        list: (first_id, last_id) inclusive ranges, empty if nothing is due
+    """
+    shard_count = shard_count or settings.BILLING_SHARD_COUNT
+    shard_size = shard_size or settings.BILLING_SHARD_SIZE
+
+    bounds = due_subscriptions(billing_date).order_by().aggregate(first=Min('id'), last=Max('id'))
+    if bounds['first'] is None:
+        return []
+
+    span = bounds['last'] - bounds['first'] + 1
+    if not shard_size:
+        shard_size = -(-span // max(shard_count, 1))
+
+    return [
+        (first_id, min(first_id + shard_size - 1, bounds['last']))
+        for first_id in range(bounds['first'], bounds['last'] + 1, shard_size)
+    ]
+
+def build_invoice(subscription, billing_date):
+    """
+    Build (without saving) the invoice for one billing period of a subscription
+    """
+    return Invoice(
+        user=subscription.user,
+        subscription=subscription,
+        plan_id=subscription.plan_id,
+        # bulk_create skips Invoice.save(), so populate the email here
+        email=subscription.user.email or None,
+        amount=subscription.plan.price,
+        issue_date=billing_date,
+        due_date=billing_date + timedelta(days=INVOICE_DUE_DAYS),
+        billing_period=billing_date,
+        status='pending'
+    )
+
+def billing_dates(subscription, until, since=None):
+    """
+    Every billing date of a subscription from its next_billing_date up to `until`
+
+    Args:
+        subscription: The Subscription, with next_billing_date set
+        until (date): Last date to bill (inclusive), also capped at end_date
+        since (date, optional): Dates before this are passed over without billing
+
+    Returns:
+        tuple: (list of dates to bill, the next billing date after them)
+    """
+    dates = []
+    current = subscription.next_billing_date
+    while current <= until and current <= subscription.end_date:
+        if since is None or current >= since:
+            dates.append(current)
+        current = subscription.billing_date_after(current)
+    return dates, current
+
+def run_scope(first_id=None, last_id=None, since=None):
+    """
+    BillingRun scope label for a whole run or a shard's id range, plus any lower date bound
+    """
+    scope = 'all'
+    if first_id is not None or last_id is not None:
+        scope = f"{first_id or ''}-{last_id or ''}"
+    if since is not None:
+        scope = f"{scope} since {since.isoformat()}"
+    return scope
+
+def generate_invoices_for_date(billing_date, chunk_size=None, send_emails=True, first_id=None, last_id=None, since=None):
+    """
+    Generate invoices for every subscription due on or before billing_date
+
+    Billing dates missed while the scheduler was down are generated in the same
+    pass: each subscription gets one invoice per billing date between its
+    next_billing_date and billing_date, so recovering from an outage is a single
+    scan however many days were missed. `since` bounds how far back to bill.
+
+    Candidates are streamed from the database and written with one bulk insert per
+    chunk, so the run costs a fixed number of queries per chunk rather than per
+    subscription.
+
+    Progress is recorded in a BillingRun keyed by (billing_date, scope). Each chunk
+    commits its invoices together with the run's keyset checkpoint, so a rerun after
+    a crash resumes after the last committed subscription, and a rerun of a completed
+    run does nothing. Subscriptions that already have an invoice for the period are
+    skipped with one indexed lookup per chunk. Every processed subscription has its
+    next_billing_date advanced past billing_date, and the new invoices are added to
+    the revenue rollup, in the same transaction as its invoices.
+
+    Args:
+        billing_date (date): The last billing day to generate invoices for
+        chunk_size (int, optional): Rows per chunk. Defaults to BILLING_CHUNK_SIZE.
+        send_emails (bool): Send the invoice created email for each new invoice
+        first_id (int, optional): Lowest subscription id to bill (shard start)
+        last_id (int, optional): Highest subscription id to bill (shard end)
+        since (date, optional): Billing dates before this are skipped, not invoiced
+
+    Returns:
+        dict: invoices_created, emails_sent, skipped, chunks and queries counts for the run
+    """
+    chunk_size = chunk_size or settings.BILLING_CHUNK_SIZE
+    stats = {'invoices_created': 0, 'emails_sent': 0, 'skipped': 0, 'chunks': 0, 'queries': 0}
+
+    run, _ = BillingRun.objects.get_or_create(billing_date=billing_date, scope=run_scope(first_id, last_id, since))
+    if run.status == 'completed':
+        logger.info(f"{run} already completed, nothing to do")
+        return stats
+    if run.last_subscription_id:
+        logger.info(f"Resuming {run} after subscription {run.last_subscription_id}")
+
+    try:
+        rows = due_subscriptions(billing_date, first_id, last_id).filter(
+            id__gt=run.last_subscription_id
+        ).iterator(chunk_size=chunk_size)
+        while True:
+            with QueryCounter() as queries:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                with transaction.atomic():
+                    invoices, skipped = _bill_chunk(chunk, billing_date, since, chunk_size)
+                    BillingRun.objects.filter(pk=run.pk).update(
+                        last_subscription_id=chunk[-1].id,
+                        invoices_created=F('invoices_created') + len(invoices)
+                    )
+                    if send_emails:
+                        # Sent once the chunk and its checkpoint are committed
+                        transaction.on_commit(lambda invoices=invoices: _send_invoice_emails(invoices, stats))
+
+            stats['chunks'] += 1
+            stats['queries'] += queries.count
+            stats['invoices_created'] += len(invoices)
+            stats['skipped'] += skipped
+            logger.info(f"Chunk {stats['chunks']}: {len(chunk)} subscriptions, {len(invoices)} invoices created, {skipped} already billed, {queries.count} queries")
+    except Exception as e:
+        BillingRun.objects.filter(pk=run.pk).update(status='failed', error=str(e))
+        raise
+
+    BillingRun.objects.filter(pk=run.pk).update(
+        status='completed',
+        error='',
+        emails_sent=F('emails_sent') + stats['emails_sent'],
+        completed_at=timezone.now()
+    )
+    return stats
+
+def _bill_chunk(chunk, until, since, chunk_size):
+    periods = {}
+    for subscription in chunk:
+        periods[subscription.id], subscription.next_billing_date = billing_dates(subscription, until, since)
+
+    all_periods = [period for dates in periods.values() for period in dates]
+    billed = set()
+    if all_periods:
+        billed = set(Invoice.objects.filter(
+            subscription_id__in=list(periods),
+            billing_period__gte=min(all_periods),
+            billing_period__lte=until
+        ).values_list('subscription_id', 'billing_period'))
+
+    new_invoices = [
+        build_invoice(subscription, period)
+        for subscription in chunk
+        for period in periods[subscription.id]
+        if (subscription.id, period) not in billed
+    ]
+
+    invoices = Invoice.objects.bulk_create(new_invoices, batch_size=chunk_size)
+    record_invoices_created(invoices)
+    Subscription.objects.bulk_update(chunk, ['next_billing_date'], batch_size=chunk_size)
+    return invoices, len(all_periods) - len(new_invoices)
+
+def _send_invoice_emails(invoices, stats):
+    sent, _ = send_email_batch(partial(build_invoice_created_email, invoice) for invoice in invoices)
+    stats['emails_sent'] += sent
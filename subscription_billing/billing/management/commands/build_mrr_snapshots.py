@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from datetime import date
+from billing.mrr import build_mrr_snapshots
+
+class Command(BaseCommand):
+    help = 'Builds the daily MRR snapshots, continuing from the latest one or rebuilding from --since'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Rebuild snapshots from this date (YYYY-MM-DD), replacing existing ones')
+        parser.add_argument('--until', help='Last date to snapshot (YYYY-MM-DD). Defaults to yesterday.')
+
+    def handle(self, *args, **options):
+        try:
+            since = date.fromisoformat(options['since']) if options['since'] else None
+            until = date.fromisoformat(options['until']) if options['until'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        
+        if since and until and since > until:
+            raise CommandError('--since must not be after --until')
+        
+        days = build_mrr_snapshots(until=until, since=since)
+        
+        self.stdout.write(self.style.SUCCESS(f"Built {days} days of MRR snapshots"))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+import json
+from billing.analytics import compute_cohort_analytics
+
+class Command(BaseCommand):
+    help = 'Prints cohort retention, monthly churn and paid conversion computed from subscriptions and invoices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, help='Retention horizon in months. Defaults to ANALYTICS_COHORT_MONTHS.')
+        parser.add_argument('--json', action='store_true', help='Print the raw result as JSON')
+
+    def handle(self, *args, **options):
+        if options['months'] is not None and options['months'] < 1:
+            raise CommandError('--months must be at least 1')
+        
+        result = compute_cohort_analytics(options['months'])
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+        
+        self.stdout.write("Cohort retention (% of customers active N months after their first subscription)")
+        self.stdout.write('cohort   size  conv  ' + ' '.join(f'{offset:>5}' for offset in range(result['months'] + 1)))
+        for cohort, size, conversion, row in zip(result['cohorts'], result['sizes'], result['conversion'], result['retention']):
+            cells = ' '.join('    -' if value is None else f'{value * 100:5.1f}' for value in row)
+            self.stdout.write(f"{cohort} {size:>6} {conversion * 100:4.0f}%  {cells}")
+        
+        self.stdout.write('')
+        self.stdout.write('Monthly churn')
+        for month in result['churn']:
+            self.stdout.write(f"{month['month']}  {month['churned']:>6} of {month['active']:>6}  {month['rate'] * 100:5.2f}%")
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['customers']} customers, {result['paying_customers']} paying, computed in {result['seconds']}s"
+        ))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from datetime import date
+from billing.invoicing import generate_invoices_for_date
+
+class Command(BaseCommand):
+    help = 'Generates invoices for every billing date up to --until, catching up days missed by the scheduler'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Skip billing dates before this date (YYYY-MM-DD)')
+        parser.add_argument('--until', help='Last billing date to generate (YYYY-MM-DD). Defaults to today.')
+        parser.add_argument('--chunk-size', type=int, help='Subscriptions per bulk insert. Defaults to BILLING_CHUNK_SIZE.')
+        parser.add_argument('--no-emails', action='store_true', help='Do not send invoice created emails')
+
+    def handle(self, *args, **options):
+        try:
+            since = date.fromisoformat(options['since']) if options['since'] else None
+            until = date.fromisoformat(options['until']) if options['until'] else timezone.now().date()
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        
+        if since and since > until:
+            raise CommandError('--since must not be after --until')
+        
+        self.stdout.write(f"Generating invoices{f' from {since}' if since else ''} up to {until}")
+        stats = generate_invoices_for_date(
+            until,
+            chunk_size=options['chunk_size'],
+            send_emails=not options['no_emails'],
+            since=since
+        )
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {stats['invoices_created']} invoices ({stats['skipped']} already billed) "
+            f"in {stats['chunks']} chunks, {stats['queries']} queries, sent {stats['emails_sent']} emails"
+        ))
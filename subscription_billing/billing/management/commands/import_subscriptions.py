@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from pathlib import Path
+import sys
+from billing.imports import IMPORT_FORMATS, import_subscriptions, read_rows
+from billing.summaries import throughput
+
+class Command(BaseCommand):
+    help = 'Bulk imports subscriptions, with their initial invoices, from a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin. Columns: user (username or email), plan (id or name), start_date, end_date, status")
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Input format. Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, help='Rows per transaction. Defaults to IMPORT_CHUNK_SIZE.')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and count the rows without writing anything')
+        parser.add_argument('--no-emails', action='store_true', help='Do not queue subscription confirmation emails')
+        parser.add_argument('--no-copy', action='store_true', help='Use bulk_create even on PostgreSQL instead of COPY')
+        parser.add_argument('--max-errors', type=int, default=20, help='Rejected rows to list at the end')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        output = options['format'] or Path(path).suffix.lstrip('.').lower()
+        if output not in IMPORT_FORMATS:
+            raise CommandError(f"Cannot tell the format of {path}; pass --format {'|'.join(IMPORT_FORMATS)}")
+        
+        def report(chunk):
+            self.stdout.write(
+                f"Chunk {chunk['chunk']}: {chunk['rows']} rows, {chunk['created']} subscriptions, "
+                f"{chunk['invoices']} invoices, {chunk['skipped']} existing, {len(chunk['errors'])} rejected "
+                f"in {chunk['seconds']:.2f}s ({throughput(chunk['rows'], chunk['seconds']):.0f} rows/s)"
+            )
+        
+        self.stdout.write(f"{'Validating' if options['dry_run'] else 'Importing'} subscriptions from {path}")
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f"Cannot open {path}: {e}")
+        try:
+            stats = import_subscriptions(
+                read_rows(stream, output),
+                chunk_size=options['chunk_size'],
+                dry_run=options['dry_run'],
+                send_emails=not options['no_emails'],
+                use_copy=False if options['no_copy'] else None,
+                on_chunk=report
+            )
+        except ValueError as e:
+            raise CommandError(f"{e}. Chunks before it were committed; rerunning skips them.")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        
+        for line_number, message in stats['errors'][:options['max_errors']]:
+            self.stdout.write(self.style.WARNING(f"Line {line_number}: {message}"))
+        if len(stats['errors']) > options['max_errors']:
+            self.stdout.write(self.style.WARNING(f"... and {len(stats['errors']) - options['max_errors']} more rejected rows"))
+        
+        verb = 'Would create' if options['dry_run'] else 'Created'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats['created']} subscriptions and {stats['invoices']} invoices from {stats['rows']} rows "
+            f"({stats['skipped']} existing, {len(stats['errors'])} rejected) in {stats['chunks']} chunks, "
+            f"{stats['seconds']:.2f}s ({throughput(stats['rows'], stats['seconds']):.0f} rows/s)"
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from datetime import date
+from billing.rollups import rebuild_revenue_rollups
+
+class Command(BaseCommand):
+    help = 'Recomputes the RevenueRollup table from invoices, repairing any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Rebuild only this month (YYYY-MM). Defaults to every month.')
+
+    def handle(self, *args, **options):
+        month = None
+        if options['month']:
+            try:
+                month = date.fromisoformat(f"{options['month']}-01")
+            except ValueError as e:
+                raise CommandError(f'Invalid month: {e}')
+        
+        self.stdout.write(f"Rebuilding revenue rollups for {month:%B %Y}" if month else "Rebuilding revenue rollups for every month")
+        rows = rebuild_revenue_rollups(month)
+        
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} revenue rollup rows"))
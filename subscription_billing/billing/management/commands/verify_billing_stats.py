@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from billing.stats import verify_user_billing_stats
+
+class Command(BaseCommand):
+    help = 'Compares the UserBillingStats counters with subscriptions and invoices, optionally repairing drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Overwrite drifted rows with the computed values')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Users checked per batch of queries')
+
+    def handle(self, *args, **options):
+        drift = verify_user_billing_stats(repair=options['repair'], chunk_size=options['chunk_size'])
+        
+        for user_id, stored, actual in drift:
+            changed = ', '.join(f"{field} {stored[field]} -> {actual[field]}" for field in stored if stored[field] != actual[field])
+            self.stdout.write(f"User {user_id}: {changed}")
+        
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Billing stats match subscriptions and invoices"))
+        elif options['repair']:
+            self.stdout.write(self.style.SUCCESS(f"Repaired billing stats for {len(drift)} users"))
+        else:
+            self.stdout.write(self.style.WARNING(f"Billing stats drifted for {len(drift)} users; rerun with --repair to fix"))
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_billing_period(apps, schema_editor):
+    # Existing invoices cover the period they were issued for; when a subscription
+    # already has duplicates for a day only the first keeps the period so the
+    # unique constraint can be added.
+    Invoice = apps.get_model('billing', 'Invoice')
+    seen = set()
+    batch = []
+    for invoice in Invoice.objects.order_by('id').only('id', 'subscription_id', 'issue_date').iterator(chunk_size=1000):
+        key = (invoice.subscription_id, invoice.issue_date)
+        if key in seen:
+            continue
+        seen.add(key)
+        invoice.billing_period = invoice.issue_date
+        batch.append(invoice)
+        if len(batch) >= 1000:
+            Invoice.objects.bulk_update(batch, ['billing_period'])
+            batch = []
+    if batch:
+        Invoice.objects.bulk_update(batch, ['billing_period'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0003_subscription_email'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('billing_date', models.DateField()),
+                ('scope', models.CharField(default='all', help_text="'all' or the 'first_id-last_id' subscription range of a shard", max_length=50)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('last_subscription_id', models.BigIntegerField(default=0, help_text='Keyset checkpoint: last subscription id processed')),
+                ('invoices_created', models.PositiveIntegerField(default=0)),
+                ('emails_sent', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='billing_period',
+            field=models.DateField(blank=True, help_text='Billing date of the period this invoice covers', null=True),
+        ),
+        migrations.RunPython(backfill_billing_period, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='invoice',
+            constraint=models.UniqueConstraint(fields=('subscription', 'billing_period'), name='unique_invoice_per_billing_period'),
+        ),
+        migrations.AddConstraint(
+            model_name='billingrun',
+            constraint=models.UniqueConstraint(fields=('billing_date', 'scope'), name='unique_billing_run_per_scope'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:12
+
+from django.conf import settings
+from dateutil.relativedelta import relativedelta
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_next_billing_date(apps, schema_editor):
+    # Next date anchored on start_date that is on or after today and after the
+    # signup period, so a subscription whose billing day is today is still due.
+    Subscription = apps.get_model('billing', 'Subscription')
+    today = timezone.now().date()
+    batch = []
+    for subscription in Subscription.objects.order_by('id').only('id', 'start_date').iterator(chunk_size=1000):
+        start_date = subscription.start_date
+        months = max((today.year - start_date.year) * 12 + today.month - start_date.month, 1)
+        next_date = start_date + relativedelta(months=months)
+        if next_date < today:
+            next_date = start_date + relativedelta(months=months + 1)
+        subscription.next_billing_date = next_date
+        batch.append(subscription)
+        if len(batch) >= 1000:
+            Subscription.objects.bulk_update(batch, ['next_billing_date'])
+            batch = []
+    if batch:
+        Subscription.objects.bulk_update(batch, ['next_billing_date'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0004_billing_runs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='next_billing_date',
+            field=models.DateField(blank=True, help_text='Date the next recurring invoice is due', null=True),
+        ),
+        migrations.RunPython(backfill_next_billing_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['status', 'next_billing_date'], name='subscription_due_idx'),
+        ),
+    ]
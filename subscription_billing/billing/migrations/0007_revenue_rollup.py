@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def backfill_revenue_rollups(apps, schema_editor):
+    # Seed the rollup from existing invoices; from here on it is kept up to date
+    # as invoices are created and change status
+    Invoice = apps.get_model('billing', 'Invoice')
+    RevenueRollup = apps.get_model('billing', 'RevenueRollup')
+    totals = (
+        Invoice.objects.annotate(month=TruncMonth('issue_date'))
+        .values('month', 'subscription__plan_id', 'status')
+        .annotate(invoice_count=Count('id'), amount=Sum('amount'))
+        .order_by()
+    )
+    RevenueRollup.objects.bulk_create([
+        RevenueRollup(
+            month=row['month'],
+            plan_id=row['subscription__plan_id'],
+            status=row['status'],
+            invoice_count=row['invoice_count'],
+            amount=row['amount']
+        )
+        for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0006_email_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month the invoices were issued in')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('paid', 'Paid'), ('overdue', 'Overdue'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('invoice_count', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revenue_rollups', to='billing.plan')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('month', 'plan', 'status'), name='unique_revenue_rollup')],
+            },
+        ),
+        migrations.RunPython(backfill_revenue_rollups, migrations.RunPython.noop),
+    ]
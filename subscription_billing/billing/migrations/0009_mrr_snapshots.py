@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_cancelled_at(apps, schema_editor):
+    # Cancellation time was not recorded before; the last update is the best estimate
+    Subscription = apps.get_model('billing', 'Subscription')
+    Subscription.objects.filter(status='cancelled').update(cancelled_at=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0008_invoice_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MrrSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('price', models.DecimalField(decimal_places=2, help_text='Plan price on this day', max_digits=10)),
+                ('active_subscriptions', models.IntegerField(default=0)),
+                ('mrr', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('new_subscriptions', models.IntegerField(default=0)),
+                ('new_mrr', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('churned_subscriptions', models.IntegerField(default=0)),
+                ('churned_mrr', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expansion_mrr', models.DecimalField(decimal_places=2, default=0, help_text='MRR change not explained by new or churned subscriptions', max_digits=14)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='cancelled_at',
+            field=models.DateTimeField(blank=True, help_text='When the subscription was cancelled', null=True),
+        ),
+        migrations.RunPython(backfill_cancelled_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['start_date'], name='subscription_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['end_date'], name='subscription_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['cancelled_at'], name='subscription_cancelled_idx'),
+        ),
+        migrations.AddField(
+            model_name='mrrsnapshot',
+            name='plan',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mrr_snapshots', to='billing.plan'),
+        ),
+        migrations.AddConstraint(
+            model_name='mrrsnapshot',
+            constraint=models.UniqueConstraint(fields=('date', 'plan'), name='unique_mrr_snapshot'),
+        ),
+    ]
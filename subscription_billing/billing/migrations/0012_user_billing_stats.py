@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_user_billing_stats(apps, schema_editor):
+    # Seed one row per user with subscriptions or outstanding invoices; from here
+    # on the rows are kept up to date by the code that changes them
+    Subscription = apps.get_model('billing', 'Subscription')
+    Invoice = apps.get_model('billing', 'Invoice')
+    UserBillingStats = apps.get_model('billing', 'UserBillingStats')
+    stats = {}
+    for row in Subscription.objects.filter(status='active').values('user_id').annotate(count=Count('id')).order_by():
+        stats.setdefault(row['user_id'], UserBillingStats(user_id=row['user_id'])).active_subscriptions = row['count']
+    invoices = Invoice.objects.filter(status__in=['pending', 'overdue']).values('user_id').annotate(
+        pending=Count('id', filter=Q(status='pending')),
+        overdue=Count('id', filter=Q(status='overdue')),
+        amount=Sum('amount'),
+    ).order_by()
+    for row in invoices:
+        row_stats = stats.setdefault(row['user_id'], UserBillingStats(user_id=row['user_id']))
+        row_stats.pending_invoices = row['pending']
+        row_stats.overdue_invoices = row['overdue']
+        row_stats.outstanding_amount = row['amount']
+    UserBillingStats.objects.bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('billing', '0011_plan_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBillingStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='billing_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('active_subscriptions', models.IntegerField(default=0, help_text='Subscriptions with status active')),
+                ('pending_invoices', models.IntegerField(default=0)),
+                ('overdue_invoices', models.IntegerField(default=0)),
+                ('outstanding_amount', models.DecimalField(decimal_places=2, default=0, help_text='Total of pending and overdue invoices', max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'user billing stats',
+            },
+        ),
+        migrations.RunPython(backfill_user_billing_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0012_user_billing_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emailoutbox',
+            name='kind',
+            field=models.CharField(choices=[('subscription_confirmation', 'Subscription Confirmation'), ('payment_confirmation', 'Payment Confirmation'), ('bulk_payment_confirmation', 'Bulk Payment Confirmation')], max_length=50),
+        ),
+    ]
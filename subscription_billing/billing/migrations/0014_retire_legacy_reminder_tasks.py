@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.utils import timezone
+
+LEGACY_TASKS = (
+    'billing.tasks.send_payment_reminders',
+    'billing.tasks.send_unpaid_invoice_reminders',
+)
+LEGACY_NAMES = (
+    'send-payment-reminders-daily',
+    'send-unpaid-invoice-reminders-daily',
+)
+
+
+def delete_legacy_reminder_tasks(apps, schema_editor):
+    # The database scheduler keeps beat entries removed from settings, so the two
+    # reminder schedules replaced by send-daily-billing-notices are deleted here
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTasks = apps.get_model('django_celery_beat', 'PeriodicTasks')
+    legacy = PeriodicTask.objects.filter(task__in=LEGACY_TASKS) | PeriodicTask.objects.filter(name__in=LEGACY_NAMES)
+    deleted, _ = legacy.delete()
+    if deleted:
+        # Historical models send no signals, so tell running beat schedulers to reload
+        PeriodicTasks.objects.update_or_create(ident=1, defaults={'last_update': timezone.now()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0013_bulk_payment_confirmation'),
+        ('django_celery_beat', '0018_improve_crontab_helptext'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_legacy_reminder_tasks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def backfill_invoice_plan(apps, schema_editor):
+    # Existing invoices were billed at their subscription's plan as it is now,
+    # the best record there is of what they were billed for
+    Invoice = apps.get_model('billing', 'Invoice')
+    Subscription = apps.get_model('billing', 'Subscription')
+    Invoice.objects.filter(plan__isnull=True).update(
+        plan_id=Subquery(Subscription.objects.filter(pk=OuterRef('subscription_id')).values('plan_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0014_retire_legacy_reminder_tasks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='plan',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='invoices', to='billing.plan'),
+        ),
+        migrations.RunPython(backfill_invoice_plan, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='invoice',
+            name='plan',
+            field=models.ForeignKey(help_text='Plan billed, kept when the subscription later changes plan', on_delete=django.db.models.deletion.CASCADE, related_name='invoices', to='billing.plan'),
+        ),
+    ]
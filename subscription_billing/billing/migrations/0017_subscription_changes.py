@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_cancellations(apps, schema_editor):
+    # Cancellations are the only earlier transitions on record; plan moves were not kept
+    Subscription = apps.get_model('billing', 'Subscription')
+    SubscriptionChange = apps.get_model('billing', 'SubscriptionChange')
+    cancelled = Subscription.objects.filter(status='cancelled', cancelled_at__isnull=False).values_list('id', 'plan_id', 'cancelled_at')
+    SubscriptionChange.objects.bulk_create(
+        [
+            SubscriptionChange(subscription_id=pk, changed_at=cancelled_at, old_plan_id=plan_id, new_plan_id=plan_id, old_status='active', new_status='cancelled')
+            for pk, plan_id, cancelled_at in cancelled.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0016_outbox_sending_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriptionChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('old_status', models.CharField(choices=[('active', 'Active'), ('cancelled', 'Cancelled'), ('expired', 'Expired')], max_length=20)),
+                ('new_status', models.CharField(choices=[('active', 'Active'), ('cancelled', 'Cancelled'), ('expired', 'Expired')], max_length=20)),
+                ('new_plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='billing.plan')),
+                ('old_plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='billing.plan')),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='billing.subscription')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['changed_at'], name='subscription_change_at_idx'), models.Index(fields=['subscription', 'changed_at'], name='subscription_change_sub_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_cancellations, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='subscription',
+            name='subscription_cancelled_idx',
+        ),
+    ]
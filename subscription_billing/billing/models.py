@@ -1,8 +1,22 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
+from dateutil.relativedelta import relativedelta
+from datetime import datetime
 import uuid
 
+def next_billing_date_after(start_date, after):
+    """
+    First monthly billing date anchored on start_date that falls strictly after `after`
+    Dates are computed from the anchor, so a subscription started on the 31st is
+    billed on the last day of shorter months and back on the 31st afterwards
+    """
+    months = max((after.year - start_date.year) * 12 + after.month - start_date.month, 0)
+    candidate = start_date + relativedelta(months=months)
+    if candidate <= after:
+        candidate = start_date + relativedelta(months=months + 1)
+    return candidate
+
 class Plan(models.Model):
     PLAN_TYPES = (
         ('basic', 'Basic'),
@@ -13,6 +27,7 @@ class Plan(models.Model):
     name = models.CharField(max_length=50, choices=PLAN_TYPES)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     description = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return self.get_name_display()
@@ -30,21 +45,91 @@ class Subscription(models.Model):
     start_date = models.DateField(default=timezone.now)
     end_date = models.DateField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    next_billing_date = models.DateField(null=True, blank=True, help_text="Date the next recurring invoice is due")
+    cancelled_at = models.DateTimeField(null=True, blank=True, help_text="When the subscription was cancelled")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Serves the daily "due today" range scan of the invoice generator
+            models.Index(fields=['status', 'next_billing_date'], name='subscription_due_idx'),
+            # Serve the per-day starts and ends read by the MRR snapshot build
+            models.Index(fields=['start_date'], name='subscription_start_idx'),
+            models.Index(fields=['end_date'], name='subscription_end_idx'),
+            # Keyset order of the subscriptions API and its changes-since feed
+            models.Index(fields=['user', 'created_at', 'id'], name='subscription_user_created_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='subscription_user_updated_idx'),
+        ]
+    
     def save(self, *args, **kwargs):
         # Auto-populate email from user if not provided or empty
         if (not self.email or self.email.strip() == '') and self.user and self.user.email:
             self.email = self.user.email
+        # The signup invoice covers the start date, recurring billing starts a month later
+        if self.next_billing_date is None and self.start_date:
+            self.next_billing_date = self.billing_date_after(self.start_date)
+        # However the status changes (API cancel, PATCH, admin), cancelled_at marks
+        # when it became cancelled and is cleared on reactivation, for the cohort report
+        if self.status == 'cancelled' and self.cancelled_at is None:
+            self.cancelled_at = timezone.now()
+        elif self.status == 'active':
+            self.cancelled_at = None
         super().save(*args, **kwargs)
+        # Log plan and status moves with their time, so the MRR snapshots can
+        # place the subscription on the plan and status it had on any day
+        loaded = getattr(self, '_loaded', None)
+        if loaded and None not in loaded and loaded != (self.plan_id, self.status):
+            SubscriptionChange.objects.create(
+                subscription=self,
+                changed_at=self.cancelled_at if self.status == 'cancelled' and loaded[1] != 'cancelled' else timezone.now(),
+                old_plan_id=loaded[0],
+                new_plan_id=self.plan_id,
+                old_status=loaded[1],
+                new_status=self.status,
+            )
+        self._loaded = (self.plan_id, self.status)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Plan and status as stored, compared by save() to log changes
+        instance._loaded = (instance.__dict__.get('plan_id'), instance.__dict__.get('status'))
+        return instance
     
     def __str__(self):
         return f"{self.user.username} - {self.plan.name} ({self.status})"
     
+    def billing_date_after(self, after):
+        start_date = self.start_date
+        if isinstance(start_date, datetime):
+            start_date = timezone.localdate(start_date)
+        if isinstance(after, datetime):
+            after = timezone.localdate(after)
+        return next_billing_date_after(start_date, after)
+    
     def is_active(self):
         return self.status == 'active' and self.end_date >= timezone.now().date()
 
+class SubscriptionChange(models.Model):
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, related_name='changes')
+    changed_at = models.DateTimeField(default=timezone.now)
+    old_plan = models.ForeignKey(Plan, on_delete=models.CASCADE, related_name='+')
+    new_plan = models.ForeignKey(Plan, on_delete=models.CASCADE, related_name='+')
+    old_status = models.CharField(max_length=20, choices=Subscription.STATUS_CHOICES)
+    new_status = models.CharField(max_length=20, choices=Subscription.STATUS_CHOICES)
+    
+    class Meta:
+        indexes = [
+            # The per-day read of the MRR snapshot build
+            models.Index(fields=['changed_at'], name='subscription_change_at_idx'),
+            # A subscription's changes after a day, to know its plan and status on it
+            models.Index(fields=['subscription', 'changed_at'], name='subscription_change_sub_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Subscription {self.subscription_id} {self.changed_at:%Y-%m-%d %H:%M}: {self.old_plan_id}/{self.old_status} -> {self.new_plan_id}/{self.new_status}"
+
 class Invoice(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
@@ -56,18 +141,36 @@ class Invoice(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='invoices')
     subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, related_name='invoices')
+    plan = models.ForeignKey(Plan, on_delete=models.CASCADE, related_name='invoices', help_text="Plan billed, kept when the subscription later changes plan")
     email = models.EmailField(null=True, blank=True, help_text="Email address for invoice notifications")
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     issue_date = models.DateField(default=timezone.now)
     due_date = models.DateField()
+    billing_period = models.DateField(null=True, blank=True, help_text="Billing date of the period this invoice covers")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        constraints = [
+            # At most one invoice per subscription per billing period
+            models.UniqueConstraint(fields=['subscription', 'billing_period'], name='unique_invoice_per_billing_period'),
+        ]
+        indexes = [
+            # Keyset order of invoice exports, overall and per user
+            models.Index(fields=['issue_date', 'id'], name='invoice_issue_keyset_idx'),
+            models.Index(fields=['user', 'issue_date', 'id'], name='invoice_user_issue_keyset_idx'),
+            # Changes-since feed of the invoices API
+            models.Index(fields=['user', 'updated_at', 'id'], name='invoice_user_updated_idx'),
+        ]
+    
     def save(self, *args, **kwargs):
         # Auto-populate email from user if not provided or empty
         if (not self.email or self.email.strip() == '') and self.user and self.user.email:
             self.email = self.user.email
+        # Bill the subscription's current plan unless told otherwise
+        if self.plan_id is None and self.subscription_id:
+            self.plan_id = self.subscription.plan_id
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -75,3 +178,110 @@ class Invoice(models.Model):
     
     def is_overdue(self):
         return self.status == 'pending' and self.due_date < timezone.now().date()
+
+class BillingRun(models.Model):
+    STATUS_CHOICES = (
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    
+    billing_date = models.DateField()
+    scope = models.CharField(max_length=50, default='all', help_text="'all' or the 'first_id-last_id' subscription range of a shard")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    last_subscription_id = models.BigIntegerField(default=0, help_text="Keyset checkpoint: last subscription id processed")
+    invoices_created = models.PositiveIntegerField(default=0)
+    emails_sent = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['billing_date', 'scope'], name='unique_billing_run_per_scope'),
+        ]
+    
+    def __str__(self):
+        return f"Billing run {self.billing_date} [{self.scope}] ({self.status})"
+
+class EmailOutbox(models.Model):
+    KIND_CHOICES = (
+        ('subscription_confirmation', 'Subscription Confirmation'),
+        ('payment_confirmation', 'Payment Confirmation'),
+        ('bulk_payment_confirmation', 'Bulk Payment Confirmation'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES)
+    payload = models.JSONField(default=dict, help_text="Ids of the objects the email is rendered from")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, help_text="When a pending email is due; when a sending one was claimed")
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} email {self.id} ({self.status})"
+
+class RevenueRollup(models.Model):
+    month = models.DateField(help_text="First day of the month the invoices were issued in")
+    plan = models.ForeignKey(Plan, on_delete=models.CASCADE, related_name='revenue_rollups')
+    status = models.CharField(max_length=20, choices=Invoice.STATUS_CHOICES)
+    invoice_count = models.IntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'plan', 'status'], name='unique_revenue_rollup'),
+        ]
+    
+    def __str__(self):
+        return f"{self.month:%B %Y} {self.plan.name} {self.status}: {self.invoice_count} invoices, ${self.amount}"
+
+class UserBillingStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='billing_stats')
+    active_subscriptions = models.IntegerField(default=0, help_text="Subscriptions with status active")
+    pending_invoices = models.IntegerField(default=0)
+    overdue_invoices = models.IntegerField(default=0)
+    outstanding_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Total of pending and overdue invoices")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'user billing stats'
+    
+    def __str__(self):
+        return f"{self.user.username}: {self.active_subscriptions} active, {self.pending_invoices} pending, {self.overdue_invoices} overdue, ${self.outstanding_amount} outstanding"
+
+class MrrSnapshot(models.Model):
+    date = models.DateField()
+    plan = models.ForeignKey(Plan, on_delete=models.CASCADE, related_name='mrr_snapshots')
+    price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Plan price on this day")
+    active_subscriptions = models.IntegerField(default=0)
+    mrr = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    new_subscriptions = models.IntegerField(default=0)
+    new_mrr = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    churned_subscriptions = models.IntegerField(default=0)
+    churned_mrr = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expansion_mrr = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="MRR change not explained by new or churned subscriptions")
+    
+    class Meta:
+        constraints = [
+            # Also serves date range reads of the MRR series
+            models.UniqueConstraint(fields=['date', 'plan'], name='unique_mrr_snapshot'),
+        ]
+    
+    def __str__(self):
+        return f"MRR {self.date} {self.plan.name}: ${self.mrr} ({self.active_subscriptions} active)"
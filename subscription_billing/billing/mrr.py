@@ -0,0 +1,232 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BigIntegerField, Count, F, Min, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from datetime import date, datetime, time, timedelta
+import logging
+import numpy as np
+from .models import Plan, Subscription, SubscriptionChange, MrrSnapshot
+
+logger = logging.getLogger(__name__)
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+def _state_at_end_of(day):
+    # A subscription's plan and status at the end of `day` are the old values of
+    # its first later change, or its current ones when it has not changed since
+    later = SubscriptionChange.objects.filter(
+        subscription=OuterRef('pk'), changed_at__gte=_day_start(day + timedelta(days=1))
+    ).order_by('changed_at', 'id')
+    return {
+        'plan_on': Coalesce(Subquery(later.values('old_plan_id')[:1]), F('plan_id'), output_field=BigIntegerField()),
+        'status_on': Coalesce(Subquery(later.values('old_status')[:1]), F('status')),
+    }
+
+def active_on(day):
+    """
+    Subscriptions active on `day`: started, not yet ended and not cancelled at
+    the end of it, annotated with `plan_on`, the plan they were on that day
+    """
+    return Subscription.objects.filter(start_date__lte=day, end_date__gte=day).annotate(
+        **_state_at_end_of(day)
+    ).exclude(status_on='cancelled')
+
+def _day_movements(day):
+    """
+    Per plan movements between the end of the day before `day` and the end of it
+
+    Only subscriptions starting on `day`, ending the day before or changed during
+    it can differ between the two; each is placed on the plan it held at the end
+    of either day, or none when inactive.
+
+    Returns:
+        tuple: new, churned and net moved-in counts, each a dict by plan id
+    """
+    previous = day - timedelta(days=1)
+    start, end = _day_start(day), _day_start(day + timedelta(days=1))
+    fields = ('id', 'plan_id', 'status', 'start_date', 'end_date')
+    candidates = {row[0]: row for row in Subscription.objects.filter(start_date=day).values_list(*fields)}
+    candidates.update({row[0]: row for row in Subscription.objects.filter(end_date=previous).values_list(*fields)})
+    changed = SubscriptionChange.objects.filter(changed_at__gte=start, changed_at__lt=end).values_list(
+        'subscription_id', *(f'subscription__{field}' for field in fields[1:])
+    )
+    candidates.update({row[0]: row for row in changed})
+
+    later = {}
+    if candidates:
+        for subscription_id, changed_at, plan_id, status in SubscriptionChange.objects.filter(
+            subscription_id__in=list(candidates), changed_at__gte=start
+        ).order_by('changed_at', 'id').values_list('subscription_id', 'changed_at', 'old_plan_id', 'old_status'):
+            later.setdefault(subscription_id, []).append((changed_at, plan_id, status))
+
+    def plan_at_end_of(row, on, until):
+        subscription_id, plan_id, status, start_date, end_date = row
+        if not start_date <= on <= end_date:
+            return None
+        for changed_at, old_plan_id, old_status in later.get(subscription_id, ()):
+            if changed_at >= until:
+                plan_id, status = old_plan_id, old_status
+                break
+        return None if status == 'cancelled' else plan_id
+
+    new, churned, moved = {}, {}, {}
+    for row in candidates.values():
+        before, after = plan_at_end_of(row, previous, start), plan_at_end_of(row, day, end)
+        if before == after:
+            continue
+        if before is None:
+            # Reactivations count as new like first starts
+            new[after] = new.get(after, 0) + 1
+        elif after is None:
+            churned[before] = churned.get(before, 0) + 1
+        else:
+            moved[before] = moved.get(before, 0) - 1
+            moved[after] = moved.get(after, 0) + 1
+    return new, churned, moved
+
+def _count_by_plan(queryset):
+    return dict(queryset.values('plan_on').annotate(count=Count('id')).values_list('plan_on', 'count').order_by())
+
+def build_mrr_snapshots(until=None, since=None):
+    """
+    Extend the daily MRR snapshots up to `until`, one row per plan per day
+
+    Each day is derived from the previous day's snapshot plus that day's changes:
+    the subscriptions that started or ended, and the plan and status changes
+    logged in SubscriptionChange. Only those rows are read, through the start,
+    end and change indexes, so a nightly run costs a few small queries whatever
+    the number of subscriptions. Only the first day, when there is no previous
+    snapshot, is seeded from a full count.
+
+    A reactivation counts as new and a cancellation as churn, against the plan
+    held that day. A plan change moves the subscription from one plan to the
+    other, so expansion, the MRR change not explained by new or churned
+    subscriptions, covers upgrades, downgrades (as negative expansion) and plan
+    price changes.
+
+    Args:
+        until (date, optional): Last day to snapshot. Defaults to yesterday.
+        since (date, optional): Rebuild from this day, replacing existing snapshots.
+            Defaults to the day after the latest snapshot, or the first subscription start.
+
+    Returns:
+        int: Number of days built
+    """
+    until = until or timezone.localdate() - timedelta(days=1)
+    prices = dict(Plan.objects.values_list('id', 'price'))
+
+    previous = {}
+    if since is None:
+        latest = MrrSnapshot.objects.aggregate(latest=Max('date'))['latest']
+        if latest is not None:
+            since = latest + timedelta(days=1)
+            previous = {row.plan_id: row for row in MrrSnapshot.objects.filter(date=latest)}
+        else:
+            since = Subscription.objects.aggregate(first=Min('start_date'))['first']
+            if since is None:
+                return 0
+    else:
+        MrrSnapshot.objects.filter(date__gte=since).delete()
+
+    days = 0
+    day = since
+    while day <= until:
+        new, churned, moved = _day_movements(day)
+        seed = _count_by_plan(active_on(day)) if not previous else None
+
+        snapshots = []
+        for plan_id, price in prices.items():
+            before = previous.get(plan_id)
+            before_active = before.active_subscriptions if before else 0
+            before_mrr = before.mrr if before else 0
+            before_price = before.price if before else price
+
+            active = seed.get(plan_id, 0) if seed is not None else (
+                before_active + new.get(plan_id, 0) - churned.get(plan_id, 0) + moved.get(plan_id, 0)
+            )
+            snapshot = MrrSnapshot(
+                date=day,
+                plan_id=plan_id,
+                price=price,
+                active_subscriptions=active,
+                mrr=active * price,
+                new_subscriptions=new.get(plan_id, 0),
+                new_mrr=new.get(plan_id, 0) * price,
+                churned_subscriptions=churned.get(plan_id, 0),
+                churned_mrr=churned.get(plan_id, 0) * before_price,
+            )
+            if seed is None:
+                snapshot.expansion_mrr = snapshot.mrr - (before_mrr + snapshot.new_mrr - snapshot.churned_mrr)
+            snapshots.append(snapshot)
+
+        with transaction.atomic():
+            MrrSnapshot.objects.bulk_create(snapshots)
+        previous = {snapshot.plan_id: snapshot for snapshot in snapshots}
+        days += 1
+        day += timedelta(days=1)
+
+    logger.info(f"Built {days} days of MRR snapshots up to {until}")
+    return days
+
+def mrr_series(start, end, plan_id=None):
+    """
+    Daily MRR, ARR and movements between start and end, summed over plans
+
+    A single range read of the snapshot table grouped by date.
+
+    Returns:
+        list: One dict per day with date, active_subscriptions, mrr, arr,
+        new_mrr, expansion_mrr and churned_mrr
+    """
+    snapshots = MrrSnapshot.objects.filter(date__gte=start, date__lte=end)
+    if plan_id is not None:
+        snapshots = snapshots.filter(plan_id=plan_id)
+    rows = snapshots.values('date').annotate(
+        active=Sum('active_subscriptions'),
+        total_mrr=Sum('mrr'),
+        total_new=Sum('new_mrr'),
+        total_expansion=Sum('expansion_mrr'),
+        total_churned=Sum('churned_mrr'),
+    ).order_by('date')
+    return [
+        {
+            'date': row['date'].isoformat(),
+            'active_subscriptions': row['active'],
+            'mrr': round(float(row['total_mrr']), 2),
+            'arr': round(float(row['total_mrr']) * 12, 2),
+            'new_mrr': round(float(row['total_new']), 2),
+            'expansion_mrr': round(float(row['total_expansion']), 2),
+            'churned_mrr': round(float(row['total_churned']), 2),
+        }
+        for row in rows
+    ]
+
+def mrr_forecast(series, days, window=None):
+    """
+    Project MRR forward with a least-squares line through the recent series
+
+    Args:
+        series (list): Output of mrr_series()
+        days (int): Days to project past the last point
+        window (int, optional): Trailing points to fit. Defaults to MRR_FORECAST_WINDOW.
+
+    Returns:
+        list: One dict per projected day with date, mrr and arr
+    """
+    window = window or settings.MRR_FORECAST_WINDOW
+    recent = series[-window:]
+    if not days or not recent:
+        return []
+
+    mrr = np.array([point['mrr'] for point in recent])
+    x = np.arange(len(mrr))
+    slope, intercept = np.polyfit(x, mrr, 1) if len(mrr) > 1 else (0.0, mrr[0])
+    projected = np.maximum(intercept + slope * np.arange(len(mrr), len(mrr) + days), 0)
+
+    last = date.fromisoformat(recent[-1]['date'])
+    return [
+        {'date': (last + timedelta(days=offset + 1)).isoformat(), 'mrr': round(float(value), 2), 'arr': round(float(value) * 12, 2)}
+        for offset, value in enumerate(projected)
+    ]
@@ -0,0 +1,70 @@
+from itertools import groupby
+import logging
+from .models import Invoice
+from .utils import build_email_message
+
+logger = logging.getLogger(__name__)
+
+def unpaid_invoices_by_user():
+    """
+    Stream every unpaid (pending or overdue) invoice once, grouped by user
+
+    The grouping is done by the database: rows come back ordered by user, so each
+    user's invoices are contiguous and only one user's worth is held in memory.
+    Users without an email address are filtered out in the same query.
+
+    Yields:
+        tuple: (user, list of that user's unpaid invoices, overdue first)
+    """
+    invoices = (
+        Invoice.objects.filter(status__in=['pending', 'overdue'])
+        .exclude(user__email='')
+        .select_related('user', 'subscription__plan')
+        # 'overdue' sorts before 'pending', so past-due invoices lead each group
+        .order_by('user_id', 'status', 'due_date', 'id')
+    )
+    for _, user_invoices in groupby(invoices.iterator(), key=lambda invoice: invoice.user_id):
+        user_invoices = list(user_invoices)
+        yield user_invoices[0].user, user_invoices
+
+def plan_daily_notices():
+    """
+    Decide the one billing notice each user gets today
+
+    A user with overdue invoices gets a past-due notice listing those invoices
+    together with any still pending; a user with only pending invoices gets a
+    payment reminder. Either way it is a single message per user.
+
+    Yields:
+        dict: user, invoices, overdue and pending invoice lists, and total_amount
+    """
+    for user, invoices in unpaid_invoices_by_user():
+        overdue = [invoice for invoice in invoices if invoice.status == 'overdue']
+        yield {
+            'user': user,
+            'invoices': invoices,
+            'overdue': overdue,
+            'pending': invoices[len(overdue):],
+            'total_amount': sum(invoice.amount for invoice in invoices),
+        }
+
+def build_daily_notice_email(notice):
+    """
+    Build the combined daily billing notice for one user
+
+    Args:
+        notice (dict): One entry from plan_daily_notices()
+
+    Returns:
+        EmailMultiAlternatives: The rendered message
+    """
+    invoice_count = len(notice['invoices'])
+    overdue_count = len(notice['overdue'])
+    if overdue_count:
+        subject = f"Payment Overdue: {overdue_count} invoice{'s' if overdue_count > 1 else ''} past due"
+    else:
+        subject = f"Payment Reminder: You have {invoice_count} unpaid invoice{'s' if invoice_count > 1 else ''}"
+
+    context = dict(notice, invoice_count=invoice_count, overdue_count=overdue_count)
+    user = notice['user']
+    return build_email_message(subject, 'billing/emails/unpaid_invoice_reminder.html', context, [user.email])
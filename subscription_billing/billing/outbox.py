@@ -0,0 +1,117 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
+from functools import partial
+import logging
+from .models import EmailOutbox, Subscription, Invoice
+from .utils import (
+    build_subscription_confirmation_email,
+    build_payment_confirmation_email,
+    build_bulk_payment_confirmation_email,
+    send_email_batch
+)
+
+logger = logging.getLogger(__name__)
+
+def _subscription_confirmation(payload):
+    subscription = Subscription.objects.select_related('user', 'plan').get(id=payload['subscription_id'])
+    return build_subscription_confirmation_email(subscription)
+
+def _payment_confirmation(payload):
+    invoice = Invoice.objects.select_related('user', 'subscription__plan').get(id=payload['invoice_id'])
+    return build_payment_confirmation_email(invoice)
+
+def _bulk_payment_confirmation(payload):
+    invoices = list(
+        Invoice.objects.select_related('user', 'subscription__plan').filter(id__in=payload['invoice_ids']).order_by('id')
+    )
+    if not invoices:
+        raise Invoice.DoesNotExist(f"None of invoices {payload['invoice_ids']} exist")
+    return build_bulk_payment_confirmation_email(invoices)
+
+# Outbox kind -> builder rendering the message from the stored payload
+OUTBOX_BUILDERS = {
+    'subscription_confirmation': _subscription_confirmation,
+    'payment_confirmation': _payment_confirmation,
+    'bulk_payment_confirmation': _bulk_payment_confirmation,
+}
+
+def enqueue_email(kind, **payload):
+    """
+    Queue an email for the outbox dispatcher instead of sending it inline
+
+    Call inside the transaction that makes the business change, so the email is
+    queued if and only if that change commits. Costs one INSERT and no network I/O.
+
+    Args:
+        kind (str): One of EmailOutbox.KIND_CHOICES
+        **payload: Ids the builder needs, e.g. subscription_id, invoice_id or invoice_ids
+
+    Returns:
+        EmailOutbox: The queued row
+    """
+    return EmailOutbox.objects.create(kind=kind, payload=payload)
+
+def dispatch_outbox(batch_size=None):
+    """
+    Send one batch of due outbox emails over a shared SMTP connection
+
+    Delivery is at most once. Rows are claimed with SELECT ... FOR UPDATE SKIP
+    LOCKED and set to 'sending' in a transaction committed before any email goes
+    out, so neither a concurrent dispatcher nor a rerun picks them up again; each
+    is marked sent as soon as its send returns. A row still 'sending' after
+    EMAIL_OUTBOX_SENDING_TIMEOUT belonged to a dispatcher that died mid-batch and
+    may or may not have been delivered, so it is marked failed rather than resent.
+    Sends that fail are retried with exponential backoff until
+    EMAIL_OUTBOX_MAX_ATTEMPTS is reached.
+
+    Args:
+        batch_size (int, optional): Rows per batch. Defaults to EMAIL_OUTBOX_BATCH_SIZE.
+
+    Returns:
+        tuple: (sent, failed) counts for the batch
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    now = timezone.now()
+
+    interrupted = EmailOutbox.objects.filter(
+        status='sending', next_attempt_at__lte=now - timedelta(seconds=settings.EMAIL_OUTBOX_SENDING_TIMEOUT)
+    ).update(status='failed', last_error='Interrupted while sending; not retried in case it was delivered')
+    if interrupted:
+        logger.warning(f"Marked {interrupted} interrupted outbox emails as failed")
+
+    with transaction.atomic():
+        entries = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('id')[:batch_size]
+        )
+        EmailOutbox.objects.filter(id__in=[entry.id for entry in entries]).update(status='sending', next_attempt_at=now)
+    if not entries:
+        return 0, 0
+
+    def record(item, error):
+        entry = item.args[0]
+        if error is None:
+            EmailOutbox.objects.filter(id=entry.id).update(status='sent', sent_at=timezone.now(), last_error='')
+            return
+        entry.attempts += 1
+        entry.last_error = str(error)
+        if entry.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS or isinstance(error, (KeyError, Subscription.DoesNotExist, Invoice.DoesNotExist)):
+            entry.status = 'failed'
+        else:
+            entry.status = 'pending'
+            entry.next_attempt_at = now + timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (entry.attempts - 1))
+        entry.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+    sent, failed = send_email_batch(
+        (partial(_build, entry) for entry in entries),
+        on_result=record
+    )
+
+    logger.info(f"Outbox batch complete. Sent {sent} emails, {failed} failed")
+    return sent, failed
+
+def _build(entry):
+    return OUTBOX_BUILDERS[entry.kind](entry.payload)
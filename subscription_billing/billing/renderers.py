@@ -0,0 +1,88 @@
+from io import BytesIO
+import math
+from rest_framework.parsers import JSONParser, get_encoding
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson-backed JSON renderer and parser
+#
+# With orjson installed these encode and decode in C; without it they are DRF's
+# JSONRenderer and JSONParser. The output is byte for byte what DRF produces:
+# datetimes, dates and UUIDs are formatted natively in the same ISO forms
+# (UTC as "Z"), and everything else orjson does not know (Decimal, timedelta,
+# querysets, ...) goes through DRF's JSONEncoder.default. Floats are the one
+# textual difference: exponents are written 1e16 rather than 1e+16, which parses
+# to the same value. Anything orjson cannot handle exactly (integers over 64
+# bits, NaN and infinities, indented or ASCII-only output, non-UTF-8 bodies)
+# goes down the stdlib path, which raises for non-finite floats as DRF does.
+
+_default = JSONEncoder().default
+# orjson reads integers past 64 bits as floats; bodies with a run of 19 digits
+# (inside strings too, harmlessly) are left to the stdlib, which keeps them exact.
+# Mapping digits to 0 and everything else to a space makes that a substring test.
+_DIGITS = bytes(ord('0') if ord('0') <= byte <= ord('9') else ord(' ') for byte in range(256))
+_LONG_NUMBER = b'0' * 19
+
+# Strings, ints and None, most of a serializer's output, cost one set lookup
+_SCALARS = frozenset((str, int, bool, type(None)))
+
+def _has_non_finite(items):
+    # orjson writes NaN and infinities as null, so output containing null is
+    # searched for them through the containers orjson serializes natively
+    stack = [items]
+    while stack:
+        item = stack.pop()
+        for value in (item.values() if isinstance(item, dict) else item):
+            if value.__class__ in _SCALARS:
+                continue
+            if isinstance(value, (dict, list, tuple)):
+                stack.append(value)
+            elif isinstance(value, float) and not math.isfinite(value):
+                return True
+    return False
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer encoding with orjson when it is installed
+    """
+    if orjson is not None:
+        options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or data is None or self.ensure_ascii or not self.compact or not self.strict
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(data, default=_default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'null' in content and _has_non_finite([data]):
+            # Raises, like DRF, rather than rendering them as null
+            return super().render(data, accepted_media_type, renderer_context)
+        # DRF escapes these two so the JSON is also valid JavaScript
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser decoding with orjson when it is installed
+    """
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = get_encoding(parser_context or {})
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        if _LONG_NUMBER in body.translate(_DIGITS):
+            return super().parse(BytesIO(body), media_type, parser_context)
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # What orjson rejects the stdlib may still accept (NaN when not
+            # strict); otherwise this raises DRF's usual ParseError
+            return super().parse(BytesIO(body), media_type, parser_context)
@@ -0,0 +1,169 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from collections import defaultdict
+from dateutil.relativedelta import relativedelta
+from datetime import datetime
+from decimal import Decimal
+import logging
+from .models import Invoice, RevenueRollup
+from .stats import add_invoice, apply_user_deltas, user_deltas
+
+logger = logging.getLogger(__name__)
+
+STATUS_UPDATE_BATCH_SIZE = 1000
+
+def month_of(day):
+    """
+    First day of the month containing `day`, the RevenueRollup.month key
+    """
+    if isinstance(day, datetime):
+        day = timezone.localdate(day)
+    return day.replace(day=1)
+
+def _apply(deltas):
+    # Keys are applied in a fixed order so concurrent writers lock rollup rows in
+    # the same sequence and cannot deadlock each other
+    for (month, plan_id, status), (count, amount) in sorted(deltas.items()):
+        if not count and not amount:
+            continue
+        changes = {'invoice_count': F('invoice_count') + count, 'amount': F('amount') + amount}
+        rows = RevenueRollup.objects.filter(month=month, plan_id=plan_id, status=status)
+        if rows.update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                RevenueRollup.objects.create(month=month, plan_id=plan_id, status=status, invoice_count=count, amount=amount)
+        except IntegrityError:
+            # Created by a concurrent writer since the update above
+            rows.update(**changes)
+
+def _add(deltas, users, invoice, status, sign):
+    entry = deltas[(month_of(invoice.issue_date), invoice.plan_id, status)]
+    entry[0] += sign
+    entry[1] += sign * invoice.amount
+    add_invoice(users, invoice.user_id, status, invoice.amount, sign)
+
+def _record(invoices, sign):
+    deltas = defaultdict(lambda: [0, Decimal('0')])
+    users = user_deltas()
+    for invoice in invoices:
+        _add(deltas, users, invoice, invoice.status, sign)
+    _apply(deltas)
+    apply_user_deltas(users)
+
+def record_invoices_created(invoices):
+    """
+    Add newly created invoices to the revenue rollup and their users' billing stats
+
+    Call inside the transaction that creates them. Costs one or two queries per
+    distinct (month, plan, status) and per user among the invoices, not per invoice.
+
+    Args:
+        invoices: Invoice objects with plan_id set
+    """
+    _record(invoices, 1)
+
+def record_invoices_deleted(invoices):
+    """
+    Remove invoices about to be deleted from the revenue rollup and their users' billing stats
+
+    Call inside the transaction that deletes them, before the delete.
+    """
+    _record(invoices, -1)
+
+def record_status_change(invoice, old_status):
+    """
+    Move one invoice between status buckets of the revenue rollup and its user's billing stats
+
+    Call inside the transaction that saves the new status.
+
+    Args:
+        invoice: The Invoice, already carrying its new status
+        old_status (str): The status it had before the change
+    """
+    if invoice.status == old_status:
+        return
+    deltas = defaultdict(lambda: [0, Decimal('0')])
+    users = user_deltas()
+    _add(deltas, users, invoice, old_status, -1)
+    _add(deltas, users, invoice, invoice.status, 1)
+    _apply(deltas)
+    apply_user_deltas(users)
+
+def change_invoice_status(queryset, status):
+    """
+    Set the status of every invoice in queryset and update the rollup and user stats to match
+
+    The invoices are locked and their old buckets read before the update, all in
+    one transaction, so the rollup moves exactly the rows that changed.
+
+    Args:
+        queryset: Invoices to change
+        status (str): The new status
+
+    Returns:
+        int: Number of invoices changed
+    """
+    with transaction.atomic():
+        rows = list(
+            queryset.exclude(status=status)
+            .select_for_update(of=('self',))
+            .values_list('id', 'issue_date', 'plan_id', 'status', 'amount', 'user_id')
+        )
+        deltas = defaultdict(lambda: [0, Decimal('0')])
+        users = user_deltas()
+        for _, issue_date, plan_id, old_status, amount, user_id in rows:
+            for key, sign in (((month_of(issue_date), plan_id, old_status), -1), ((month_of(issue_date), plan_id, status), 1)):
+                deltas[key][0] += sign
+                deltas[key][1] += sign * amount
+            add_invoice(users, user_id, old_status, amount, -1)
+            add_invoice(users, user_id, status, amount, 1)
+
+        ids = [row[0] for row in rows]
+        now = timezone.now()
+        for start in range(0, len(ids), STATUS_UPDATE_BATCH_SIZE):
+            # update() skips auto_now, so bump updated_at for the changes-since feed
+            Invoice.objects.filter(id__in=ids[start:start + STATUS_UPDATE_BATCH_SIZE]).update(status=status, updated_at=now)
+        _apply(deltas)
+        apply_user_deltas(users)
+    return len(rows)
+
+def rebuild_revenue_rollups(month=None):
+    """
+    Recompute the revenue rollup from the invoice table
+
+    Args:
+        month (date, optional): Rebuild only this month. Defaults to every month.
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    invoices = Invoice.objects.all()
+    rollups = RevenueRollup.objects.all()
+    if month is not None:
+        month = month_of(month)
+        invoices = invoices.filter(issue_date__gte=month, issue_date__lt=month + relativedelta(months=1))
+        rollups = rollups.filter(month=month)
+
+    totals = (
+        invoices.annotate(month=TruncMonth('issue_date'))
+        .values('month', 'plan_id', 'status')
+        .annotate(invoice_count=Count('id'), amount=Sum('amount'))
+        .order_by()
+    )
+    with transaction.atomic():
+        rollups.delete()
+        created = RevenueRollup.objects.bulk_create([
+            RevenueRollup(
+                month=row['month'],
+                plan_id=row['plan_id'],
+                status=row['status'],
+                invoice_count=row['invoice_count'],
+                amount=row['amount']
+            )
+            for row in totals
+        ])
+    logger.info(f"Rebuilt {len(created)} revenue rollup rows")
+    return len(created)
@@ -3,8 +3,11 @@ from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken
 from .models import Plan, Subscription, Invoice
+from .catalog import get_plan
+from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=8)
@@ -67,13 +70,116 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
         read_only_fields = ['id']
 
-class PlanSerializer(serializers.ModelSerializer):
+# Fast list representations
+#
+# List responses build each row with the functions below instead of running every
+# nested serializer field. Their output is identical to the ModelSerializers':
+# decimals as two-place strings, dates as ISO strings and datetimes in DRF's
+# ISO 8601 format in the current timezone. Querysets passed to them should
+# select_related the nested plan/subscription so no row triggers a query.
+
+CENTS = Decimal('0.01')
+
+def _decimal(value):
+    return f'{value.quantize(CENTS, rounding=ROUND_HALF_UP):f}' if value is not None else ''
+
+def _date(value):
+    return value.isoformat() if value else None
+
+def _datetime(value):
+    if not value:
+        return None
+    value = timezone.localtime(value).isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+def plan_data(plan):
+    return {
+        'id': plan.id,
+        'name': plan.name,
+        'price': _decimal(plan.price),
+        'description': plan.description,
+    }
+
+def subscription_data(subscription):
+    return {
+        'id': subscription.id,
+        'user': subscription.user_id,
+        'plan': subscription.plan_id,
+        'plan_details': plan_data(subscription.plan),
+        'start_date': _date(subscription.start_date),
+        'end_date': _date(subscription.end_date),
+        'status': subscription.status,
+        'created_at': _datetime(subscription.created_at),
+        'updated_at': _datetime(subscription.updated_at),
+    }
+
+def invoice_data(invoice):
+    return {
+        'uuid': str(invoice.uuid),
+        'user': invoice.user_id,
+        'subscription': invoice.subscription_id,
+        'subscription_details': subscription_data(invoice.subscription),
+        'amount': _decimal(invoice.amount),
+        'issue_date': _date(invoice.issue_date),
+        'due_date': _date(invoice.due_date),
+        'status': invoice.status,
+        'created_at': _datetime(invoice.created_at),
+        'updated_at': _datetime(invoice.updated_at),
+    }
+
+class FastListSerializer(serializers.ListSerializer):
+    """
+    ListSerializer that renders each item with a plain function, skipping DRF's per-field work
+    """
+    represent = None
+
+    def to_representation(self, data):
+        items = data.all() if hasattr(data, 'all') else data
+        # A sparse fieldset (see fieldsets.py) in the context replaces the full representation
+        fieldset = self.context.get('fieldset')
+        represent = fieldset.represent if fieldset is not None else self.represent
+        return [represent(item) for item in items]
+
+class FieldsetMixin:
+    """
+    Renders the sparse fieldset in the context, if any, instead of every field
+    """
+    def to_representation(self, instance):
+        fieldset = self.context.get('fieldset')
+        if fieldset is not None:
+            return fieldset.represent(instance)
+        return super().to_representation(instance)
+
+class PlanListSerializer(FastListSerializer):
+    represent = staticmethod(plan_data)
+
+class SubscriptionListSerializer(FastListSerializer):
+    represent = staticmethod(subscription_data)
+
+class InvoiceListSerializer(FastListSerializer):
+    represent = staticmethod(invoice_data)
+
+class PlanSerializer(FieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Plan
         fields = ['id', 'name', 'price', 'description']
         read_only_fields = ['id']
+        list_serializer_class = PlanListSerializer
+
+class CatalogPlanField(serializers.PrimaryKeyRelatedField):
+    """
+    Plan primary key field resolved from the cached plan catalog instead of a query
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return get_plan(data)
+        except Plan.DoesNotExist:
+            self.fail('does_not_exist', pk_value=data)
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(FieldsetMixin, serializers.ModelSerializer):
+    plan = CatalogPlanField(queryset=Plan.objects.all())
     plan_details = PlanSerializer(source='plan', read_only=True)
     end_date = serializers.DateField(required=False)
     
@@ -81,6 +187,7 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         model = Subscription
         fields = ['id', 'user', 'plan', 'plan_details', 'start_date', 'end_date', 'status', 'created_at', 'updated_at']
         read_only_fields = ['id', 'user', 'created_at', 'updated_at', 'plan_details']
+        list_serializer_class = SubscriptionListSerializer
     
     def create(self, validated_data):
         # Set user from request context
@@ -100,13 +207,14 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         
         return super().create(validated_data)
 
-class InvoiceSerializer(serializers.ModelSerializer):
+class InvoiceSerializer(FieldsetMixin, serializers.ModelSerializer):
     subscription_details = SubscriptionSerializer(source='subscription', read_only=True)
     
     class Meta:
         model = Invoice
         fields = ['uuid', 'user', 'subscription', 'subscription_details', 'amount', 'issue_date', 'due_date', 'status', 'created_at', 'updated_at']
         read_only_fields = ['uuid', 'created_at', 'updated_at', 'subscription_details']
+        list_serializer_class = InvoiceListSerializer
 
 class PayInvoiceSerializer(serializers.Serializer):
     invoice_uuid = serializers.UUIDField()
@@ -118,4 +226,10 @@ class PayInvoiceSerializer(serializers.Serializer):
                 raise serializers.ValidationError("This invoice is already paid.")
             return value
         except Invoice.DoesNotExist:
-            raise serializers.ValidationError("Invoice not found.") 
\ No newline at end of file
+            raise serializers.ValidationError("Invoice not found.") 
+
+class BulkPayInvoicesSerializer(serializers.Serializer):
+    invoice_uuids = serializers.ListField(
+        child=serializers.UUIDField(), allow_empty=False, max_length=settings.BULK_PAY_MAX_INVOICES
+    )
+    all_or_nothing = serializers.BooleanField(default=False)
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from .authentication import bump_blacklist_version, invalidate_cached_user
+from .catalog import invalidate_plan_catalog
+from .models import Plan
+
+@receiver([post_save, post_delete], sender=Plan)
+def plan_changed(sender, **kwargs):
+    # Drop the cached catalog now and again on commit, so a request that rebuilt
+    # it from the old rows before this transaction committed is not kept
+    invalidate_plan_catalog()
+    transaction.on_commit(invalidate_plan_catalog)
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, **kwargs):
+    # Deactivations and password changes must reach CachedJWTAuthentication on
+    # the next request; dropped again on commit for the same reason as plans
+    invalidate_cached_user(instance.pk)
+    transaction.on_commit(lambda: invalidate_cached_user(instance.pk))
+
+@receiver(post_save, sender=BlacklistedToken)
+def token_blacklisted(sender, **kwargs):
+    # However a token is blacklisted (logout, rotation, admin), other processes
+    # reload their BlacklistedJTIs once the row is committed
+    transaction.on_commit(bump_blacklist_version)
@@ -0,0 +1,180 @@
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+from collections import defaultdict
+from decimal import Decimal
+import logging
+from .models import Subscription, Invoice, UserBillingStats
+
+logger = logging.getLogger(__name__)
+
+STATS_FIELDS = ('active_subscriptions', 'pending_invoices', 'overdue_invoices', 'outstanding_amount')
+# Invoice statuses that count towards a user's stats, and the counter each one feeds
+OUTSTANDING_STATUSES = {'pending': 'pending_invoices', 'overdue': 'overdue_invoices'}
+CENTS = Decimal('0.01')
+STATS_BATCH_SIZE = 1000
+
+def user_deltas():
+    """
+    Empty per-user changes, keyed by user id, with one value per STATS_FIELDS entry
+    """
+    return defaultdict(lambda: dict.fromkeys(STATS_FIELDS, 0))
+
+def add_invoice(deltas, user_id, status, amount, sign):
+    """
+    Count an invoice in (sign=1) or out of (sign=-1) its user's stats
+    """
+    field = OUTSTANDING_STATUSES.get(status)
+    if field:
+        deltas[user_id][field] += sign
+        deltas[user_id]['outstanding_amount'] += sign * amount
+
+def add_subscription(deltas, user_id, status, sign):
+    """
+    Count a subscription in (sign=1) or out of (sign=-1) its user's stats
+    """
+    if status == 'active':
+        deltas[user_id]['active_subscriptions'] += sign
+
+def apply_user_deltas(deltas):
+    """
+    Add the changes to the UserBillingStats rows, creating missing rows
+
+    Call inside the transaction making the underlying changes. The affected rows
+    are locked and rewritten STATS_BATCH_SIZE users at a time, so a billing run
+    touching thousands of users costs a few queries per batch rather than per user.
+    """
+    changes = {
+        user_id: {field: value for field, value in values.items() if value}
+        for user_id, values in deltas.items()
+    }
+    user_ids = sorted(user_id for user_id, values in changes.items() if values)
+    for start in range(0, len(user_ids), STATS_BATCH_SIZE):
+        batch = user_ids[start:start + STATS_BATCH_SIZE]
+        # Locked in user id order so concurrent writers cannot deadlock each other
+        rows = list(UserBillingStats.objects.select_for_update().filter(user_id__in=batch).order_by('user_id'))
+        now = timezone.now()
+        for row in rows:
+            for field, value in changes[row.user_id].items():
+                setattr(row, field, getattr(row, field) + value)
+            row.updated_at = now
+        UserBillingStats.objects.bulk_update(rows, [*STATS_FIELDS, 'updated_at'])
+
+        found = {row.user_id for row in rows}
+        missing = [user_id for user_id in batch if user_id not in found]
+        if not missing:
+            continue
+        try:
+            with transaction.atomic():
+                UserBillingStats.objects.bulk_create([
+                    UserBillingStats(user_id=user_id, **changes[user_id]) for user_id in missing
+                ])
+        except IntegrityError:
+            # Some were created by a concurrent writer since the read above
+            apply_user_deltas({user_id: changes[user_id] for user_id in missing})
+
+def record_subscriptions_created(subscriptions):
+    """
+    Add newly created subscriptions to their users' stats
+    """
+    deltas = user_deltas()
+    for subscription in subscriptions:
+        add_subscription(deltas, subscription.user_id, subscription.status, 1)
+    apply_user_deltas(deltas)
+
+def record_subscriptions_deleted(subscriptions):
+    """
+    Remove subscriptions about to be deleted from their users' stats
+    """
+    deltas = user_deltas()
+    for subscription in subscriptions:
+        add_subscription(deltas, subscription.user_id, subscription.status, -1)
+    apply_user_deltas(deltas)
+
+def record_subscription_status_change(subscription, old_status):
+    """
+    Move one subscription between statuses in its user's stats
+
+    Args:
+        subscription: The Subscription, already carrying its new status
+        old_status (str): The status it had before the change
+    """
+    if subscription.status == old_status:
+        return
+    deltas = user_deltas()
+    add_subscription(deltas, subscription.user_id, old_status, -1)
+    add_subscription(deltas, subscription.user_id, subscription.status, 1)
+    apply_user_deltas(deltas)
+
+def current_user_billing_stats(first_id, last_id):
+    """
+    UserBillingStats values computed from the subscription and invoice tables for
+    an inclusive user id range, in two grouped queries
+
+    Returns:
+        dict: user_id -> {field: value} for users with any non-zero value
+    """
+    actual = defaultdict(lambda: dict.fromkeys(STATS_FIELDS, 0))
+    subscriptions = (
+        Subscription.objects.filter(user_id__gte=first_id, user_id__lte=last_id, status='active')
+        .values('user_id').annotate(count=Count('id')).order_by()
+    )
+    for row in subscriptions:
+        actual[row['user_id']]['active_subscriptions'] = row['count']
+
+    invoices = (
+        Invoice.objects.filter(user_id__gte=first_id, user_id__lte=last_id, status__in=OUTSTANDING_STATUSES)
+        .values('user_id').annotate(
+            pending=Count('id', filter=Q(status='pending')),
+            overdue=Count('id', filter=Q(status='overdue')),
+            amount=Sum('amount'),
+        ).order_by()
+    )
+    for row in invoices:
+        actual[row['user_id']].update(
+            pending_invoices=row['pending'],
+            overdue_invoices=row['overdue'],
+            outstanding_amount=Decimal(row['amount']).quantize(CENTS),
+        )
+    return actual
+
+def verify_user_billing_stats(repair=False, chunk_size=5000):
+    """
+    Compare every UserBillingStats row with the subscription and invoice tables
+
+    Users are checked one id range at a time, three queries per range. A missing
+    row counts as all zeros.
+
+    Args:
+        repair (bool): Overwrite drifted rows with the computed values
+        chunk_size (int): Users per id range
+
+    Returns:
+        list: (user_id, stored, actual) for each user whose stats drifted
+    """
+    bounds = User.objects.aggregate(first=Min('id'), last=Max('id'))
+    if bounds['first'] is None:
+        return []
+
+    zero = dict.fromkeys(STATS_FIELDS, 0)
+    drift = []
+    for first_id in range(bounds['first'], bounds['last'] + 1, chunk_size):
+        last_id = first_id + chunk_size - 1
+        actual = current_user_billing_stats(first_id, last_id)
+        stored = {
+            row['user_id']: row
+            for row in UserBillingStats.objects.filter(user_id__gte=first_id, user_id__lte=last_id).values('user_id', *STATS_FIELDS)
+        }
+        for user_id in sorted(set(actual) | set(stored)):
+            have = {field: stored[user_id][field] for field in STATS_FIELDS} if user_id in stored else zero
+            want = actual.get(user_id, zero)
+            if have != want:
+                drift.append((user_id, have, want))
+
+    if repair and drift:
+        with transaction.atomic():
+            for user_id, _, want in drift:
+                UserBillingStats.objects.update_or_create(user_id=user_id, defaults=want)
+        logger.info(f"Repaired billing stats for {len(drift)} users")
+    return drift
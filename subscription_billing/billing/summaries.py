@@ -0,0 +1,158 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Count, DecimalField, Exists, Max, Min, OuterRef, Prefetch, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from datetime import timedelta
+from decimal import Decimal
+from functools import partial
+from itertools import islice
+import logging
+import time
+from .models import Subscription, Invoice
+from .utils import build_email_message, send_email_batch
+
+logger = logging.getLogger(__name__)
+
+def summary_period(today):
+    """
+    First and last day of the month before `today`
+    """
+    last_day = today.replace(day=1) - timedelta(days=1)
+    return last_day.replace(day=1), last_day
+
+def _has_active_subscription():
+    return Exists(Subscription.objects.filter(user=OuterRef('pk'), status='active'))
+
+def _invoice_total(period, status=None):
+    condition = Q(invoices__issue_date__range=period)
+    if status:
+        condition &= Q(invoices__status=status)
+    return Coalesce(Sum('invoices__amount', filter=condition), Value(Decimal('0')), output_field=DecimalField())
+
+def summary_recipients(period_start, period_end, first_id=None, last_id=None):
+    """
+    Users with an active subscription and an email address, ordered by id, with
+    their totals for the period annotated in one grouped query
+
+    Each user carries invoice_count, total_amount, total_paid and total_pending,
+    plus last_month_invoices and active_subscriptions lists filled by one prefetch
+    query each, so a chunk of users costs three queries however many there are.
+    first_id/last_id optionally restrict the scan to an inclusive id range (one worker's share)
+    """
+    period = (period_start, period_end)
+    queryset = User.objects.filter(_has_active_subscription()).exclude(email='')
+    if first_id is not None:
+        queryset = queryset.filter(id__gte=first_id)
+    if last_id is not None:
+        queryset = queryset.filter(id__lte=last_id)
+    return queryset.annotate(
+        invoice_count=Count('invoices', filter=Q(invoices__issue_date__range=period)),
+        total_amount=_invoice_total(period),
+        total_paid=_invoice_total(period, 'paid'),
+        total_pending=_invoice_total(period, 'pending'),
+    ).prefetch_related(
+        Prefetch(
+            'invoices',
+            queryset=Invoice.objects.filter(issue_date__range=period).order_by('issue_date', 'id'),
+            to_attr='last_month_invoices'
+        ),
+        Prefetch(
+            'subscriptions',
+            queryset=Subscription.objects.filter(status='active').select_related('plan').order_by('id'),
+            to_attr='active_subscriptions'
+        ),
+    ).order_by('id')
+
+def recipient_ranges(workers=None):
+    """
+    Split the summary recipients' id space into one contiguous range per worker
+
+    Args:
+        workers (int, optional): Number of ranges. Defaults to BILLING_SUMMARY_WORKERS.
+
+    Returns:
+        list: (first_id, last_id) inclusive ranges, empty if there are no recipients
+    """
+    workers = workers or settings.BILLING_SUMMARY_WORKERS
+
+    bounds = User.objects.filter(_has_active_subscription()).exclude(email='').aggregate(
+        first=Min('id'), last=Max('id')
+    )
+    if bounds['first'] is None:
+        return []
+
+    size = -(-(bounds['last'] - bounds['first'] + 1) // max(workers, 1))
+    return [
+        (first_id, min(first_id + size - 1, bounds['last']))
+        for first_id in range(bounds['first'], bounds['last'] + 1, size)
+    ]
+
+def build_summary_email(user, period_end):
+    """
+    Build the monthly billing summary for one user
+
+    Args:
+        user: A User from summary_recipients(), with its totals and invoices attached
+        period_end (date): Last day of the summarised month
+
+    Returns:
+        EmailMultiAlternatives: The rendered message
+    """
+    month_year = period_end.strftime("%B %Y")
+    logger.info(f"Prepared monthly summary for {user.username} - {user.invoice_count} invoices, ${user.total_amount}")
+    return build_email_message(
+        f'Monthly Billing Summary - {month_year}',
+        'billing/emails/monthly_billing_summary.html',
+        {
+            'user': user,
+            'month_year': month_year,
+            'last_month_invoices': user.last_month_invoices,
+            'active_subscriptions': user.active_subscriptions,
+            'total_amount': user.total_amount,
+            'total_paid': user.total_paid,
+            'total_pending': user.total_pending,
+            'invoice_count': user.invoice_count,
+        },
+        [user.email]
+    )
+
+def send_billing_summaries(period_start, period_end, first_id=None, last_id=None, chunk_size=None):
+    """
+    Render and send the monthly summaries for one range of recipients
+
+    Recipients are fetched chunk by chunk; each chunk's messages are rendered and
+    then handed to send_email_batch, which streams them over one SMTP connection.
+
+    Args:
+        period_start (date): First day of the summarised month
+        period_end (date): Last day of the summarised month
+        first_id (int, optional): Lowest user id to include
+        last_id (int, optional): Highest user id to include
+        chunk_size (int, optional): Users per chunk. Defaults to BILLING_SUMMARY_CHUNK_SIZE.
+
+    Returns:
+        dict: sent, failed and seconds for the range
+    """
+    chunk_size = chunk_size or settings.BILLING_SUMMARY_CHUNK_SIZE
+    stats = {'sent': 0, 'failed': 0, 'seconds': 0.0}
+    started = time.monotonic()
+
+    users = summary_recipients(period_start, period_end, first_id, last_id).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(users, chunk_size))
+        if not chunk:
+            break
+        sent, failed = send_email_batch(
+            partial(build_summary_email, user, period_end) for user in chunk
+        )
+        stats['sent'] += sent
+        stats['failed'] += failed
+
+    stats['seconds'] = time.monotonic() - started
+    return stats
+
+def throughput(messages, seconds):
+    """
+    Messages per second, guarding against a zero-length run
+    """
+    return messages / seconds if seconds > 0 else float(messages)
@@ -1,13 +1,20 @@
-from celery import shared_task
+from celery import shared_task, chord
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, timedelta
+from functools import partial
 import logging
-from .models import Subscription, Invoice
+import time
+from .models import Subscription, Invoice, RevenueRollup
 from .utils import (
-    send_invoice_created_email, 
-    send_payment_reminder_email, 
-    send_subscription_confirmation_email
+    build_email_message,
+    send_email_batch
 )
+from .invoicing import generate_invoices_for_date, shard_ranges
+from .notifications import plan_daily_notices, build_daily_notice_email
+from .summaries import summary_period, recipient_ranges, send_billing_summaries, throughput
+from .outbox import dispatch_outbox
+from .rollups import change_invoice_status
+from .mrr import build_mrr_snapshots
 from django.core.mail import send_mail
 from django.conf import settings
 from django.template.loader import render_to_string
@@ -16,45 +23,61 @@ from django.contrib.auth.models import User
 logger = logging.getLogger(__name__)
 
 @shared_task
-def generate_invoices():
+def generate_invoices(chunk_size=None, shard_count=None, shard_size=None, since=None, until=None):
     """
     Generate invoices for active subscriptions
     This task is scheduled to run daily
+    Billing dates missed since the last run are caught up in the same pass; pass
+    since/until (ISO dates) to bound a backfill explicitly
+    With more than one shard (BILLING_SHARD_COUNT / BILLING_SHARD_SIZE) the work is
+    fanned out to generate_invoice_shard subtasks and combined in a chord callback
     """
     logger.info("Starting invoice generation task")
-    today = timezone.now().date()
-    # Get all active subscriptions
-    active_subscriptions = Subscription.objects.filter(
-        status='active',
-        end_date__gte=today
-    )
+    today = date.fromisoformat(until) if until else timezone.now().date()
     
-    logger.info(f"Found {active_subscriptions.count()} active subscriptions")
+    shard_count = shard_count or settings.BILLING_SHARD_COUNT
+    shard_size = shard_size or settings.BILLING_SHARD_SIZE
+    if shard_count > 1 or shard_size:
+        shards = shard_ranges(today, shard_count=shard_count, shard_size=shard_size)
+        if shards:
+            chord([
+                generate_invoice_shard.s(today.isoformat(), first_id, last_id, chunk_size, since)
+                for first_id, last_id in shards
+            ])(combine_invoice_shard_results.s())
+        logger.info(f"Dispatched {len(shards)} invoice generation shards for {today}")
+        return f"Dispatched {len(shards)} invoice generation shards"
     
-    invoices_created = 0
-    emails_sent = 0
+    since = date.fromisoformat(since) if since else None
+    stats = generate_invoices_for_date(today, chunk_size=chunk_size, since=since)
+    
+    logger.info(f"Invoice generation complete. Created {stats['invoices_created']} invoices in {stats['chunks']} chunks ({stats['queries']} queries), sent {stats['emails_sent']} emails")
+    return f"Generated {stats['invoices_created']} invoices, sent {stats['emails_sent']} emails"
+
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def generate_invoice_shard(billing_date, first_id, last_id, chunk_size=None, since=None):
+    """
+    Generate invoices for one contiguous subscription id range
+    Each shard has its own BillingRun checkpoint, so a failed shard is retried on
+    its own and resumes where it stopped without affecting the other shards
+    """
+    billing_date = date.fromisoformat(billing_date)
+    since = date.fromisoformat(since) if since else None
+    logger.info(f"Starting invoice shard {first_id}-{last_id} for {billing_date}")
+    
+    stats = generate_invoices_for_date(billing_date, chunk_size=chunk_size, first_id=first_id, last_id=last_id, since=since)
     
-    for subscription in active_subscriptions:
-        if subscription.start_date.day == today.day:
-            due_date = today + timedelta(days=15)
-            
-            # Create a new invoice
-            invoice = Invoice.objects.create(
-                user=subscription.user,
-                subscription=subscription,
-                amount=subscription.plan.price,
-                issue_date=today,
-                due_date=due_date,
-                status='pending'
-            )
-            invoices_created += 1
-            logger.info(f"Created invoice {invoice.uuid} for subscription {subscription.id} - User: {subscription.user.username}")
-            
-            # Send invoice email notification
-            if send_invoice_created_email(invoice):
-                emails_sent += 1
+    logger.info(f"Invoice shard {first_id}-{last_id} complete. Created {stats['invoices_created']} invoices, sent {stats['emails_sent']} emails")
+    return stats
+
+@shared_task
+def combine_invoice_shard_results(results):
+    """
+    Chord callback combining the counts reported by each invoice shard
+    """
+    invoices_created = sum(result['invoices_created'] for result in results)
+    emails_sent = sum(result['emails_sent'] for result in results)
     
-    logger.info(f"Invoice generation complete. Created {invoices_created} invoices, sent {emails_sent} emails")
+    logger.info(f"Invoice generation complete. {len(results)} shards created {invoices_created} invoices, sent {emails_sent} emails")
     return f"Generated {invoices_created} invoices, sent {emails_sent} emails"
 
 @shared_task
@@ -72,11 +95,8 @@ def mark_overdue_invoices():
         due_date__lt=today
     )
     
-    count = overdue_invoices.count()
-    logger.info(f"Found {count} overdue invoices")
-    
-    # Update status to overdue
-    overdue_invoices.update(status='overdue')
+    # Update status to overdue, moving the invoices between revenue rollup buckets
+    count = change_invoice_status(overdue_invoices, 'overdue')
     
     logger.info(f"Marked {count} invoices as overdue")
     return f"Marked {count} invoices as overdue"
@@ -84,27 +104,11 @@ def mark_overdue_invoices():
 @shared_task
 def send_payment_reminders():
     """
-    Send payment reminders for overdue invoices
-    This task runs daily
+    Retired: overdue reminders are part of send_daily_billing_notices
+    Does nothing, so a leftover schedule entry cannot send a second reminder
     """
-    logger.info("Starting payment reminder task")
-    
-    overdue_invoices = Invoice.objects.filter(status='overdue')
-    reminder_count = 0
-    emails_sent = 0
-    
-    logger.info(f"Found {overdue_invoices.count()} overdue invoices requiring reminders")
-    
-    for invoice in overdue_invoices:
-        logger.info(f"Sending reminder for invoice {invoice.uuid} - User: {invoice.user.username}")
-        reminder_count += 1
-        
-        # Send reminder email
-        if send_payment_reminder_email(invoice):
-            emails_sent += 1
-    
-    logger.info(f"Sent {reminder_count} payment reminders, {emails_sent} emails delivered")
-    return f"Sent {reminder_count} payment reminders, {emails_sent} emails delivered"
+    logger.warning("send_payment_reminders is retired; overdue reminders are sent by send_daily_billing_notices")
+    return "Skipped: payment reminders are sent by send_daily_billing_notices"
 
 @shared_task
 def send_monthly_subscription_renewals():
@@ -120,99 +124,89 @@ def send_monthly_subscription_renewals():
         status='active',
         end_date__lte=seven_days_from_now,
         end_date__gte=today
-    )
+    ).select_related('user', 'plan')
     
     logger.info(f"Found {expiring_subscriptions.count()} subscriptions expiring in the next 7 days")
     
-    emails_sent = 0
-    for subscription in expiring_subscriptions:
-        try:
-            # Send renewal reminder email
-            send_mail(
-                subject='🔔 Your Subscription is Expiring Soon!',
-                message='',
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[subscription.email or subscription.user.email],
-                html_message=render_to_string('billing/emails/subscription_renewal_reminder.html', {
-                    'subscription': subscription,
-                    'user': subscription.user,
-                    'plan': subscription.plan,
-                    'days_remaining': (subscription.end_date - today).days
-                }),
-                fail_silently=False,
-            )
-            emails_sent += 1
-            logger.info(f"Sent renewal reminder to {subscription.user.username} - expires {subscription.end_date}")
-        except Exception as e:
-            logger.error(f"Failed to send renewal reminder to {subscription.user.username}: {e}")
+    reminders = (
+        partial(
+            build_email_message,
+            '🔔 Your Subscription is Expiring Soon!',
+            'billing/emails/subscription_renewal_reminder.html',
+            {
+                'subscription': subscription,
+                'user': subscription.user,
+                'plan': subscription.plan,
+                'days_remaining': (subscription.end_date - today).days
+            },
+            [subscription.email or subscription.user.email]
+        )
+        for subscription in expiring_subscriptions.iterator()
+    )
+    emails_sent, emails_failed = send_email_batch(reminders)
     
-    logger.info(f"Monthly renewal reminders complete. Sent {emails_sent} emails")
+    logger.info(f"Monthly renewal reminders complete. Sent {emails_sent} emails, {emails_failed} failed")
     return f"Sent {emails_sent} subscription renewal reminders"
 
 @shared_task
-def send_monthly_billing_summary():
+def send_monthly_billing_summary(workers=None, chunk_size=None):
     """
     Send monthly billing summary to all active users
     This task runs monthly (1st of each month)
+    Rendering is CPU-bound, so with more than one worker (BILLING_SUMMARY_WORKERS)
+    the recipients are split into id ranges rendered and sent by
+    send_billing_summary_range subtasks, combined in a chord callback
     """
     logger.info("Starting monthly billing summary task")
-    today = timezone.now().date()
-    first_day_last_month = today.replace(day=1) - timedelta(days=1)
-    first_day_last_month = first_day_last_month.replace(day=1)
-    last_day_last_month = today.replace(day=1) - timedelta(days=1)
+    period_start, period_end = summary_period(timezone.now().date())
     
-    # Get all users with active subscriptions
-    users_with_subscriptions = User.objects.filter(
-        subscription__status='active'
-    ).distinct()
+    workers = workers or settings.BILLING_SUMMARY_WORKERS
+    if workers > 1:
+        ranges = recipient_ranges(workers)
+        if ranges:
+            chord([
+                send_billing_summary_range.s(period_start.isoformat(), period_end.isoformat(), first_id, last_id, chunk_size)
+                for first_id, last_id in ranges
+            ])(combine_billing_summary_results.s(time.time()))
+        logger.info(f"Dispatched {len(ranges)} monthly billing summary workers")
+        return f"Dispatched {len(ranges)} monthly billing summary workers"
     
-    logger.info(f"Found {users_with_subscriptions.count()} users with active subscriptions")
+    stats = send_billing_summaries(period_start, period_end, chunk_size=chunk_size)
+    rate = throughput(stats['sent'], stats['seconds'])
     
-    emails_sent = 0
-    for user in users_with_subscriptions:
-        try:
-            last_month_invoices = Invoice.objects.filter(
-                user=user,
-                issue_date__gte=first_day_last_month,
-                issue_date__lte=last_day_last_month
-            )
-            
-            active_subscriptions = Subscription.objects.filter(
-                user=user,
-                status='active'
-            )
-            
-            total_amount = sum(invoice.amount for invoice in last_month_invoices)
-            total_paid = sum(invoice.amount for invoice in last_month_invoices.filter(status='paid'))
-            total_pending = sum(invoice.amount for invoice in last_month_invoices.filter(status='pending'))
-            
-            user_email = user.email if user.email else None
-            if user_email:
-                send_mail(
-                    subject=f'Monthly Billing Summary - {last_day_last_month.strftime("%B %Y")}',
-                    message='',
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[user_email],
-                    html_message=render_to_string('billing/emails/monthly_billing_summary.html', {
-                        'user': user,
-                        'month_year': last_day_last_month.strftime("%B %Y"),
-                        'last_month_invoices': last_month_invoices,
-                        'active_subscriptions': active_subscriptions,
-                        'total_amount': total_amount,
-                        'total_paid': total_paid,
-                        'total_pending': total_pending,
-                        'invoice_count': last_month_invoices.count(),
-                    }),
-                    fail_silently=False,
-                )
-                emails_sent += 1
-                logger.info(f"Sent monthly summary to {user.username} - {last_month_invoices.count()} invoices, ${total_amount}")
-        
-        except Exception as e:
-            logger.error(f"Failed to send monthly summary to {user.username}: {e}")
+    logger.info(f"Monthly billing summary complete. Sent {stats['sent']} emails, {stats['failed']} failed in {stats['seconds']:.1f}s ({rate:.1f} msgs/sec)")
+    return f"Sent {stats['sent']} monthly billing summaries ({rate:.1f} msgs/sec)"
+
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def send_billing_summary_range(period_start, period_end, first_id, last_id, chunk_size=None):
+    """
+    Render and send the monthly summaries for one contiguous user id range
+    """
+    logger.info(f"Starting monthly billing summaries for users {first_id}-{last_id}")
+    
+    stats = send_billing_summaries(
+        date.fromisoformat(period_start),
+        date.fromisoformat(period_end),
+        first_id=first_id,
+        last_id=last_id,
+        chunk_size=chunk_size
+    )
+    
+    logger.info(f"Monthly billing summaries for users {first_id}-{last_id} complete. Sent {stats['sent']} emails, {stats['failed']} failed ({throughput(stats['sent'], stats['seconds']):.1f} msgs/sec)")
+    return stats
+
+@shared_task
+def combine_billing_summary_results(results, started_at):
+    """
+    Chord callback combining the counts reported by each summary worker
+    Throughput is measured from dispatch to the last worker finishing
+    """
+    emails_sent = sum(result['sent'] for result in results)
+    emails_failed = sum(result['failed'] for result in results)
+    rate = throughput(emails_sent, time.time() - started_at)
     
-    logger.info(f"Monthly billing summary complete. Sent {emails_sent} emails")
-    return f"Sent {emails_sent} monthly billing summaries"
+    logger.info(f"Monthly billing summary complete. {len(results)} workers sent {emails_sent} emails, {emails_failed} failed ({rate:.1f} msgs/sec)")
+    return f"Sent {emails_sent} monthly billing summaries ({rate:.1f} msgs/sec)"
 
 @shared_task
 def send_monthly_admin_report():
@@ -227,10 +221,14 @@ def send_monthly_admin_report():
     last_day_last_month = today.replace(day=1) - timedelta(days=1)
     
     try:
-        last_month_invoices = Invoice.objects.filter(
-            issue_date__gte=first_day_last_month,
-            issue_date__lte=last_day_last_month
-        )
+        # Revenue per status comes from the rollup: a few rows instead of every invoice
+        revenue = {}
+        for status, invoice_count, amount in RevenueRollup.objects.filter(
+            month=first_day_last_month
+        ).values_list('status', 'invoice_count', 'amount'):
+            totals = revenue.setdefault(status, {'invoice_count': 0, 'amount': 0})
+            totals['invoice_count'] += invoice_count
+            totals['amount'] += amount
         
         new_subscriptions = Subscription.objects.filter(
             start_date__gte=first_day_last_month,
@@ -242,9 +240,9 @@ def send_monthly_admin_report():
             date_joined__lte=last_day_last_month
         )
         
-        total_revenue = sum(invoice.amount for invoice in last_month_invoices.filter(status='paid'))
-        pending_revenue = sum(invoice.amount for invoice in last_month_invoices.filter(status='pending'))
-        overdue_revenue = sum(invoice.amount for invoice in last_month_invoices.filter(status='overdue'))
+        total_revenue = revenue.get('paid', {}).get('amount', 0)
+        pending_revenue = revenue.get('pending', {}).get('amount', 0)
+        overdue_revenue = revenue.get('overdue', {}).get('amount', 0)
         
         total_active_subscriptions = Subscription.objects.filter(status='active').count()
         
@@ -263,7 +261,7 @@ def send_monthly_admin_report():
                 'new_subscriptions_count': new_subscriptions.count(),
                 'new_users_count': new_users.count(),
                 'total_active_subscriptions': total_active_subscriptions,
-                'invoices_generated': last_month_invoices.count(),
+                'invoices_generated': sum(row['invoice_count'] for row in revenue.values()),
                 'new_subscriptions': new_subscriptions,
                 'metrics_period': f"{first_day_last_month.strftime('%Y-%m-%d')} to {last_day_last_month.strftime('%Y-%m-%d')}"
             }),
@@ -278,66 +276,56 @@ def send_monthly_admin_report():
         return f"Failed to send monthly admin report: {e}"
 
 @shared_task
-def send_unpaid_invoice_reminders():
+def send_daily_billing_notices():
     """
-    Send daily reminders to users with unpaid invoices (pending or overdue)
-    This task runs daily
+    Send each user with unpaid invoices one combined billing notice
+    This task runs daily and replaces the separate per-invoice payment reminders
+    and per-user unpaid invoice reminders with a single scan and a single email
     """
-    logger.info("Starting unpaid invoice reminders task")
+    logger.info("Starting daily billing notices task")
     
-    # Get all unpaid invoices (both pending and overdue)
-    unpaid_invoices = Invoice.objects.filter(status__in=['pending', 'overdue'])
+    notices = (partial(build_daily_notice_email, notice) for notice in plan_daily_notices())
+    emails_sent, emails_failed = send_email_batch(notices)
     
-    # Group invoices by user
-    users_with_unpaid = {}
-    for invoice in unpaid_invoices:
-        user_id = invoice.user.id
-        if user_id not in users_with_unpaid:
-            users_with_unpaid[user_id] = []
-        users_with_unpaid[user_id].append(invoice)
-    
-    logger.info(f"Found {len(users_with_unpaid)} users with unpaid invoices")
+    logger.info(f"Daily billing notices complete. Sent {emails_sent} emails, {emails_failed} failed")
+    return f"Sent billing notices to {emails_sent} users with unpaid invoices. {emails_failed} failed."
+
+@shared_task
+def send_unpaid_invoice_reminders():
+    """
+    Retired: unpaid invoice reminders are part of send_daily_billing_notices
+    Does nothing, so a leftover schedule entry cannot send a second notice
+    """
+    logger.warning("send_unpaid_invoice_reminders is retired; unpaid reminders are sent by send_daily_billing_notices")
+    return "Skipped: unpaid invoice reminders are sent by send_daily_billing_notices"
+
+@shared_task
+def snapshot_mrr():
+    """
+    Extend the daily MRR snapshots through yesterday
+    This task runs daily; each missing day is built from the one before it
+    """
+    logger.info("Starting MRR snapshot task")
+    days = build_mrr_snapshots()
     
+    logger.info(f"MRR snapshots complete. Built {days} days")
+    return f"Built {days} days of MRR snapshots"
+
+@shared_task
+def dispatch_email_outbox():
+    """
+    Send the emails queued in the EmailOutbox by web and API requests
+    This task runs every 30 seconds and drains due rows batch by batch
+    """
     emails_sent = 0
     emails_failed = 0
+    while True:
+        sent, failed = dispatch_outbox()
+        if not sent and not failed:
+            break
+        emails_sent += sent
+        emails_failed += failed
     
-    for user_id, user_invoices in users_with_unpaid.items():
-        user = user_invoices[0].user
-        
-        # Skip if user has no email
-        if not user.email:
-            logger.warning(f"User {user.username} has no email address, skipping reminder")
-            continue
-        
-        try:
-            # Calculate total amount due
-            total_amount = sum(invoice.amount for invoice in user_invoices)
-            
-            context = {
-                'user': user,
-                'invoices': user_invoices,
-                'total_amount': total_amount,
-                'invoice_count': len(user_invoices)
-            }
-            
-            subject = f"Payment Reminder: You have {len(user_invoices)} unpaid invoice{'s' if len(user_invoices) > 1 else ''}"
-            message = render_to_string('billing/emails/unpaid_invoice_reminder.html', context)
-            
-            send_mail(
-                subject=subject,
-                message='',  # Empty plain text, use html_message
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                html_message=message,
-                fail_silently=False,
-            )
-            
-            emails_sent += 1
-            logger.info(f"Sent unpaid invoice reminder to {user.username} - {len(user_invoices)} invoices, ${total_amount}")
-            
-        except Exception as e:
-            emails_failed += 1
-            logger.error(f"Failed to send unpaid invoice reminder to {user.username}: {e}")
-    
-    logger.info(f"Unpaid invoice reminders complete. Sent {emails_sent} emails, {emails_failed} failed")
-    return f"Sent reminders to {emails_sent} users with unpaid invoices. {emails_failed} failed." 
\ No newline at end of file
+    if emails_sent or emails_failed:
+        logger.info(f"Email outbox dispatch complete. Sent {emails_sent} emails, {emails_failed} failed")
+    return f"Sent {emails_sent} outbox emails, {emails_failed} failed"
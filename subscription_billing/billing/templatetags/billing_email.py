@@ -0,0 +1,26 @@
+from django import template
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from functools import lru_cache
+
+register = template.Library()
+
+@lru_cache(maxsize=4)
+def _render_footer(template_name, year):
+    # The footer only depends on the year, so it is rendered once per worker process
+    return render_to_string(template_name, {'year': year})
+
+@register.simple_tag
+def email_footer():
+    """
+    Static HTML footer shared by every email, rendered once and reused
+    """
+    return mark_safe(_render_footer('billing/emails/_footer.html', timezone.now().year))
+
+@register.simple_tag
+def email_footer_text():
+    """
+    Plain-text counterpart of email_footer
+    """
+    return _render_footer('billing/emails/_footer.txt', timezone.now().year)
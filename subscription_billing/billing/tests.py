@@ -1,7 +1,52 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.db import connection
+from django.contrib.auth.models import User
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
-from billing.models import Plan
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from billing.models import Plan, Subscription, SubscriptionChange, Invoice, BillingRun, EmailOutbox, RevenueRollup, MrrSnapshot, UserBillingStats
+from billing.invoicing import generate_invoices_for_date, shard_ranges
+from billing.tasks import (
+    generate_invoice_shard, combine_invoice_shard_results,
+    send_payment_reminders, send_unpaid_invoice_reminders, send_daily_billing_notices,
+    send_monthly_billing_summary, send_billing_summary_range, combine_billing_summary_results,
+    mark_overdue_invoices, send_monthly_admin_report, snapshot_mrr, dispatch_email_outbox
+)
+from billing.utils import send_email_batch, build_payment_reminder_email
+from billing.summaries import summary_period, summary_recipients, recipient_ranges
+from billing.rollups import rebuild_revenue_rollups
+from billing.stats import verify_user_billing_stats
+from billing.exports import iter_invoice_rows
+from billing.analytics import cohort_analytics, load_subscriptions
+from billing.mrr import build_mrr_snapshots, active_on, mrr_series, mrr_forecast
+from billing.serializers import PlanSerializer, SubscriptionSerializer, InvoiceSerializer
+from billing.renderers import FastJSONRenderer, FastJSONParser
+from billing.views import InvoiceViewSet, SubscriptionViewSet
+from billing.authentication import LastLoginBatch, blacklisted_jtis
+from django.core.cache import cache
+import numpy as np
 from django.utils import timezone
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from dateutil.relativedelta import relativedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
 
 class APIFunctionalTests(TestCase):
     def setUp(self):
@@ -74,3 +119,1610 @@ class APIFunctionalTests(TestCase):
         cancel_response = self.client.post(cancel_url)
         print("Cancel Subscription Response:", cancel_response.status_code, cancel_response.data)
         self.assertEqual(cancel_response.status_code, 200)
+
+
+class InvoiceGenerationTests(TestCase):
+    def setUp(self):
+        self.plan = Plan.objects.create(name='pro', price=Decimal('19.99'), description='Pro plan')
+        self.today = timezone.now().date()
+
+    def create_subscriptions(self, count, start_date=None):
+        # Started a month ago by default, so the first recurring invoice is due today
+        start_date = start_date or self.today - relativedelta(months=1)
+        for i in range(count):
+            user = User.objects.create_user(username=f'billing{Subscription.objects.count()}', email=f'user{i}@example.com')
+            Subscription.objects.create(
+                user=user,
+                plan=self.plan,
+                start_date=start_date,
+                end_date=start_date + timedelta(days=365),
+                status='active'
+            )
+
+    def test_generates_one_invoice_per_due_subscription(self):
+        self.create_subscriptions(3)
+        self.create_subscriptions(2, start_date=self.today - relativedelta(months=1, days=-1))
+
+        stats = generate_invoices_for_date(self.today, chunk_size=2)
+
+        self.assertEqual(stats['invoices_created'], 3)
+        self.assertEqual(stats['chunks'], 2)
+        self.assertEqual(Invoice.objects.filter(issue_date=self.today).count(), 3)
+        invoice = Invoice.objects.first()
+        self.assertEqual(invoice.email, invoice.user.email)
+        self.assertEqual(invoice.amount, self.plan.price)
+
+    def test_query_count_does_not_grow_with_subscriptions(self):
+        self.create_subscriptions(2)
+        with CaptureQueriesContext(connection) as small_run:
+            generate_invoices_for_date(self.today, chunk_size=100, send_emails=False)
+
+        Invoice.objects.all().delete()
+        BillingRun.objects.all().delete()
+        RevenueRollup.objects.all().delete()
+        self.create_subscriptions(8)
+        with CaptureQueriesContext(connection) as large_run:
+            generate_invoices_for_date(self.today, chunk_size=100, send_emails=False)
+
+        self.assertEqual(Invoice.objects.count(), 8)
+        self.assertEqual(len(small_run), len(large_run))
+
+    def test_shards_cover_due_subscriptions_without_overlap(self):
+        self.create_subscriptions(7)
+        due_ids = list(Subscription.objects.values_list('id', flat=True))
+
+        shards = shard_ranges(self.today, shard_count=3)
+
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(shards[0][0], min(due_ids))
+        self.assertEqual(shards[-1][1], max(due_ids))
+        for (_, previous_last), (next_first, _) in zip(shards, shards[1:]):
+            self.assertEqual(next_first, previous_last + 1)
+        self.assertEqual(len(shard_ranges(self.today, shard_size=2)), 4)
+
+    def test_shard_task_bills_only_its_range(self):
+        self.create_subscriptions(4)
+        first_id, second_id, *_ = Subscription.objects.order_by('id').values_list('id', flat=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = generate_invoice_shard(self.today.isoformat(), first_id, second_id)
+
+        self.assertEqual(result['invoices_created'], 2)
+        self.assertEqual(result['emails_sent'], 2)
+        self.assertEqual(Invoice.objects.count(), 2)
+        self.assertEqual(
+            combine_invoice_shard_results([result, {'invoices_created': 3, 'emails_sent': 1}]),
+            "Generated 5 invoices, sent 3 emails"
+        )
+
+    def test_rerun_does_not_duplicate_invoices(self):
+        self.create_subscriptions(3)
+
+        generate_invoices_for_date(self.today, chunk_size=2)
+        BillingRun.objects.update(status='running')
+        stats = generate_invoices_for_date(self.today, chunk_size=2)
+
+        self.assertEqual(stats['invoices_created'], 0)
+        self.assertEqual(Invoice.objects.count(), 3)
+        run = BillingRun.objects.get(billing_date=self.today, scope='all')
+        self.assertEqual(run.status, 'completed')
+        self.assertEqual(run.invoices_created, 3)
+
+    def test_resumes_from_checkpoint(self):
+        self.create_subscriptions(4)
+        first_id = Subscription.objects.order_by('id').values_list('id', flat=True)[1]
+        BillingRun.objects.create(billing_date=self.today, scope='all', last_subscription_id=first_id)
+
+        stats = generate_invoices_for_date(self.today, chunk_size=10)
+
+        self.assertEqual(stats['invoices_created'], 2)
+        self.assertFalse(Invoice.objects.filter(subscription_id__lte=first_id).exists())
+
+    def test_skips_subscription_already_invoiced_for_period(self):
+        self.create_subscriptions(1)
+        subscription = Subscription.objects.get()
+        Invoice.objects.create(
+            user=subscription.user,
+            subscription=subscription,
+            amount=self.plan.price,
+            issue_date=self.today,
+            due_date=self.today + timedelta(days=15),
+            billing_period=self.today
+        )
+
+        stats = generate_invoices_for_date(self.today)
+
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(Invoice.objects.count(), 1)
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.next_billing_date, self.today + relativedelta(months=1))
+
+    def test_new_subscription_is_not_billed_again_on_its_start_day(self):
+        self.create_subscriptions(1, start_date=self.today)
+
+        stats = generate_invoices_for_date(self.today)
+
+        self.assertEqual(stats['invoices_created'], 0)
+        self.assertEqual(Subscription.objects.get().next_billing_date, self.today + relativedelta(months=1))
+
+    def test_month_end_anchor_bills_in_short_months(self):
+        user = User.objects.create_user(username='monthend', email='monthend@example.com')
+        subscription = Subscription.objects.create(
+            user=user,
+            plan=self.plan,
+            start_date=date(2026, 1, 31),
+            end_date=date(2026, 12, 31),
+            status='active'
+        )
+        self.assertEqual(subscription.next_billing_date, date(2026, 2, 28))
+
+        generate_invoices_for_date(date(2026, 2, 28), send_emails=False)
+
+        subscription.refresh_from_db()
+        self.assertEqual(Invoice.objects.get().billing_period, date(2026, 2, 28))
+        self.assertEqual(subscription.next_billing_date, date(2026, 3, 31))
+
+    def test_catches_up_missed_billing_dates_in_one_pass(self):
+        user = User.objects.create_user(username='catchup', email='catchup@example.com')
+        subscription = Subscription.objects.create(
+            user=user,
+            plan=self.plan,
+            start_date=date(2026, 1, 15),
+            end_date=date(2026, 12, 31),
+            status='active'
+        )
+
+        stats = generate_invoices_for_date(date(2026, 4, 20), send_emails=False)
+
+        self.assertEqual(stats['invoices_created'], 3)
+        self.assertEqual(
+            list(Invoice.objects.order_by('billing_period').values_list('billing_period', flat=True)),
+            [date(2026, 2, 15), date(2026, 3, 15), date(2026, 4, 15)]
+        )
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.next_billing_date, date(2026, 5, 15))
+
+    def test_backfill_command_respects_since(self):
+        user = User.objects.create_user(username='backfill', email='backfill@example.com')
+        Subscription.objects.create(
+            user=user,
+            plan=self.plan,
+            start_date=date(2026, 1, 15),
+            end_date=date(2026, 12, 31),
+            status='active'
+        )
+
+        call_command('generate_invoices', since='2026-03-01', until='2026-04-20', no_emails=True, stdout=StringIO())
+
+        self.assertEqual(
+            list(Invoice.objects.order_by('billing_period').values_list('billing_period', flat=True)),
+            [date(2026, 3, 15), date(2026, 4, 15)]
+        )
+
+
+class CountingEmailBackend(locmem.EmailBackend):
+    """
+    Local SMTP stand-in that records how many connections were opened
+    Set fail_next to make the next send fail, like a dropped SMTP session
+    """
+    connections_opened = 0
+    fail_next = 0
+
+    def open(self):
+        CountingEmailBackend.connections_opened += 1
+        return True
+
+    def send_messages(self, messages):
+        if CountingEmailBackend.fail_next:
+            CountingEmailBackend.fail_next -= 1
+            raise ConnectionError("connection dropped")
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='billing.tests.CountingEmailBackend')
+class BatchEmailTests(TestCase):
+    def setUp(self):
+        CountingEmailBackend.connections_opened = 0
+        CountingEmailBackend.fail_next = 0
+        self.plan = Plan.objects.create(name='basic', price=Decimal('9.99'), description='Basic plan')
+        self.today = timezone.now().date()
+        for i in range(5):
+            user = User.objects.create_user(username=f'reminder{i}', email=f'reminder{i}@example.com')
+            subscription = Subscription.objects.create(
+                user=user,
+                plan=self.plan,
+                start_date=self.today,
+                end_date=self.today + timedelta(days=30),
+                status='active'
+            )
+            Invoice.objects.create(
+                user=user,
+                subscription=subscription,
+                amount=self.plan.price,
+                issue_date=self.today - timedelta(days=30),
+                due_date=self.today - timedelta(days=15),
+                status='overdue'
+            )
+
+    def test_daily_notices_share_one_connection(self):
+        send_daily_billing_notices()
+
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(CountingEmailBackend.connections_opened, 1)
+
+    @override_settings(EMAIL_BATCH_SIZE=2)
+    def test_connection_is_recycled_after_batch_size_messages(self):
+        send_daily_billing_notices()
+
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(CountingEmailBackend.connections_opened, 3)
+
+    def test_retired_reminder_tasks_send_nothing(self):
+        send_payment_reminders()
+        send_unpaid_invoice_reminders()
+
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_reconnects_and_retries_after_error(self):
+        CountingEmailBackend.fail_next = 1
+
+        sent, failed = send_email_batch(
+            build_payment_reminder_email(invoice) for invoice in Invoice.objects.all()
+        )
+
+        self.assertEqual((sent, failed), (5, 0))
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(CountingEmailBackend.connections_opened, 2)
+
+    def test_text_part_is_rendered_from_text_template(self):
+        message = build_payment_reminder_email(Invoice.objects.first())
+
+        html, _ = message.alternatives[0]
+        self.assertNotIn('<', message.body)
+        self.assertIn('Subscription Billing System', message.body)
+        self.assertIn('Subscription Billing System', html)
+
+    def test_daily_notices_send_one_email_per_user_from_one_scan(self):
+        user = User.objects.get(username='reminder0')
+        subscription = user.subscriptions.get()
+        for status in ('overdue', 'pending'):
+            Invoice.objects.create(
+                user=user,
+                subscription=subscription,
+                amount=self.plan.price,
+                issue_date=self.today - timedelta(days=5),
+                due_date=self.today + timedelta(days=10),
+                status=status
+            )
+
+        with CaptureQueriesContext(connection) as queries:
+            send_daily_billing_notices()
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(mail.outbox), 5)
+        notice = next(message for message in mail.outbox if message.to == ['reminder0@example.com'])
+        self.assertEqual(notice.subject, 'Payment Overdue: 2 invoices past due')
+        self.assertIn('3 unpaid invoices', notice.body)
+        self.assertIn('Total Amount Due: $29.97', notice.body)
+
+
+class MonthlySummaryTests(TestCase):
+    def setUp(self):
+        self.plan = Plan.objects.create(name='premium', price=Decimal('29.99'), description='Premium plan')
+        self.today = timezone.now().date()
+        self.period_start, self.period_end = summary_period(self.today)
+        for i in range(5):
+            user = User.objects.create_user(username=f'summary{i}', email=f'summary{i}@example.com')
+            subscription = Subscription.objects.create(
+                user=user,
+                plan=self.plan,
+                start_date=self.period_start,
+                end_date=self.period_start + timedelta(days=365),
+                status='active'
+            )
+            Invoice.objects.create(
+                user=user,
+                subscription=subscription,
+                amount=self.plan.price,
+                issue_date=self.period_start,
+                due_date=self.period_start + timedelta(days=15),
+                status='paid' if i % 2 else 'pending'
+            )
+        User.objects.create_user(username='no-subscription', email='nosub@example.com')
+
+    def test_sends_one_summary_per_subscriber(self):
+        result = send_monthly_billing_summary(workers=1, chunk_size=2)
+
+        self.assertTrue(result.startswith("Sent 5 monthly billing summaries ("))
+        self.assertIn("msgs/sec", result)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].subject, f"Monthly Billing Summary - {self.period_end.strftime('%B %Y')}")
+
+    def test_totals_come_from_one_grouped_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            users = list(summary_recipients(self.period_start, self.period_end))
+
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(len(users), 5)
+        paid_user, pending_user = users[1], users[0]
+        self.assertEqual((paid_user.invoice_count, paid_user.total_paid, paid_user.total_pending), (1, Decimal('29.99'), Decimal('0')))
+        self.assertEqual((pending_user.total_amount, pending_user.total_pending), (Decimal('29.99'), Decimal('29.99')))
+        self.assertEqual(len(pending_user.last_month_invoices), 1)
+        self.assertEqual(pending_user.active_subscriptions[0].plan, self.plan)
+
+    def test_query_count_does_not_grow_with_recipients(self):
+        with CaptureQueriesContext(connection) as small_run:
+            send_monthly_billing_summary(workers=1, chunk_size=100)
+
+        for i in range(5, 10):
+            user = User.objects.create_user(username=f'summary{i}', email=f'summary{i}@example.com')
+            Subscription.objects.create(
+                user=user,
+                plan=self.plan,
+                start_date=self.period_start,
+                end_date=self.period_start + timedelta(days=365),
+                status='active'
+            )
+        with CaptureQueriesContext(connection) as large_run:
+            send_monthly_billing_summary(workers=1, chunk_size=100)
+
+        self.assertEqual(len(mail.outbox), 15)
+        self.assertEqual(len(small_run), len(large_run))
+
+    def test_worker_ranges_split_recipients_without_overlap(self):
+        user_ids = list(User.objects.filter(username__startswith='summary').values_list('id', flat=True))
+
+        ranges = recipient_ranges(workers=2)
+
+        self.assertEqual(len(ranges), 2)
+        self.assertEqual(ranges[0][0], min(user_ids))
+        self.assertEqual(ranges[-1][1], max(user_ids))
+        self.assertEqual(ranges[1][0], ranges[0][1] + 1)
+
+    def test_range_task_sends_only_its_users(self):
+        first_id, second_id, *_ = User.objects.filter(username__startswith='summary').order_by('id').values_list('id', flat=True)
+
+        result = send_billing_summary_range(self.period_start.isoformat(), self.period_end.isoformat(), first_id, second_id)
+
+        self.assertEqual((result['sent'], result['failed']), (2, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['summary0@example.com', 'summary1@example.com'])
+        self.assertTrue(
+            combine_billing_summary_results([result, {'sent': 3, 'failed': 0}], time.time()).startswith("Sent 5 monthly billing summaries")
+        )
+
+
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.plan = Plan.objects.create(name='basic', price=Decimal('9.99'), description='Basic plan')
+        self.user = User.objects.create_user(username='outbox', email='outbox@example.com', password='securepassword123')
+        self.client.force_authenticate(self.user)
+
+    def test_subscribe_queues_email_instead_of_sending(self):
+        response = self.client.post('/api/subscriptions/', {'plan': self.plan.id, 'start_date': str(timezone.now().date())}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        entry = EmailOutbox.objects.get()
+        self.assertEqual(entry.kind, 'subscription_confirmation')
+        self.assertEqual(entry.payload, {'subscription_id': response.data['id']})
+
+        self.assertEqual(dispatch_email_outbox(), "Sent 1 outbox emails, 0 failed")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['outbox@example.com'])
+        self.assertEqual(EmailOutbox.objects.get().status, 'sent')
+
+    def test_pay_queues_payment_confirmation(self):
+        self.client.post('/api/subscriptions/', {'plan': self.plan.id, 'start_date': str(timezone.now().date())}, format='json')
+        invoice = Invoice.objects.get()
+
+        response = self.client.post(f'/api/invoices/{invoice.id}/pay/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(EmailOutbox.objects.filter(kind='payment_confirmation', payload={'invoice_id': invoice.id}).count(), 1)
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(EMAIL_BACKEND='billing.tests.CountingEmailBackend')
+    def test_failed_send_is_retried_with_backoff(self):
+        self.client.post('/api/subscriptions/', {'plan': self.plan.id, 'start_date': str(timezone.now().date())}, format='json')
+        CountingEmailBackend.fail_next = 2
+
+        dispatch_email_outbox()
+
+        entry = EmailOutbox.objects.get()
+        self.assertEqual(entry.status, 'pending')
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        dispatch_email_outbox()
+        self.assertEqual(EmailOutbox.objects.get().status, 'sent')
+
+    def test_rows_are_claimed_before_sending_and_never_resent(self):
+        self.client.post('/api/subscriptions/', {'plan': self.plan.id, 'start_date': str(timezone.now().date())}, format='json')
+        statuses = []
+        send = locmem.EmailBackend.send_messages
+
+        def send_and_look(backend, messages):
+            statuses.append(EmailOutbox.objects.get().status)
+            return send(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', send_and_look):
+            dispatch_email_outbox()
+        self.assertEqual(statuses, ['sending'])
+
+        # A dispatcher that died after claiming leaves the row 'sending'
+        EmailOutbox.objects.update(status='sending', next_attempt_at=timezone.now())
+        self.assertEqual(dispatch_email_outbox(), "Sent 0 outbox emails, 0 failed")
+        EmailOutbox.objects.update(next_attempt_at=timezone.now() - timedelta(hours=1))
+        dispatch_email_outbox()
+        self.assertEqual(EmailOutbox.objects.get().status, 'failed')
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class RevenueRollupTests(TestCase):
+    def setUp(self):
+        self.plan = Plan.objects.create(name='pro', price=Decimal('19.99'), description='Pro plan')
+        self.today = timezone.now().date()
+        self.month = self.today.replace(day=1)
+        for i in range(3):
+            user = User.objects.create_user(username=f'rollup{i}', email=f'rollup{i}@example.com')
+            Subscription.objects.create(
+                user=user,
+                plan=self.plan,
+                start_date=self.today - relativedelta(months=1),
+                end_date=self.today + timedelta(days=365),
+                status='active'
+            )
+        generate_invoices_for_date(self.today, send_emails=False)
+
+    def bucket(self, status):
+        rollup = RevenueRollup.objects.filter(month=self.month, plan=self.plan, status=status).first()
+        return (rollup.invoice_count, rollup.amount) if rollup else (0, Decimal('0'))
+
+    def assertMatchesRebuild(self):
+        incremental = set(RevenueRollup.objects.filter(invoice_count__gt=0).values_list('month', 'plan_id', 'status', 'invoice_count', 'amount'))
+        rebuild_revenue_rollups()
+        self.assertEqual(incremental, set(RevenueRollup.objects.values_list('month', 'plan_id', 'status', 'invoice_count', 'amount')))
+
+    def test_generation_adds_invoices_to_rollup(self):
+        self.assertEqual(self.bucket('pending'), (3, Decimal('59.97')))
+        self.assertMatchesRebuild()
+
+    def test_paying_moves_invoice_between_buckets(self):
+        user = User.objects.get(username='rollup0')
+        user.set_password('password')
+        user.save()
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.post(f'/api/invoices/{user.invoices.get().id}/pay/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.bucket('pending'), (2, Decimal('39.98')))
+        self.assertEqual(self.bucket('paid'), (1, Decimal('19.99')))
+        self.assertMatchesRebuild()
+
+    def test_concurrent_pays_move_the_invoice_once(self):
+        user = User.objects.get(username='rollup0')
+        client = APIClient()
+        client.force_authenticate(user)
+        invoice = user.invoices.get()
+        # The second request read the invoice before the first one committed
+        stale = Invoice.objects.get(pk=invoice.pk)
+
+        self.assertEqual(client.post(f'/api/invoices/{invoice.id}/pay/').status_code, 200)
+        client.force_login(user)
+        with mock.patch.object(InvoiceViewSet, 'get_object', return_value=stale):
+            response = client.post(f'/api/invoices/{invoice.id}/pay/')
+        with mock.patch('billing.views.get_object_or_404', return_value=stale):
+            web = client.post(reverse('pay_invoice', args=[invoice.uuid]))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(web.status_code, 302)
+        self.assertEqual(self.bucket('paid'), (1, Decimal('19.99')))
+        self.assertEqual(EmailOutbox.objects.filter(kind='payment_confirmation').count(), 1)
+        self.assertMatchesRebuild()
+
+    def test_mark_overdue_moves_invoices_in_bulk(self):
+        Invoice.objects.filter(user__username='rollup2').update(due_date=self.today - timedelta(days=1))
+
+        self.assertEqual(mark_overdue_invoices(), "Marked 1 invoices as overdue")
+
+        self.assertEqual(self.bucket('pending'), (2, Decimal('39.98')))
+        self.assertEqual(self.bucket('overdue'), (1, Decimal('19.99')))
+        self.assertMatchesRebuild()
+
+    def test_rebuild_command_repairs_drift(self):
+        RevenueRollup.objects.update(invoice_count=0, amount=0)
+
+        out = StringIO()
+        call_command('rebuild_revenue_rollups', f'--month={self.today:%Y-%m}', stdout=out)
+
+        self.assertIn('Wrote 1 revenue rollup rows', out.getvalue())
+        self.assertEqual(self.bucket('pending'), (3, Decimal('59.97')))
+
+    def test_admin_report_reads_rollup(self):
+        last_month = summary_period(self.today)[0]
+        RevenueRollup.objects.create(month=last_month, plan=self.plan, status='paid', invoice_count=4, amount=Decimal('79.96'))
+
+        with CaptureQueriesContext(connection) as queries:
+            result = send_monthly_admin_report()
+
+        self.assertEqual(result, "Sent monthly admin report - $79.96 revenue, 3 new subscriptions")
+        self.assertFalse(any('"billing_invoice"' in query['sql'] for query in queries))
+
+    def test_admin_edits_and_deletes_update_rollup_and_stats(self):
+        # setUp creates the subscriptions without counting them
+        verify_user_billing_stats(repair=True)
+        admin_user = User.objects.create_superuser(username='rollupadmin', email='admin@example.com', password='password')
+        self.client.force_login(admin_user)
+        invoice = Invoice.objects.get(user__username='rollup0')
+
+        response = self.client.post(f'/admin/billing/invoice/{invoice.id}/change/', {
+            'user': invoice.user_id, 'subscription': invoice.subscription_id, 'email': invoice.email,
+            'amount': '25.00', 'issue_date': invoice.issue_date, 'due_date': invoice.due_date, 'status': 'paid',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.bucket('pending'), (2, Decimal('39.98')))
+        self.assertEqual(self.bucket('paid'), (1, Decimal('25.00')))
+
+        response = self.client.post('/admin/billing/invoice/', {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': list(Invoice.objects.filter(status='pending').values_list('id', flat=True)),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.bucket('pending'), (0, Decimal('0')))
+        self.assertMatchesRebuild()
+        self.assertEqual(verify_user_billing_stats(), [])
+
+
+class InvoiceExportTests(TestCase):
+    def setUp(self):
+        self.plan = Plan.objects.create(name='basic', price=Decimal('9.99'), description='Basic plan')
+        self.today = timezone.now().date()
+        self.user = User.objects.create_user(username='finance', email='finance@example.com')
+        self.other = User.objects.create_user(username='other', email='other@example.com')
+        for user in (self.user, self.other):
+            subscription = Subscription.objects.create(
+                user=user,
+                plan=self.plan,
+                start_date=self.today - timedelta(days=90),
+                end_date=self.today + timedelta(days=275),
+                status='active'
+            )
+            for days_ago, invoice_status in ((60, 'paid'), (30, 'paid'), (30, 'overdue'), (0, 'pending')):
+                Invoice.objects.create(
+                    user=user,
+                    subscription=subscription,
+                    amount=self.plan.price,
+                    issue_date=self.today - timedelta(days=days_ago),
+                    due_date=self.today - timedelta(days=days_ago - 15),
+                    status=invoice_status
+                )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_csv_export_streams_own_invoices_in_keyset_order(self):
+        response = self.client.get('/api/invoices/export/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(line.decode() for line in response.streaming_content))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({row['user_id'] for row in rows}, {str(self.user.id)})
+        self.assertEqual([row['issue_date'] for row in rows], sorted(row['issue_date'] for row in rows))
+        self.assertEqual(rows[0]['plan'], 'basic')
+
+    def test_jsonl_export_filters_by_date_and_status(self):
+        since = (self.today - timedelta(days=45)).isoformat()
+
+        response = self.client.get(f'/api/invoices/export/?output=jsonl&from={since}&status=paid,overdue')
+
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted(row['status'] for row in rows), ['overdue', 'paid'])
+        self.assertEqual(rows[0]['amount'], '9.99')
+
+    def test_export_rejects_bad_params(self):
+        self.assertEqual(self.client.get('/api/invoices/export/?output=xml').status_code, 400)
+        self.assertEqual(self.client.get('/api/invoices/export/?from=yesterday').status_code, 400)
+        self.assertEqual(self.client.get('/api/invoices/export/?status=unknown').status_code, 400)
+
+    def test_export_all_is_staff_only(self):
+        self.assertEqual(self.client.get('/api/invoices/export-all/').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/invoices/export-all/?output=jsonl')
+
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 8)
+
+    def test_keyset_pages_cover_every_row_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            ids = [row[0] for row in iter_invoice_rows(Invoice.objects.all(), chunk_size=3)]
+
+        self.assertEqual(sorted(ids), sorted(Invoice.objects.values_list('id', flat=True)))
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(queries), 3)
+        self.assertFalse(any('COUNT' in query['sql'] or 'OFFSET' in query['sql'] for query in queries))
+
+
+class CohortAnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.plan = Plan.objects.create(name='basic', price=Decimal('9.99'), description='Basic plan')
+        self.today = timezone.now().date()
+        self.this_month = self.today.year * 12 + self.today.month - 1
+
+    def test_retention_churn_and_conversion(self):
+        month = 2026 * 12
+        # Customer 1 stays three months, 2 leaves after one, 3 comes back after a gap, 4 joins a month later
+        user_ids = np.array([1, 2, 3, 3, 4])
+        starts = np.array([month, month, month, month + 2, month + 1], dtype=np.int32)
+        stops = np.array([month + 2, month, month, month + 3, month + 3], dtype=np.int32)
+
+        result = cohort_analytics(user_ids, starts, stops, np.array([1, 4]), month + 3, 3)
+
+        self.assertEqual(result['cohorts'], ['2026-01', '2026-02'])
+        self.assertEqual(result['sizes'], [3, 1])
+        self.assertEqual(result['retention'][0], [1.0, 0.3333, 0.6667, 0.3333])
+        self.assertEqual(result['retention'][1], [1.0, 1.0, 1.0, None])
+        self.assertEqual(result['conversion'], [0.3333, 1.0])
+        self.assertEqual(
+            [(month['month'], month['active'], month['churned']) for month in result['churn']],
+            [('2026-02', 3, 2), ('2026-03', 2, 0), ('2026-04', 3, 1)]
+        )
+
+    def test_cancelled_subscription_stops_at_cancellation(self):
+        user = User.objects.create_user(username='cohort', email='cohort@example.com')
+        Subscription.objects.create(
+            user=user,
+            plan=self.plan,
+            start_date=self.today - relativedelta(months=3),
+            end_date=self.today + relativedelta(months=9),
+            status='cancelled',
+            cancelled_at=timezone.now()
+        )
+
+        user_ids, starts, stops = load_subscriptions()
+
+        self.assertEqual(user_ids.tolist(), [user.id])
+        self.assertEqual(starts.tolist(), [self.this_month - 3])
+        self.assertEqual(stops.tolist(), [self.this_month])
+
+    def test_api_is_staff_only_and_cached(self):
+        user = User.objects.create_user(username='analyst', email='analyst@example.com')
+        client = APIClient()
+        client.force_authenticate(user)
+        self.assertEqual(client.get('/api/analytics/cohorts/').status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        Subscription.objects.create(
+            user=user,
+            plan=self.plan,
+            start_date=self.today,
+            end_date=self.today + timedelta(days=30),
+            status='active'
+        )
+        first = client.get('/api/analytics/cohorts/?months=6').json()
+        with CaptureQueriesContext(connection) as queries:
+            second = client.get('/api/analytics/cohorts/?months=6').json()
+
+        self.assertEqual(first['customers'], 1)
+        self.assertEqual(second['generated_at'], first['generated_at'])
+        self.assertFalse(any('billing_' in query['sql'] for query in queries))
+        self.assertEqual(client.get('/api/analytics/cohorts/?months=0').status_code, 400)
+
+    def test_cohort_report_command(self):
+        user = User.objects.create_user(username='report', email='report@example.com')
+        Subscription.objects.create(
+            user=user,
+            plan=self.plan,
+            start_date=self.today,
+            end_date=self.today + timedelta(days=30),
+            status='active'
+        )
+
+        out = StringIO()
+        call_command('cohort_report', '--months=3', stdout=out)
+
+        self.assertIn(f'{self.today:%Y-%m}      1    0%  100.0     -     -     -', out.getvalue())
+        self.assertIn('1 customers, 0 paying', out.getvalue())
+
+
+class MrrSnapshotTests(TestCase):
+    def setUp(self):
+        self.basic = Plan.objects.create(name='basic', price=Decimal('10.00'), description='Basic plan')
+        self.pro = Plan.objects.create(name='pro', price=Decimal('30.00'), description='Pro plan')
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+        self.subscribe(self.basic, 10, 20)
+        self.subscribe(self.basic, 10, 20)
+        self.subscribe(self.basic, 8, -4)
+        cancelled = self.subscribe(self.pro, 5, 25)
+        cancelled.status = 'cancelled'
+        cancelled.cancelled_at = timezone.now() - timedelta(days=2)
+        cancelled.save()
+
+    def subscribe(self, plan, started_days_ago, ends_in_days):
+        user = User.objects.create_user(username=f'mrr{User.objects.count()}', email='mrr@example.com')
+        return Subscription.objects.create(
+            user=user,
+            plan=plan,
+            start_date=self.today - timedelta(days=started_days_ago),
+            end_date=self.today + timedelta(days=ends_in_days),
+            status='active'
+        )
+
+    def test_incremental_days_match_a_full_count(self):
+        self.assertEqual(snapshot_mrr(), "Built 10 days of MRR snapshots")
+
+        for snapshot in MrrSnapshot.objects.all():
+            self.assertEqual(
+                snapshot.active_subscriptions,
+                active_on(snapshot.date).filter(plan_on=snapshot.plan_id).count(),
+                f"{snapshot.plan.name} on {snapshot.date}"
+            )
+        latest = {row['date']: row for row in mrr_series(self.yesterday - timedelta(days=5), self.yesterday)}
+        self.assertEqual(latest[self.yesterday.isoformat()]['mrr'], 20.0)
+        self.assertEqual(latest[(self.today - timedelta(days=5)).isoformat()]['new_mrr'], 30.0)
+        self.assertEqual(latest[(self.today - timedelta(days=3)).isoformat()]['churned_mrr'], 10.0)
+
+    def test_nightly_run_reads_only_the_days_changes(self):
+        build_mrr_snapshots(until=self.today - timedelta(days=2))
+        self.subscribe(self.pro, 1, 30)
+
+        with CaptureQueriesContext(connection) as queries:
+            build_mrr_snapshots(until=self.yesterday)
+
+        subscription_reads = [query['sql'] for query in queries if 'FROM "billing_subscription"' in query['sql']]
+        self.assertEqual(len(subscription_reads), 2)
+        self.assertTrue(all('"start_date" =' in sql or '"end_date" =' in sql for sql in subscription_reads))
+        snapshot = MrrSnapshot.objects.get(date=self.yesterday, plan=self.pro)
+        self.assertEqual((snapshot.active_subscriptions, snapshot.new_mrr), (1, Decimal('30.00')))
+
+    def test_plan_changes_and_reactivations_match_a_full_count(self):
+        build_mrr_snapshots(until=self.today - timedelta(days=3))
+        client = APIClient()
+        upgraded = Subscription.objects.filter(plan=self.basic, end_date__gt=self.today).first()
+        client.force_authenticate(upgraded.user)
+        self.assertEqual(client.patch(f'/api/subscriptions/{upgraded.id}/', {'plan': self.pro.id}, format='json').status_code, 200)
+        reactivated = Subscription.objects.get(status='cancelled')
+        client.force_authenticate(reactivated.user)
+        self.assertEqual(client.patch(f'/api/subscriptions/{reactivated.id}/', {'status': 'active'}, format='json').status_code, 200)
+        SubscriptionChange.objects.filter(changed_at__gte=timezone.now() - timedelta(minutes=1)).update(
+            changed_at=timezone.now() - timedelta(days=1)
+        )
+
+        build_mrr_snapshots(until=self.today + timedelta(days=2))
+
+        for snapshot in MrrSnapshot.objects.all():
+            self.assertGreaterEqual(snapshot.active_subscriptions, 0)
+            self.assertEqual(
+                snapshot.active_subscriptions,
+                active_on(snapshot.date).filter(plan_on=snapshot.plan_id).count(),
+                f"{snapshot.plan.name} on {snapshot.date}"
+            )
+        moved = {row.plan_id: row for row in MrrSnapshot.objects.filter(date=self.yesterday)}
+        self.assertEqual((moved[self.basic.id].active_subscriptions, moved[self.pro.id].active_subscriptions), (1, 2))
+        self.assertEqual(moved[self.pro.id].new_subscriptions, 1)
+        self.assertEqual(sum(row.expansion_mrr for row in moved.values()), Decimal('20.00'))
+        self.assertEqual(MrrSnapshot.objects.get(date=self.today + timedelta(days=2), plan=self.pro).mrr, Decimal('60.00'))
+
+    def test_price_change_is_expansion(self):
+        build_mrr_snapshots(until=self.today - timedelta(days=2))
+        self.basic.price = Decimal('12.00')
+        self.basic.save()
+
+        build_mrr_snapshots(until=self.yesterday)
+
+        snapshot = MrrSnapshot.objects.get(date=self.yesterday, plan=self.basic)
+        self.assertEqual((snapshot.mrr, snapshot.expansion_mrr), (Decimal('24.00'), Decimal('4.00')))
+
+    def test_forecast_extends_the_trend(self):
+        series = [{'date': (self.today + timedelta(days=day)).isoformat(), 'mrr': 100.0 + 10 * day} for day in range(5)]
+
+        forecast = mrr_forecast(series, 2)
+
+        self.assertEqual([point['mrr'] for point in forecast], [150.0, 160.0])
+        self.assertEqual(forecast[0]['date'], (self.today + timedelta(days=5)).isoformat())
+
+    def test_api_serves_series_and_forecast_to_staff(self):
+        build_mrr_snapshots()
+        user = User.objects.create_user(username='cfo', email='cfo@example.com', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.get(f'/api/analytics/mrr/?from={self.today - timedelta(days=7)}&forecast=3')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['series']), 7)
+        self.assertEqual(len(response.json()['forecast']), 3)
+        self.assertEqual(response.json()['series'][-1]['arr'], 240.0)
+        self.assertEqual(client.get('/api/analytics/mrr/?from=soon').status_code, 400)
+
+    def test_cancelling_through_patch_sets_cancelled_at(self):
+        subscription = Subscription.objects.filter(plan=self.basic, status='active').first()
+        client = APIClient()
+        client.force_authenticate(subscription.user)
+        url = f'/api/subscriptions/{subscription.id}/'
+
+        self.assertEqual(client.patch(url, {'status': 'cancelled'}, format='json').status_code, 200)
+        subscription.refresh_from_db()
+        self.assertIsNotNone(subscription.cancelled_at)
+        self.assertFalse(active_on(self.today + timedelta(days=1)).filter(id=subscription.id).exists())
+
+        self.assertEqual(client.patch(url, {'status': 'active'}, format='json').status_code, 200)
+        subscription.refresh_from_db()
+        self.assertIsNone(subscription.cancelled_at)
+
+
+class ListQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='lister', email='lister@example.com')
+        self.plans = [
+            Plan.objects.create(name='basic', price=Decimal('9.99'), description='Basic'),
+            Plan.objects.create(name='pro', price=Decimal('29.50'), description='Pro'),
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_subscriptions(self, count):
+        today = timezone.now().date()
+        for index in range(count):
+            plan = self.plans[index % 2]
+            subscription = Subscription.objects.create(
+                user=self.user, plan=plan, email=self.user.email, status='active',
+                start_date=today, end_date=today + timedelta(days=30)
+            )
+            Invoice.objects.create(
+                user=self.user, subscription=subscription, email=self.user.email, amount=plan.price,
+                issue_date=today, due_date=today + timedelta(days=15), billing_period=today, status='pending'
+            )
+
+    def test_query_count_does_not_grow_with_rows(self):
+        endpoints = {
+            '/api/subscriptions/': 2,
+            '/api/invoices/': 2,
+            '/api/invoices/pending/': 1,
+        }
+        for rows in (1, 25):
+            self.add_subscriptions(rows)
+            for url, queries in endpoints.items():
+                with self.subTest(url=url, rows=rows), self.assertNumQueries(queries):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_list_output_matches_the_model_serializers(self):
+        self.add_subscriptions(3)
+
+        invoices = self.client.get('/api/invoices/').json()['results']
+        subscriptions = self.client.get('/api/subscriptions/').json()['results']
+        plans = self.client.get('/api/plans/').json()['results']
+
+        self.assertEqual(invoices, [InvoiceSerializer(invoice).data for invoice in Invoice.objects.order_by('id')])
+        self.assertEqual(subscriptions, [SubscriptionSerializer(sub).data for sub in Subscription.objects.order_by('id')])
+        self.assertEqual(plans, [PlanSerializer(plan).data for plan in Plan.objects.order_by('id')])
+        self.assertEqual(self.client.get('/api/invoices/pending/').json(), invoices)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='syncer', email='syncer@example.com')
+        self.plan = Plan.objects.create(name='basic', price=Decimal('10.00'), description='Basic')
+        self.today = timezone.now().date()
+        self.subscription = Subscription.objects.create(
+            user=self.user, plan=self.plan, status='active', start_date=self.today, end_date=self.today + timedelta(days=30)
+        )
+        # Issue dates deliberately out of id order, with ties
+        for index, days_ago in enumerate([3, 1, 3, 2, 1, 5, 2]):
+            Invoice.objects.create(
+                user=self.user, subscription=self.subscription, amount=self.plan.price,
+                issue_date=self.today - timedelta(days=days_ago), due_date=self.today,
+                billing_period=self.today - timedelta(days=index), status='pending'
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url):
+        uuids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            uuids += [row['uuid'] for row in response.json()['results']]
+            url, pages = response.json()['next'], pages + 1
+        return uuids, pages, response.json()['cursor']
+
+    def test_cursor_walks_every_invoice_in_keyset_order_without_counting(self):
+        with CaptureQueriesContext(connection) as queries:
+            uuids, pages, _ = self.walk('/api/invoices/?cursor=&page_size=3')
+
+        expected = [str(uuid) for uuid in Invoice.objects.order_by('issue_date', 'id').values_list('uuid', flat=True)]
+        self.assertEqual(uuids, expected)
+        self.assertEqual(pages, 3)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+        self.assertFalse(any('OFFSET' in query['sql'] for query in queries))
+
+    def test_changes_since_feed_resumes_from_its_cursor(self):
+        since = timezone.now()
+        changed = Invoice.objects.order_by('id')[2]
+        changed.status = 'paid'
+        changed.save()
+
+        uuids, _, cursor = self.walk(f'/api/invoices/?updated_since={since.isoformat().replace("+00:00", "Z")}')
+        self.assertEqual(uuids, [str(changed.uuid)])
+
+        self.assertEqual(self.client.get(f'/api/invoices/?cursor={cursor}').json()['results'], [])
+        rolled = Invoice.objects.order_by('id')[5]
+        rolled.status = 'cancelled'
+        rolled.save()
+        self.assertEqual(
+            [row['uuid'] for row in self.client.get(f'/api/invoices/?cursor={cursor}').json()['results']],
+            [str(rolled.uuid)]
+        )
+
+    def test_subscriptions_page_on_created_at(self):
+        Subscription.objects.create(
+            user=self.user, plan=self.plan, status='active', start_date=self.today, end_date=self.today + timedelta(days=30)
+        )
+
+        response = self.client.get('/api/subscriptions/?cursor=&page_size=1')
+
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.subscription.id])
+        self.assertIsNotNone(response.json()['next'])
+
+    def test_page_numbers_stay_the_default_and_bad_input_is_rejected(self):
+        self.assertEqual(self.client.get('/api/invoices/').json()['count'], 7)
+        self.assertEqual(self.client.get('/api/invoices/?cursor=not-a-cursor').status_code, 404)
+        self.assertEqual(self.client.get('/api/invoices/?updated_since=yesterday').status_code, 400)
+
+
+class PlanCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.plan = Plan.objects.create(name='basic', price=Decimal('9.99'), description='Basic')
+        self.client = APIClient()
+
+    def test_plans_are_served_from_the_catalog_with_validators(self):
+        first = self.client.get('/api/plans/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/plans/')
+            detail = self.client.get(f'/api/plans/{self.plan.id}/')
+
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(detail.json()['price'], '9.99')
+        self.assertTrue(first['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', first)
+        self.assertEqual(self.client.get('/api/plans/999/').status_code, 404)
+
+    def test_conditional_get_returns_not_modified(self):
+        etag = self.client.get('/api/plans/')['ETag']
+
+        response = self.client.get('/api/plans/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get('/api/plans/', HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_saving_a_plan_invalidates_the_catalog(self):
+        etag = self.client.get('/api/plans/')['ETag']
+
+        self.plan.price = Decimal('12.00')
+        self.plan.save()
+        Plan.objects.create(name='pro', price=Decimal('29.00'), description='Pro')
+
+        response = self.client.get('/api/plans/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([plan['price'] for plan in response.json()['results']], ['12.00', '29.00'])
+
+    def test_subscribe_resolves_the_plan_without_a_query(self):
+        user = User.objects.create_user(username='catalog', email='catalog@example.com')
+        self.client.force_authenticate(user)
+        self.client.get('/api/plans/')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/subscriptions/', {
+                'plan': self.plan.id, 'start_date': timezone.now().date().isoformat()
+            }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(any('FROM "billing_plan"' in query['sql'] for query in queries))
+        self.assertEqual(Invoice.objects.get(user=user).amount, Decimal('9.99'))
+        self.assertEqual(self.client.post('/api/subscriptions/', {'plan': 999}, format='json').status_code, 400)
+
+
+class UserBillingStatsTests(TestCase):
+    def setUp(self):
+        self.plan = Plan.objects.create(name='pro', price=Decimal('19.99'), description='Pro plan')
+        self.today = timezone.now().date()
+        self.user = User.objects.create_user(username='counted', email='counted@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def subscribe(self):
+        response = self.client.post('/api/subscriptions/', {'plan': self.plan.id, 'start_date': self.today.isoformat()}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def stats(self):
+        stats = UserBillingStats.objects.get(user=self.user)
+        return stats.active_subscriptions, stats.pending_invoices, stats.overdue_invoices, stats.outstanding_amount
+
+    def test_counters_follow_every_change(self):
+        first, second = self.subscribe(), self.subscribe()
+        self.assertEqual(self.stats(), (2, 2, 0, Decimal('39.98')))
+
+        Invoice.objects.filter(subscription_id=first).update(due_date=self.today - timedelta(days=1))
+        mark_overdue_invoices()
+        self.assertEqual(self.stats(), (2, 1, 1, Decimal('39.98')))
+
+        self.client.post(f'/api/invoices/{Invoice.objects.get(subscription_id=first).id}/pay/')
+        self.client.post(f'/api/subscriptions/{first}/cancel/')
+        self.assertEqual(self.stats(), (1, 1, 0, Decimal('19.99')))
+
+        self.client.delete(f'/api/subscriptions/{second}/')
+        self.assertEqual(self.stats(), (0, 0, 0, Decimal('0')))
+        self.assertEqual(verify_user_billing_stats(), [])
+
+    def test_concurrent_cancels_and_patches_count_once(self):
+        subscription_id = self.subscribe()
+        # Copies read before the first cancel committed
+        stale = [Subscription.objects.get(pk=subscription_id) for _ in range(2)]
+
+        self.assertEqual(self.client.post(f'/api/subscriptions/{subscription_id}/cancel/').status_code, 200)
+        with mock.patch.object(SubscriptionViewSet, 'get_object', return_value=stale[0]):
+            self.assertEqual(self.client.post(f'/api/subscriptions/{subscription_id}/cancel/').status_code, 400)
+            self.assertEqual(self.client.patch(f'/api/subscriptions/{subscription_id}/', {'status': 'cancelled'}, format='json').status_code, 200)
+        self.client.force_login(self.user)
+        with mock.patch('billing.views.get_object_or_404', return_value=stale[1]):
+            self.client.post(reverse('cancel_subscription', args=[subscription_id]))
+
+        self.assertEqual(self.stats()[0], 0)
+        self.assertEqual(verify_user_billing_stats(), [])
+
+    def test_dashboard_reads_counters(self):
+        self.subscribe()
+        self.client.force_login(self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard'))
+
+        # The stats row, active subscriptions and recent invoices; no count() queries
+        billing = [query['sql'] for query in queries if '"billing_' in query['sql']]
+        self.assertEqual(len(billing), 3)
+        self.assertFalse(any('COUNT(' in sql for sql in billing))
+
+        self.assertEqual(response.context['active_subscriptions_count'], 1)
+        self.assertEqual(response.context['pending_invoices_count'], 1)
+        self.assertContains(response, 'Outstanding balance: $19.99')
+
+    def test_verify_command_repairs_drift(self):
+        self.subscribe()
+        UserBillingStats.objects.filter(user=self.user).update(pending_invoices=5, outstanding_amount=0)
+
+        out = StringIO()
+        call_command('verify_billing_stats', stdout=out)
+        self.assertIn('drifted for 1 users', out.getvalue())
+
+        call_command('verify_billing_stats', '--repair', stdout=out)
+        self.assertEqual(self.stats(), (1, 1, 0, Decimal('19.99')))
+        self.assertEqual(verify_user_billing_stats(), [])
+
+    def test_plan_change_keeps_old_invoices_on_their_plan(self):
+        subscription = self.subscribe()
+        basic = Plan.objects.create(name='basic', price=Decimal('9.99'), description='Basic plan')
+
+        response = self.client.patch(f'/api/subscriptions/{subscription}/', {'plan': basic.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.client.post(f'/api/invoices/{Invoice.objects.get(subscription_id=subscription).id}/pay/')
+
+        paid = RevenueRollup.objects.get(status='paid')
+        self.assertEqual((paid.plan, paid.invoice_count, paid.amount), (self.plan, 1, Decimal('19.99')))
+        self.assertEqual(RevenueRollup.objects.get(status='pending').invoice_count, 0)
+        incremental = set(RevenueRollup.objects.filter(invoice_count__gt=0).values_list('month', 'plan_id', 'status', 'invoice_count', 'amount'))
+        rebuild_revenue_rollups()
+        self.assertEqual(incremental, set(RevenueRollup.objects.values_list('month', 'plan_id', 'status', 'invoice_count', 'amount')))
+
+    def test_admin_subscription_edits_and_deletes_update_counters(self):
+        first, second = self.subscribe(), self.subscribe()
+        admin_user = User.objects.create_superuser(username='statsadmin', email='admin@example.com', password='password')
+        self.client.force_login(admin_user)
+        subscription = Subscription.objects.get(id=first)
+
+        response = self.client.post(f'/admin/billing/subscription/{first}/change/', {
+            'user': self.user.id, 'email': subscription.email, 'plan': self.plan.id,
+            'start_date': subscription.start_date, 'end_date': subscription.end_date, 'status': 'expired',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.stats(), (1, 2, 0, Decimal('39.98')))
+
+        response = self.client.post(f'/admin/billing/subscription/{second}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.stats(), (0, 1, 0, Decimal('19.99')))
+        self.assertEqual(verify_user_billing_stats(), [])
+
+
+class BulkPayTests(TestCase):
+    def setUp(self):
+        self.plan = Plan.objects.create(name='basic', price=Decimal('9.99'), description='Basic plan')
+        self.today = timezone.now().date()
+        self.user = User.objects.create_user(username='bulkpayer', email='bulkpayer@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for _ in range(3):
+            self.client.post('/api/subscriptions/', {'plan': self.plan.id, 'start_date': self.today.isoformat()}, format='json')
+        self.invoices = list(Invoice.objects.filter(user=self.user).order_by('id'))
+        EmailOutbox.objects.all().delete()
+
+    def pay(self, uuids, **extra):
+        return self.client.post('/api/invoices/pay-bulk/', {'invoice_uuids': [str(uuid) for uuid in uuids], **extra}, format='json')
+
+    def test_pays_every_invoice_with_one_update_and_one_email(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.pay([invoice.uuid for invoice in self.invoices])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['paid'], response.json()['failed'], response.json()['total_amount']), (3, 0, '29.97'))
+        self.assertEqual(Invoice.objects.filter(user=self.user, status='paid').count(), 3)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "billing_invoice"')]), 1)
+        self.assertEqual(list(EmailOutbox.objects.values_list('kind', flat=True)), ['bulk_payment_confirmation'])
+        self.assertEqual(UserBillingStats.objects.get(user=self.user).pending_invoices, 0)
+
+        dispatch_email_outbox()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('3 invoices paid', mail.outbox[0].subject)
+        self.assertIn('$29.97', mail.outbox[0].body)
+
+    def test_partial_failure_pays_the_rest(self):
+        other = User.objects.create_user(username='someoneelse')
+        foreign = Invoice.objects.create(
+            user=other, subscription=self.invoices[0].subscription, amount=Decimal('1.00'),
+            issue_date=self.today, due_date=self.today, billing_period=self.today - timedelta(days=1)
+        )
+        self.pay([self.invoices[0].uuid])
+
+        response = self.pay([self.invoices[0].uuid, self.invoices[1].uuid, foreign.uuid, self.invoices[1].uuid])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result['result'] for result in response.json()['results']],
+            ['already_paid', 'paid', 'not_found']
+        )
+        self.assertEqual(Invoice.objects.get(id=foreign.id).status, 'pending')
+        self.assertEqual(list(EmailOutbox.objects.order_by('id').values_list('kind', flat=True)), ['payment_confirmation'] * 2)
+
+    def test_all_or_nothing_pays_nothing_on_failure(self):
+        self.pay([self.invoices[0].uuid])
+
+        response = self.pay([invoice.uuid for invoice in self.invoices], all_or_nothing=True)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([result['result'] for result in response.json()['results']], ['already_paid', 'skipped', 'skipped'])
+        self.assertEqual(Invoice.objects.filter(user=self.user, status='paid').count(), 1)
+
+    def test_rejects_invalid_bodies(self):
+        self.assertEqual(self.pay([]).status_code, 400)
+        self.assertEqual(self.client.post('/api/invoices/pay-bulk/', {'invoice_uuids': ['nope']}, format='json').status_code, 400)
+
+
+class SubscriptionImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.basic = Plan.objects.create(name='basic', price=Decimal('9.99'), description='Basic plan')
+        self.pro = Plan.objects.create(name='pro', price=Decimal('29.99'), description='Pro plan')
+        for index in range(5):
+            User.objects.create_user(username=f'partner{index}', email=f'partner{index}@example.com')
+        self.csv = self.write('import.csv', (
+            "user,plan,start_date,end_date,status\n"
+            "partner0,basic,2026-01-05,,\n"
+            "partner1@example.com,pro,2026-02-01,2026-12-31,active\n"
+            f"partner2,{self.pro.id},2026-03-10,,cancelled\n"
+            "nobody,basic,2026-01-05,,\n"
+            "partner3,gold,2026-01-05,,\n"
+            "partner4,basic,05/01/2026,,\n"
+        ))
+
+    def write(self, name, content):
+        if not hasattr(self, 'directory'):
+            self.directory = tempfile.TemporaryDirectory()
+            self.addCleanup(self.directory.cleanup)
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, *args):
+        out = StringIO()
+        call_command('import_subscriptions', *args, stdout=out)
+        return out.getvalue()
+
+    def test_imports_valid_rows_with_invoices_stats_and_queued_emails(self):
+        output = self.run_import(self.csv, '--chunk-size=2')
+
+        self.assertIn('Created 3 subscriptions and 2 invoices from 6 rows (0 existing, 3 rejected) in 3 chunks', output)
+        self.assertIn("Line 5: unknown or ambiguous user 'nobody'", output)
+        self.assertIn("Line 6: unknown or ambiguous plan 'gold'", output)
+        self.assertIn('Line 7: start_date must be a YYYY-MM-DD date', output)
+        self.assertIn('rows/s', output)
+
+        subscription = Subscription.objects.get(user__username='partner0')
+        self.assertEqual((subscription.plan, subscription.end_date), (self.basic, date(2026, 2, 4)))
+        self.assertEqual(subscription.next_billing_date.day, 5)
+        self.assertGreaterEqual(subscription.next_billing_date, min(timezone.localdate(), date(2026, 2, 5)))
+        self.assertEqual(subscription.email, 'partner0@example.com')
+        self.assertIsNotNone(Subscription.objects.get(user__username='partner2').cancelled_at)
+        self.assertEqual(Invoice.objects.get(subscription=subscription).amount, Decimal('9.99'))
+        self.assertFalse(Invoice.objects.filter(user__username='partner2').exists())
+        self.assertEqual(EmailOutbox.objects.filter(kind='subscription_confirmation').count(), 3)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(verify_user_billing_stats(), [])
+        self.assertEqual(RevenueRollup.objects.get(month=date(2026, 2, 1)).amount, Decimal('29.99'))
+
+    def test_rerun_skips_imported_rows(self):
+        self.run_import(self.csv)
+
+        output = self.run_import(self.csv, '--no-emails')
+
+        self.assertIn('Created 0 subscriptions and 0 invoices from 6 rows (3 existing, 3 rejected)', output)
+        self.assertEqual(Subscription.objects.count(), 3)
+
+    def test_dry_run_writes_nothing(self):
+        output = self.run_import(self.csv, '--dry-run')
+
+        self.assertIn('Would create 3 subscriptions and 2 invoices', output)
+        self.assertFalse(Subscription.objects.exists())
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    def test_jsonl_input_and_chunk_query_count(self):
+        lines = [json.dumps({'user': f'partner{index}', 'plan': 'basic', 'start_date': '2026-04-01'}) for index in range(5)]
+        # Warm up the plan catalog and the month's rollup row
+        self.run_import(self.write('first.jsonl', lines[0] + '\n'), '--no-emails')
+
+        with CaptureQueriesContext(connection) as small:
+            self.run_import(self.write('one.jsonl', lines[1] + '\n'), '--no-emails')
+        with CaptureQueriesContext(connection) as large:
+            output = self.run_import(self.write('many.jsonl', '\n'.join(lines[2:]) + '\n'), '--no-emails')
+
+        self.assertIn('Created 3 subscriptions and 3 invoices', output)
+        self.assertEqual(len(small), len(large))
+
+    def test_historical_start_date_is_not_back_billed(self):
+        today = timezone.localdate()
+        start_date = today.replace(day=1) - relativedelta(months=7)
+        self.run_import(self.write('old.jsonl', json.dumps({'user': 'partner0', 'plan': 'basic', 'start_date': start_date.isoformat()}) + '\n'), '--no-emails')
+
+        subscription = Subscription.objects.get(user__username='partner0')
+        self.assertEqual(subscription.next_billing_date, today if today.day == 1 else today.replace(day=1) + relativedelta(months=1))
+        self.assertEqual(generate_invoices_for_date(today, send_emails=False)['invoices_created'], 1 if today.day == 1 else 0)
+
+    def test_wrongly_typed_json_values_are_rejected_rows(self):
+        lines = [
+            json.dumps({'user': 'partner0', 'plan': 'basic', 'status': ['active']}),
+            json.dumps({'user': 'partner1', 'plan': 'basic', 'start_date': ['2026-04-01']}),
+            json.dumps({'user': 'partner2', 'plan': 'basic'}),
+        ]
+
+        output = self.run_import(self.write('typed.jsonl', '\n'.join(lines) + '\n'), '--no-emails')
+
+        self.assertIn('Created 1 subscriptions and 1 invoices from 3 rows (0 existing, 2 rejected)', output)
+        self.assertIn("Line 1: unhashable type: 'list'", output)
+        self.assertIn('Line 2: start_date must be a YYYY-MM-DD date', output)
+
+
+class AsyncReadApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', email='reader@example.com', first_name='Rea')
+        self.other = User.objects.create_user(username='other', email='other@example.com')
+        self.plan = Plan.objects.create(name='basic', price=Decimal('10.00'), description='Basic')
+        self.today = timezone.now().date()
+        self.subscription = Subscription.objects.create(
+            user=self.user, plan=self.plan, status='active', start_date=self.today, end_date=self.today + timedelta(days=30)
+        )
+        for index, status in enumerate(['pending', 'paid', 'pending']):
+            Invoice.objects.create(
+                user=self.user, subscription=self.subscription, amount=Decimal('10.00'),
+                issue_date=self.today, due_date=self.today + timedelta(days=15),
+                billing_period=self.today - timedelta(days=30 * index), status=status
+            )
+        Subscription.objects.create(
+            user=self.other, plan=self.plan, status='active', start_date=self.today, end_date=self.today + timedelta(days=30)
+        )
+        self.headers = {'headers': {'Authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}}
+
+    def test_async_endpoints_match_the_drf_endpoints(self):
+        pairs = [
+            ('/api/async/plans/', '/api/plans/'),
+            ('/api/async/subscriptions/', '/api/subscriptions/'),
+            (f'/api/async/subscriptions/{self.subscription.id}/', f'/api/subscriptions/{self.subscription.id}/'),
+            ('/api/async/invoices/', '/api/invoices/'),
+            ('/api/async/invoices/?page=2', '/api/invoices/?page=2'),
+            ('/api/async/invoices/pending/', '/api/invoices/pending/'),
+            (f'/api/async/invoices/{Invoice.objects.first().id}/', f'/api/invoices/{Invoice.objects.first().id}/'),
+            ('/api/async/auth/profile/', '/api/auth/profile/'),
+        ]
+        with mock.patch.object(PageNumberPagination, 'page_size', 2):
+            for async_url, drf_url in pairs:
+                with self.subTest(async_url):
+                    response = self.client.get(async_url, **self.headers)
+                    expected = self.client.get(drf_url, **self.headers)
+                    self.assertEqual(response.status_code, 200)
+                    # Page links differ only by the /async prefix
+                    self.assertEqual(json.loads(response.content.replace(b'/api/async/', b'/api/')), expected.json())
+
+    def test_other_users_rows_are_not_found(self):
+        other = Subscription.objects.get(user=self.other)
+
+        response = self.client.get(f'/api/async/subscriptions/{other.id}/', **self.headers)
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_authentication_and_method_errors(self):
+        self.assertEqual(self.client.get('/api/async/invoices/').status_code, 401)
+        self.assertEqual(self.client.get('/api/async/invoices/', headers={'Authorization': 'Bearer nonsense'}).status_code, 401)
+        self.assertEqual(self.client.get('/api/async/plans/').status_code, 200)
+        self.assertEqual(self.client.post('/api/async/invoices/', **self.headers).status_code, 405)
+        self.assertEqual(self.client.get('/api/async/invoices/?page=9', **self.headers).status_code, 404)
+
+    async def test_served_by_the_asgi_handler(self):
+        response = await self.async_client.get('/api/async/invoices/pending/', **self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['status'] for row in response.json()], ['pending', 'pending'])
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='mobile', email='mobile@example.com')
+        self.plan = Plan.objects.create(name='basic', price=Decimal('10.00'), description='Basic')
+        self.today = timezone.now().date()
+        self.subscription = Subscription.objects.create(
+            user=self.user, plan=self.plan, status='active', start_date=self.today, end_date=self.today + timedelta(days=30)
+        )
+        for index in range(3):
+            Invoice.objects.create(
+                user=self.user, subscription=self.subscription, amount=Decimal('10.00'),
+                issue_date=self.today - timedelta(days=index), due_date=self.today + timedelta(days=15),
+                billing_period=self.today - timedelta(days=30 * index), status='pending'
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_fields_select_columns_without_joins(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/invoices/?fields=uuid,amount,status')
+
+        self.assertEqual(response.status_code, 200)
+        rows = response.json()['results']
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(list(rows[0]), ['uuid', 'amount', 'status'])
+        self.assertEqual(rows[0]['amount'], '10.00')
+        page_query = [query['sql'] for query in queries if 'billing_invoice' in query['sql'] and 'COUNT(' not in query['sql']][-1]
+        self.assertNotIn('JOIN', page_query)
+        self.assertNotIn('due_date', page_query)
+
+    def test_full_expansion_matches_the_default_response(self):
+        default = self.client.get('/api/invoices/').json()
+        with CaptureQueriesContext(connection) as queries:
+            expanded = self.client.get('/api/invoices/?expand=subscription.plan').json()
+
+        self.assertEqual(expanded, default)
+        self.assertEqual(len([query for query in queries if 'billing_' in query['sql']]), 2)
+
+    def test_expand_one_level_and_retrieve(self):
+        invoice = Invoice.objects.first()
+
+        response = self.client.get(f'/api/invoices/{invoice.id}/?fields=uuid&expand=subscription')
+
+        self.assertEqual(list(response.json()), ['uuid', 'subscription_details'])
+        self.assertNotIn('plan_details', response.json()['subscription_details'])
+        self.assertEqual(response.json()['subscription_details']['status'], 'active')
+
+    def test_subscriptions_plans_and_pending(self):
+        subscriptions = self.client.get('/api/subscriptions/?fields=id,status&expand=plan').json()['results']
+        plans = self.client.get('/api/plans/?fields=name,price').json()['results']
+        pending = self.client.get('/api/invoices/pending/?fields=uuid').json()
+
+        self.assertEqual(subscriptions, [{'id': self.subscription.id, 'status': 'active', 'plan_details': PlanSerializer(self.plan).data}])
+        self.assertEqual(plans, [{'name': 'basic', 'price': '10.00'}])
+        self.assertEqual(len(pending), 3)
+        self.assertEqual(list(pending[0]), ['uuid'])
+
+    def test_keyset_cursor_with_sparse_fields(self):
+        response = self.client.get('/api/invoices/?cursor=&page_size=2&fields=uuid')
+        following = self.client.get(response.json()['next'])
+
+        self.assertEqual(len(response.json()['results']) + len(following.json()['results']), 3)
+        self.assertEqual(list(following.json()['results'][0]), ['uuid'])
+
+    def test_unknown_fields_and_relations_are_rejected(self):
+        response = self.client.get('/api/invoices/?fields=uuid,secret&expand=user')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', response.json()['fields'])
+        self.assertIn('expand', response.json())
+        self.assertEqual(self.client.get('/api/plans/?expand=subscription').status_code, 400)
+
+
+class FastJSONTests(TestCase):
+    def sample(self):
+        user = User(id=7, username='json')
+        plan = Plan(id=1, name='pro', price=Decimal('19.99'), description='Pro   plan ✓')
+        subscription = Subscription(
+            id=3, user=user, plan=plan, status='active', start_date=date(2026, 1, 1), end_date=date(2026, 1, 31),
+            created_at=timezone.now(), updated_at=timezone.now()
+        )
+        invoice = Invoice(
+            id=5, user=user, subscription=subscription, amount=Decimal('19.99'), issue_date=date(2026, 1, 1),
+            due_date=date(2026, 1, 16), status='pending', created_at=timezone.now(), updated_at=timezone.now()
+        )
+        return {
+            'count': 1, 'next': None,
+            'results': InvoiceSerializer([invoice], many=True).data,
+            'detail': InvoiceSerializer(invoice).data,
+            'raw': [Decimal('10.50'), date(2026, 2, 3), invoice.uuid, timedelta(hours=1), 2 ** 70, 0.25, {1: 'int key'}],
+            'datetimes': [
+                datetime(2026, 1, 1, 12, 30, tzinfo=dt_timezone.utc),
+                datetime(2026, 1, 1, 12, 30, 0, 1500, tzinfo=dt_timezone(timedelta(hours=5, minutes=30))),
+                datetime(2026, 1, 1, 12, 30),
+            ],
+        }
+
+    def test_renderer_output_matches_drf(self):
+        data = self.sample()
+
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=4'), JSONRenderer().render(data, 'application/json; indent=4')
+        )
+
+    def test_renderer_falls_back_without_orjson(self):
+        data = self.sample()
+
+        with mock.patch('billing.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_renderer_refuses_non_finite_floats_like_drf(self):
+        for value in [float('nan'), float('inf'), -float('inf')]:
+            data = {'series': [{'mrr': value, 'arr': None}]}
+            with self.assertRaises(ValueError):
+                JSONRenderer().render(data)
+            with self.assertRaises(ValueError):
+                FastJSONRenderer().render(data)
+
+    def test_parser_matches_drf(self):
+        for body in [b'{"invoice_uuids": ["a", "b"], "all_or_nothing": true, "n": 1.5}', b'[123456789012345678901234567890]']:
+            self.assertEqual(FastJSONParser().parse(BytesIO(body)), JSONParser().parse(BytesIO(body)))
+        for body in [b'{"broken": ', b'{"amount": NaN}']:
+            with self.assertRaises(ParseError):
+                FastJSONParser().parse(BytesIO(body))
+
+    def test_api_uses_the_fast_classes(self):
+        user = User.objects.create_user(username='api-json')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.post('/api/invoices/pay-bulk/', {'invoice_uuids': [str(uuid.uuid4())]}, format='json')
+
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+        self.assertEqual(response.json()['results'][0]['result'], 'not_found')
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        blacklisted_jtis.clear()
+        self.user = User.objects.create_user(username='cached', email='cached@example.com', password='secret-pass-1')
+        self.refresh = RefreshToken.for_user(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+
+    def user_queries(self, queries):
+        return [query['sql'] for query in queries if 'FROM "auth_user"' in query['sql']]
+
+    def test_user_is_read_once_then_served_from_the_cache(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.client.get('/api/auth/profile/').status_code, 200)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get('/api/auth/profile/')
+
+        self.assertEqual(response.json()['username'], 'cached')
+        self.assertEqual(len(self.user_queries(first)), 1)
+        self.assertEqual(len(second), 0)
+
+    def test_saving_a_user_drops_the_cached_copy(self):
+        self.client.get('/api/auth/profile/')
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get('/api/auth/profile/')
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['detail'], 'User is inactive')
+
+    def test_async_views_use_the_cache(self):
+        self.client.get('/api/auth/profile/')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/async/auth/profile/', headers={'Authorization': f'Bearer {self.refresh.access_token}'})
+
+        self.assertEqual(response.json()['username'], 'cached')
+        self.assertEqual(self.user_queries(queries), [])
+
+    def test_logged_out_refresh_token_is_rejected_from_memory(self):
+        self.assertEqual(self.client.post('/api/auth/logout/', {'refresh': str(self.refresh)}, format='json').status_code, 200)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/auth/token/refresh/', {'refresh': str(self.refresh)}, format='json')
+
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(any('token_blacklist_blacklistedtoken' in query['sql'] for query in queries))
+
+    def test_refresh_rotates_and_blacklists_the_old_token(self):
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': str(self.refresh)}, format='json')
+        again = self.client.post('/api/auth/token/refresh/', {'refresh': str(self.refresh)}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('refresh', response.json())
+        self.assertEqual(again.status_code, 401)
+
+    def blacklist_elsewhere(self, token):
+        # What another process's logout leaves behind: the rows, not this process's memory
+        with self.captureOnCommitCallbacks(execute=True):
+            BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=token['jti']))
+
+    def test_logged_out_token_is_rejected_after_the_cache_is_cleared(self):
+        self.client.post('/api/auth/logout/', {'refresh': str(self.refresh)}, format='json')
+        cache.clear()
+
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': str(self.refresh)}, format='json')
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_local_cache_sees_other_processes_blacklisting_on_reload(self):
+        self.assertNotIn(self.refresh['jti'], blacklisted_jtis)
+        self.blacklist_elsewhere(self.refresh)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertNotIn(self.refresh['jti'], blacklisted_jtis)
+        self.assertEqual(len(queries), 0)
+        with override_settings(AUTH_BLACKLIST_REFRESH_INTERVAL=0):
+            self.assertIn(self.refresh['jti'], blacklisted_jtis)
+
+    def test_shared_cache_version_reloads_only_after_a_blacklisting(self):
+        with mock.patch('billing.authentication.shared_cache', return_value=True):
+            self.assertNotIn(self.refresh['jti'], blacklisted_jtis)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertNotIn(self.refresh['jti'], blacklisted_jtis)
+            self.assertEqual(len(queries), 0)
+
+            self.blacklist_elsewhere(self.refresh)
+            self.assertIn(self.refresh['jti'], blacklisted_jtis)
+
+            other = RefreshToken.for_user(self.user)
+            self.blacklist_elsewhere(other)
+            # An evicted version reloads too
+            cache.clear()
+            self.assertIn(other['jti'], blacklisted_jtis)
+
+    @override_settings(LAST_LOGIN_BATCH_SIZE=3, LAST_LOGIN_FLUSH_INTERVAL=3600)
+    def test_last_logins_are_written_in_batches(self):
+        users = [self.user] + [User.objects.create_user(username=f'batch{index}', password='secret-pass-1') for index in range(2)]
+
+        with CaptureQueriesContext(connection) as queries:
+            for user in users[:2]:
+                self.client.post('/api/auth/login/', {'username': user.username, 'password': 'secret-pass-1'}, format='json')
+            self.assertFalse(User.objects.filter(last_login__isnull=False).exists())
+            self.client.post('/api/auth/login/', {'username': users[2].username, 'password': 'secret-pass-1'}, format='json')
+
+        self.assertEqual(User.objects.filter(last_login__isnull=False).count(), 3)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "auth_user"')]), 1)
+
+    def test_last_logins_are_written_without_another_login(self):
+        batch = LastLoginBatch()
+        flushed = threading.Event()
+        with mock.patch.object(LastLoginBatch, 'flush', side_effect=lambda: flushed.set()):
+            with override_settings(LAST_LOGIN_FLUSH_INTERVAL=0.01):
+                batch.record(self.user)
+
+            self.assertTrue(flushed.wait(5))
@@ -1,11 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
+from . import async_views
 from .views import (
     # API ViewSets
     PlanViewSet, SubscriptionViewSet, InvoiceViewSet,
     # JWT Authentication Views
     UserRegistrationAPIView, UserLoginAPIView, UserLogoutAPIView, UserProfileAPIView, api_endpoints,
+    # Analytics API Views
+    CohortAnalyticsAPIView, MrrAnalyticsAPIView,
     # Web Views
     dashboard, PlanListView, subscribe, 
     SubscriptionListView, SubscriptionDetailView, cancel_subscription,
@@ -30,6 +33,19 @@ urlpatterns = [
     path('api/auth/token/refresh/', TokenRefreshView.as_view(), name='api_token_refresh'),
     path('api/auth/profile/', UserProfileAPIView.as_view(), name='api_profile'),
     
+    # Analytics API URLs
+    path('api/analytics/cohorts/', CohortAnalyticsAPIView.as_view(), name='api_cohort_analytics'),
+    path('api/analytics/mrr/', MrrAnalyticsAPIView.as_view(), name='api_mrr_analytics'),
+    
+    # Async (ASGI) read endpoints
+    path('api/async/plans/', async_views.plan_list, name='api_async_plans'),
+    path('api/async/subscriptions/', async_views.subscription_list, name='api_async_subscriptions'),
+    path('api/async/subscriptions/<int:pk>/', async_views.subscription_detail, name='api_async_subscription_detail'),
+    path('api/async/invoices/', async_views.invoice_list, name='api_async_invoices'),
+    path('api/async/invoices/pending/', async_views.pending_invoices, name='api_async_pending_invoices'),
+    path('api/async/invoices/<int:pk>/', async_views.invoice_detail, name='api_async_invoice_detail'),
+    path('api/async/auth/profile/', async_views.profile, name='api_async_profile'),
+    
     # API URLs
     path('api/', include(router.urls)),
     
@@ -1,14 +1,34 @@
-from django.core.mail import send_mail, EmailMultiAlternatives
-from django.template.loader import render_to_string
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
 from django.utils.html import strip_tags
 from django.conf import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
-def send_email_template(subject, template, context, recipient_list, from_email=None):
+# Compiled templates (and missing ones) are cached by Django's cached template
+# loader, which is on whenever DEBUG is off; with DEBUG on, edits reload.
+
+def get_email_template(template):
     """
-    Send an HTML email using a template with a text fallback
+    Compiled email template
+    """
+    return get_template(template)
+
+def get_email_text_template(template):
+    """
+    Compiled plain-text counterpart (same name, .txt) of an HTML email template,
+    or None when the template has no text version
+    """
+    try:
+        return get_template(template.rsplit('.', 1)[0] + '.txt')
+    except TemplateDoesNotExist:
+        return None
+
+def build_email_message(subject, template, context, recipient_list, from_email=None):
+    """
+    Render a template into an HTML email with a text fallback, without sending it
     
     Args:
         subject (str): Email subject
@@ -18,32 +38,47 @@ def send_email_template(subject, template, context, recipient_list, from_email=N
         from_email (str, optional): Sender email address. Defaults to DEFAULT_FROM_EMAIL.
     
     Returns:
-        bool: True if the email was sent successfully, False otherwise
+        EmailMultiAlternatives: The message, ready for send() or send_email_batch()
     """
     if from_email is None:
         from_email = settings.DEFAULT_FROM_EMAIL
     
+    # Render HTML content
+    html_content = get_email_template(template).render(context)
+    # Render the dedicated plain text version, stripping the HTML only as a fallback
+    text_template = get_email_text_template(template)
+    text_content = text_template.render(context) if text_template else strip_tags(html_content)
+    
+    # Create email message
+    email = EmailMultiAlternatives(
+        subject=subject,
+        body=text_content,
+        from_email=from_email,
+        to=recipient_list
+    )
+    
+    # Attach HTML content
+    email.attach_alternative(html_content, "text/html")
+    return email
+
+def send_email_message(build, *args):
+    """
+    Build a message with build(*args) and send it on its own connection
+    
+    Args:
+        build (callable): Returns the EmailMessage to send, e.g. build_email_message
+        *args: Arguments passed to build
+    
+    Returns:
+        bool: True if the email was sent successfully, False otherwise
+    """
     try:
-        # Render HTML content
-        html_content = render_to_string(template, context)
-        # Create plain text version
-        text_content = strip_tags(html_content)
-        
-        # Create email message
-        email = EmailMultiAlternatives(
-            subject=subject,
-            body=text_content,
-            from_email=from_email,
-            to=recipient_list
-        )
-        
-        # Attach HTML content
-        email.attach_alternative(html_content, "text/html")
+        email = build(*args)
         
         # Send email
         email.send()
         
-        logger.info(f"Email sent to {', '.join(recipient_list)}: {subject}")
+        logger.info(f"Email sent to {', '.join(email.to)}: {email.subject}")
         return True
     
     except Exception as e:
@@ -51,38 +86,126 @@ def send_email_template(subject, template, context, recipient_list, from_email=N
         logger.error(f"Email configuration: Backend={settings.EMAIL_BACKEND}, Host={getattr(settings, 'EMAIL_HOST', 'Not set')}, User={getattr(settings, 'EMAIL_HOST_USER', 'Not set')}")
         return False
 
-def send_invoice_created_email(invoice):
+def send_email_template(subject, template, context, recipient_list, from_email=None):
     """
-    Send an email notification when a new invoice is created
+    Send an HTML email using a template with a text fallback
     
     Args:
-        invoice: The Invoice object
+        subject (str): Email subject
+        template (str): Path to the HTML template
+        context (dict): Context data for the template
+        recipient_list (list): List of recipient email addresses
+        from_email (str, optional): Sender email address. Defaults to DEFAULT_FROM_EMAIL.
     
     Returns:
         bool: True if the email was sent successfully, False otherwise
     """
-    logger.info(f"Preparing to send invoice created email for invoice {invoice.uuid} to {invoice.user.email}")
+    return send_email_message(build_email_message, subject, template, context, recipient_list, from_email)
+
+def send_email_batch(messages, batch_size=None, on_result=None):
+    """
+    Send many emails over one reused SMTP connection
+    
+    Messages are pulled from the iterable one at a time, so a generator renders each
+    message only when it is about to be sent. The connection is recycled after
+    batch_size messages, and after an error it is reopened and the failed message
+    retried once.
+    
+    Args:
+        messages (iterable): EmailMessage objects, or callables returning one (or
+            None to skip); a callable that raises counts as a failed message
+        batch_size (int, optional): Messages per connection. Defaults to EMAIL_BATCH_SIZE.
+        on_result (callable, optional): Called as on_result(item, error) after each
+            item is attempted, with error None on success
+    
+    Returns:
+        tuple: (sent, failed) message counts
+    """
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    connection = get_connection()
+    is_open = False
+    sent_on_connection = 0
+    sent = 0
+    failed = 0
+    
+    try:
+        for item in messages:
+            message = item
+            if callable(item):
+                try:
+                    message = item()
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Failed to render email: {str(e)}")
+                    if on_result:
+                        on_result(item, e)
+                    continue
+            if message is None:
+                continue
+            
+            if is_open and sent_on_connection >= batch_size:
+                connection.close()
+                is_open = False
+            
+            for attempt in (1, 2):
+                try:
+                    if not is_open:
+                        connection.open()
+                        is_open = True
+                        sent_on_connection = 0
+                    connection.send_messages([message])
+                    sent += 1
+                    sent_on_connection += 1
+                    logger.info(f"Email sent to {', '.join(message.to)}: {message.subject}")
+                    if on_result:
+                        on_result(item, None)
+                    break
+                except Exception as e:
+                    # Drop the connection so the retry (or next message) reconnects
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                    is_open = False
+                    if attempt == 2:
+                        failed += 1
+                        logger.error(f"Failed to send email to {', '.join(message.to)}: {str(e)}")
+                        if on_result:
+                            on_result(item, e)
+    finally:
+        if is_open:
+            connection.close()
+    
+    logger.info(f"Email batch complete. Sent {sent} emails, {failed} failed")
+    return sent, failed
+
+def build_invoice_created_email(invoice):
+    """
+    Build the email notification for a newly created invoice
     
+    Args:
+        invoice: The Invoice object
+    
+    Returns:
+        EmailMultiAlternatives: The rendered message
+    """
     subject = f"New Invoice #{invoice.uuid} - {invoice.subscription.plan.get_name_display()} Plan"
     template = 'billing/emails/invoice_created.html'
     context = {
         'invoice': invoice,
         'user': invoice.user,
     }
-    recipient_list = [invoice.email]
-    logger.info(f"Sending invoice created email to {recipient_list}")
-    
-    return send_email_template(subject, template, context, recipient_list)
+    return build_email_message(subject, template, context, [invoice.email])
 
-def send_payment_reminder_email(invoice):
+def build_payment_reminder_email(invoice):
     """
-    Send a payment reminder email for an overdue invoice
+    Build the payment reminder email for an overdue invoice
     
     Args:
         invoice: The Invoice object
     
     Returns:
-        bool: True if the email was sent successfully, False otherwise
+        EmailMultiAlternatives: The rendered message
     """
     subject = f"Payment Reminder: Invoice #{invoice.uuid} is Overdue"
     template = 'billing/emails/payment_reminder.html'
@@ -90,20 +213,43 @@ def send_payment_reminder_email(invoice):
         'invoice': invoice,
         'user': invoice.user,
     }
-    recipient_list = [invoice.email]
+    return build_email_message(subject, template, context, [invoice.email])
+
+def send_invoice_created_email(invoice):
+    """
+    Send an email notification when a new invoice is created
     
-    return send_email_template(subject, template, context, recipient_list)
+    Args:
+        invoice: The Invoice object
+    
+    Returns:
+        bool: True if the email was sent successfully, False otherwise
+    """
+    logger.info(f"Preparing to send invoice created email for invoice {invoice.uuid} to {invoice.email}")
+    return send_email_message(build_invoice_created_email, invoice)
 
-def send_subscription_confirmation_email(subscription):
+def send_payment_reminder_email(invoice):
     """
-    Send a confirmation email when a user subscribes to a plan
+    Send a payment reminder email for an overdue invoice
     
     Args:
-        subscription: The Subscription object
+        invoice: The Invoice object
     
     Returns:
         bool: True if the email was sent successfully, False otherwise
     """
+    return send_email_message(build_payment_reminder_email, invoice)
+
+def build_subscription_confirmation_email(subscription):
+    """
+    Build the confirmation email for a new subscription
+    
+    Args:
+        subscription: The Subscription object
+    
+    Returns:
+        EmailMultiAlternatives: The rendered message
+    """
     subject = f"Subscription Confirmation - {subscription.plan.get_name_display()} Plan"
     template = 'billing/emails/subscription_confirmation.html'
     context = {
@@ -112,19 +258,17 @@ def send_subscription_confirmation_email(subscription):
     }
     # Use subscription.email if available, fallback to user.email
     recipient_email = subscription.email or subscription.user.email
-    recipient_list = [recipient_email]
-    
-    return send_email_template(subject, template, context, recipient_list)
+    return build_email_message(subject, template, context, [recipient_email])
 
-def send_payment_confirmation_email(invoice):
+def build_payment_confirmation_email(invoice):
     """
-    Send a payment confirmation email when an invoice is paid
+    Build the payment confirmation email for a paid invoice
     
     Args:
         invoice: The Invoice object
     
     Returns:
-        bool: True if the email was sent successfully, False otherwise
+        EmailMultiAlternatives: The rendered message
     """
     subject = f"Payment Confirmation: Invoice #{invoice.uuid}"
     template = 'billing/emails/payment_confirmation.html'
@@ -132,6 +276,49 @@ def send_payment_confirmation_email(invoice):
         'invoice': invoice,
         'user': invoice.user,
     }
-    recipient_list = [invoice.email]
+    return build_email_message(subject, template, context, [invoice.email])
+
+def build_bulk_payment_confirmation_email(invoices):
+    """
+    Build one payment confirmation covering several invoices paid together
+    
+    Args:
+        invoices: The paid Invoice objects, all belonging to the same user
+    
+    Returns:
+        EmailMultiAlternatives: The rendered message
+    """
+    user = invoices[0].user
+    subject = f"Payment Confirmation: {len(invoices)} invoices paid"
+    template = 'billing/emails/bulk_payment_confirmation.html'
+    context = {
+        'invoices': invoices,
+        'invoice_count': len(invoices),
+        'total_amount': sum(invoice.amount for invoice in invoices),
+        'user': user,
+    }
+    return build_email_message(subject, template, context, [invoices[0].email or user.email])
+
+def send_subscription_confirmation_email(subscription):
+    """
+    Send a confirmation email when a user subscribes to a plan
+    
+    Args:
+        subscription: The Subscription object
     
-    return send_email_template(subject, template, context, recipient_list) 
\ No newline at end of file
+    Returns:
+        bool: True if the email was sent successfully, False otherwise
+    """
+    return send_email_message(build_subscription_confirmation_email, subscription)
+
+def send_payment_confirmation_email(invoice):
+    """
+    Send a payment confirmation email when an invoice is paid
+    
+    Args:
+        invoice: The Invoice object
+    
+    Returns:
+        bool: True if the email was sent successfully, False otherwise
+    """
+    return send_email_message(build_payment_confirmation_email, invoice)
@@ -5,7 +5,7 @@ from django.utils import timezone
 from django.views.generic import ListView, DetailView, View, CreateView
 from django.urls import reverse, reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
-from datetime import timedelta
+from datetime import date, timedelta
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
@@ -16,59 +16,132 @@ from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login, logout
 from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.db import transaction
+from django.conf import settings
 
-from .models import Plan, Subscription, Invoice
+from .models import Plan, Subscription, Invoice, UserBillingStats
 from .serializers import (
     PlanSerializer, 
     SubscriptionSerializer, 
     InvoiceSerializer,
     PayInvoiceSerializer,
+    BulkPayInvoicesSerializer,
     UserRegistrationSerializer,
     UserLoginSerializer,
     TokenResponseSerializer,
     UserSerializer
 )
-from .utils import send_subscription_confirmation_email, send_payment_confirmation_email
+from .outbox import enqueue_email
+from .rollups import change_invoice_status, record_invoices_created, record_invoices_deleted, record_status_change
+from .stats import record_subscriptions_created, record_subscriptions_deleted, record_subscription_status_change
+from .exports import EXPORT_FORMATS, filter_invoices, invoice_export_response
+from .analytics import cached_cohort_analytics
+from .mrr import mrr_series, mrr_forecast
+from .catalog import get_plan, plan_catalog
+from .authentication import CachedRefreshToken, record_last_login
+from .pagination import KeysetPaginationMixin, InvoiceKeysetPagination, SubscriptionKeysetPagination
+from .fieldsets import SparseFieldsetMixin
 from .forms import CustomUserCreationForm
 
 # REST API Views
-class PlanViewSet(viewsets.ReadOnlyModelViewSet):
+class PlanViewSet(SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint to view available subscription plans
     Public access - no authentication required
+    Served from the cached plan catalog, with ETag / Last-Modified for conditional GETs
+    Pass `fields` to choose the fields returned
     """
-    queryset = Plan.objects.all()
+    queryset = Plan.objects.order_by('id')
     serializer_class = PlanSerializer
+    fieldset_resource = 'plan'
     permission_classes = [permissions.AllowAny]
+    
+    def list(self, request, *args, **kwargs):
+        catalog = plan_catalog()
+        response = self._not_modified(request, catalog)
+        if response is None:
+            page = self.paginate_queryset(catalog['plans'])
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return self._with_validators(response, catalog)
+    
+    def retrieve(self, request, *args, **kwargs):
+        catalog = plan_catalog()
+        plan = catalog['by_id'].get(int(kwargs['pk'])) if kwargs['pk'].isdigit() else None
+        if plan is None:
+            raise Http404
+        response = self._not_modified(request, catalog)
+        if response is None:
+            response = Response(self.get_serializer(plan).data)
+        return self._with_validators(response, catalog)
+    
+    def _last_modified(self, catalog):
+        return int(catalog['last_modified'].timestamp()) if catalog['last_modified'] else None
+    
+    def _not_modified(self, request, catalog):
+        # A 304 when the client's copy matches the catalog, otherwise None
+        return get_conditional_response(request, etag=catalog['etag'], last_modified=self._last_modified(catalog))
+    
+    def _with_validators(self, response, catalog):
+        response['ETag'] = catalog['etag']
+        if catalog['last_modified']:
+            response['Last-Modified'] = http_date(self._last_modified(catalog))
+        return response
 
-class SubscriptionViewSet(viewsets.ModelViewSet):
+class SubscriptionViewSet(SparseFieldsetMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing user subscriptions
+    Pass `cursor` or `updated_since` for keyset paging on (created_at, id) / (updated_at, id)
+    Pass `fields` and `expand` (plan) to choose the fields and nested objects returned
     """
     serializer_class = SubscriptionSerializer
+    fieldset_resource = 'subscription'
+    keyset_pagination_class = SubscriptionKeysetPagination
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        # Users can only see their own subscriptions
-        return Subscription.objects.filter(user=self.request.user)
+        # Users can only see their own subscriptions; plan is nested in the response
+        return Subscription.objects.filter(user=self.request.user).select_related('plan').order_by('id')
     
     def perform_create(self, serializer):
-        # Set the user to the current user
-        subscription = serializer.save(user=self.request.user)
-        
-        # Create an initial invoice for the subscription
-        invoice = Invoice.objects.create(
-            user=subscription.user,
-            subscription=subscription,
-            email=subscription.user.email,
-            amount=subscription.plan.price,
-            issue_date=subscription.start_date,
-            due_date=subscription.start_date + timedelta(days=15),
-            status='pending'
-        )
-        
-        # Send confirmation email
-        send_subscription_confirmation_email(subscription)
+        with transaction.atomic():
+            # Set the user to the current user
+            subscription = serializer.save(user=self.request.user)
+            record_subscriptions_created([subscription])
+            
+            # Create an initial invoice for the subscription
+            invoice = Invoice.objects.create(
+                user=subscription.user,
+                subscription=subscription,
+                plan=subscription.plan,
+                email=subscription.user.email,
+                amount=subscription.plan.price,
+                issue_date=subscription.start_date,
+                due_date=subscription.start_date + timedelta(days=15),
+                billing_period=subscription.start_date,
+                status='pending'
+            )
+            record_invoices_created([invoice])
+            
+            # Queue confirmation email, sent by the outbox dispatcher
+            enqueue_email('subscription_confirmation', subscription_id=subscription.id)
+    
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            # Applied to the locked row, so the stats move from the status it
+            # really had, not the one read before a concurrent change committed
+            serializer.instance = Subscription.objects.select_for_update().get(pk=serializer.instance.pk)
+            old_status = serializer.instance.status
+            subscription = serializer.save()
+            record_subscription_status_change(subscription, old_status)
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # The subscription's invoices go with it
+            record_invoices_deleted(instance.invoices.all())
+            record_subscriptions_deleted([instance])
+            instance.delete()
     
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -77,61 +150,162 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
         """
         subscription = self.get_object()
         
-        if subscription.status != 'active':
-            return Response(
-                {"detail": "Only active subscriptions can be cancelled."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        subscription.status = 'cancelled'
-        subscription.save()
+        with transaction.atomic():
+            # Locked and checked again, so concurrent cancels count it once
+            subscription = Subscription.objects.select_for_update().get(pk=subscription.pk)
+            if subscription.status != 'active':
+                return Response(
+                    {"detail": "Only active subscriptions can be cancelled."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            subscription.status = 'cancelled'
+            subscription.cancelled_at = timezone.now()
+            subscription.save()
+            record_subscription_status_change(subscription, 'active')
         
         return Response(
             {"detail": "Subscription cancelled successfully."},
             status=status.HTTP_200_OK
         )
 
-class InvoiceViewSet(viewsets.ReadOnlyModelViewSet):
+class InvoiceViewSet(SparseFieldsetMixin, KeysetPaginationMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for viewing invoices
+    Pass `cursor` or `updated_since` for keyset paging on (issue_date, id) / (updated_at, id)
+    Pass `fields` and `expand` (subscription, subscription.plan) to choose the fields and nested objects returned
     """
     serializer_class = InvoiceSerializer
+    fieldset_resource = 'invoice'
+    fieldset_actions = ('list', 'retrieve', 'pending')
+    keyset_pagination_class = InvoiceKeysetPagination
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        # Users can only see their own invoices
-        return Invoice.objects.filter(user=self.request.user)
+        # Users can only see their own invoices; subscription and plan are nested in the response
+        return Invoice.objects.filter(user=self.request.user).select_related('subscription__plan').order_by('id')
     
     @action(detail=False, methods=['get'])
     def pending(self, request):
         """
         Get all pending invoices
         """
-        pending_invoices = Invoice.objects.filter(
-            user=request.user,
-            status='pending'
-        )
+        pending_invoices = self.filter_queryset(self.get_queryset()).filter(status='pending')
         serializer = self.get_serializer(pending_invoices, many=True)
         return Response(serializer.data)
     
-    @action(detail=True, methods=['post'])
-    def pay(self, request, pk=None):
+    @action(detail=False, methods=['post'], url_path='pay-bulk')
+    def pay_bulk(self, request):
         """
-        Mark an invoice as paid
+        Mark many invoices as paid in one transaction
+        Body: {"invoice_uuids": [...], "all_or_nothing": false}
+        
+        Each invoice gets a result: "paid", "already_paid" or "not_found" (unknown
+        or not yours). By default the payable invoices are paid even if others fail,
+        with a 200. With all_or_nothing, any failure pays nothing and returns a 409.
+        One confirmation email covers every invoice paid.
         """
-        invoice = self.get_object()
+        serializer = BulkPayInvoicesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        uuids = list(dict.fromkeys(serializer.validated_data['invoice_uuids']))
+        
+        with transaction.atomic():
+            # Lock the rows first so a concurrent payment cannot be reported as ours
+            invoices = {
+                invoice.uuid: invoice
+                for invoice in self.get_queryset().filter(uuid__in=uuids).select_for_update(of=('self',))
+            }
+            results = []
+            payable = []
+            for uuid in uuids:
+                invoice = invoices.get(uuid)
+                if invoice is None:
+                    results.append({'uuid': str(uuid), 'result': 'not_found'})
+                elif invoice.status == 'paid':
+                    results.append({'uuid': str(uuid), 'result': 'already_paid'})
+                else:
+                    results.append({'uuid': str(uuid), 'result': 'paid', 'amount': f'{invoice.amount:.2f}'})
+                    payable.append(invoice)
+            
+            failed = len(uuids) - len(payable)
+            if failed and serializer.validated_data['all_or_nothing']:
+                for result in results:
+                    if result['result'] == 'paid':
+                        result['result'] = 'skipped'
+                        del result['amount']
+                return Response(
+                    {"detail": "No invoices were paid because some could not be.", "paid": 0, "failed": failed, "results": results},
+                    status=status.HTTP_409_CONFLICT
+                )
+            
+            if payable:
+                ids = [invoice.id for invoice in payable]
+                change_invoice_status(Invoice.objects.filter(id__in=ids), 'paid')
+                if len(ids) == 1:
+                    enqueue_email('payment_confirmation', invoice_id=ids[0])
+                else:
+                    enqueue_email('bulk_payment_confirmation', invoice_ids=ids)
         
-        if invoice.status == 'paid':
+        return Response({
+            "paid": len(payable),
+            "failed": failed,
+            "total_amount": f"{sum(invoice.amount for invoice in payable):.2f}",
+            "results": results,
+        }, status=status.HTTP_200_OK)
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the user's invoices as CSV or JSON Lines
+        Query params: output (csv or jsonl), from / to (issue date, YYYY-MM-DD), status
+        """
+        return self._export(request, self.get_queryset(), f"invoices-{request.user.username}")
+    
+    @action(detail=False, methods=['get'], url_path='export-all', permission_classes=[permissions.IsAdminUser])
+    def export_all(self, request):
+        """
+        Stream every user's invoices as CSV or JSON Lines (staff only)
+        """
+        return self._export(request, Invoice.objects.all(), "invoices")
+    
+    def _export(self, request, queryset, filename):
+        # `output` rather than `format`, which DRF reserves for renderer selection
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
             return Response(
-                {"detail": "This invoice is already paid."},
+                {"detail": f"output must be one of {', '.join(EXPORT_FORMATS)}."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        try:
+            queryset = filter_invoices(queryset, request.query_params)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        invoice.status = 'paid'
-        invoice.save()
+        return invoice_export_response(queryset, output, filename)
+    
+    @action(detail=True, methods=['post'])
+    def pay(self, request, pk=None):
+        """
+        Mark an invoice as paid
+        """
+        invoice = self.get_object()
         
-        # Send payment confirmation email
-        send_payment_confirmation_email(invoice)
+        with transaction.atomic():
+            # Locked and checked again, so concurrent pays move it into paid once
+            invoice = Invoice.objects.select_for_update().get(pk=invoice.pk)
+            if invoice.status == 'paid':
+                return Response(
+                    {"detail": "This invoice is already paid."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            old_status = invoice.status
+            invoice.status = 'paid'
+            invoice.save()
+            record_status_change(invoice, old_status)
+            
+            # Queue payment confirmation email, sent by the outbox dispatcher
+            enqueue_email('payment_confirmation', invoice_id=invoice.id)
         
         return Response(
             {"detail": "Invoice marked as paid successfully."},
@@ -141,31 +315,27 @@ class InvoiceViewSet(viewsets.ReadOnlyModelViewSet):
 # Web Views
 @login_required
 def dashboard(request):
-    active_subscriptions = Subscription.objects.filter(
-        user=request.user,
-        status='active',
-        end_date__gte=timezone.now().date()
-    )
-    
-    pending_invoices = Invoice.objects.filter(
-        user=request.user,
-        status='pending'
-    )
-    
-    overdue_invoices = Invoice.objects.filter(
-        user=request.user,
-        status='overdue'
-    )
+    # Counts come from the user's UserBillingStats row instead of count() queries
+    stats = UserBillingStats.objects.filter(user=request.user).first() or UserBillingStats(user=request.user)
+    
+    active_subscriptions = []
+    if stats.active_subscriptions:
+        active_subscriptions = list(Subscription.objects.filter(
+            user=request.user,
+            status='active',
+            end_date__gte=timezone.now().date()
+        ).select_related('plan'))
     
     recent_invoices = Invoice.objects.filter(
         user=request.user
-    ).order_by('-issue_date')[:5]
+    ).select_related('subscription__plan').order_by('-issue_date')[:5]
     
     context = {
         'active_subscriptions': active_subscriptions,
-        'active_subscriptions_count': active_subscriptions.count(),
-        'pending_invoices_count': pending_invoices.count(),
-        'overdue_invoices_count': overdue_invoices.count(),
+        'active_subscriptions_count': len(active_subscriptions),
+        'pending_invoices_count': stats.pending_invoices,
+        'overdue_invoices_count': stats.overdue_invoices,
+        'outstanding_amount': stats.outstanding_amount,
         'recent_invoices': recent_invoices,
     }
     
@@ -176,6 +346,9 @@ class PlanListView(ListView):
     template_name = 'billing/plans.html'
     context_object_name = 'plans'
     
+    def get_queryset(self):
+        return plan_catalog()['plans']
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Add any additional context here if needed
@@ -183,7 +356,10 @@ class PlanListView(ListView):
 
 @login_required
 def subscribe(request, plan_id):
-    plan = get_object_or_404(Plan, id=plan_id)
+    try:
+        plan = get_plan(plan_id)
+    except Plan.DoesNotExist:
+        raise Http404("No Plan matches the given query.")
     
     if request.method == 'POST':
         start_date = request.POST.get('start_date')
@@ -194,29 +370,34 @@ def subscribe(request, plan_id):
         
         end_date = start_date + timedelta(days=30)
         
-        # Create a new subscription
-        subscription = Subscription.objects.create(
-            user=request.user,
-            email=request.user.email,
-            plan=plan,
-            start_date=start_date,
-            end_date=end_date,
-            status='active'
-        )
-        
-        # Create an initial invoice
-        invoice = Invoice.objects.create(
-            user=request.user,
-            subscription=subscription,
-            email=request.user.email,
-            amount=plan.price,
-            issue_date=start_date,
-            due_date=start_date + timedelta(days=15),
-            status='pending'
-        )
-        
-        # Send confirmation email
-        send_subscription_confirmation_email(subscription)
+        with transaction.atomic():
+            # Create a new subscription
+            subscription = Subscription.objects.create(
+                user=request.user,
+                email=request.user.email,
+                plan=plan,
+                start_date=start_date,
+                end_date=end_date,
+                status='active'
+            )
+            record_subscriptions_created([subscription])
+            
+            # Create an initial invoice
+            invoice = Invoice.objects.create(
+                user=request.user,
+                subscription=subscription,
+                plan=plan,
+                email=request.user.email,
+                amount=plan.price,
+                issue_date=start_date,
+                due_date=start_date + timedelta(days=15),
+                billing_period=start_date,
+                status='pending'
+            )
+            record_invoices_created([invoice])
+            
+            # Queue confirmation email, sent by the outbox dispatcher
+            enqueue_email('subscription_confirmation', subscription_id=subscription.id)
         
         messages.success(request, f'You have successfully subscribed to the {plan.get_name_display()} plan. Check your email for confirmation.')
         return redirect('dashboard')
@@ -260,8 +441,17 @@ def cancel_subscription(request, subscription_id):
         return redirect('subscription_detail', pk=subscription_id)
     
     if request.method == 'POST':
-        subscription.status = 'cancelled'
-        subscription.save()
+        with transaction.atomic():
+            # Locked and checked again, so concurrent cancels count it once
+            subscription = Subscription.objects.select_for_update().get(pk=subscription.pk)
+            if subscription.status != 'active':
+                messages.error(request, 'Only active subscriptions can be cancelled.')
+                return redirect('subscription_detail', pk=subscription_id)
+            
+            subscription.status = 'cancelled'
+            subscription.cancelled_at = timezone.now()
+            subscription.save()
+            record_subscription_status_change(subscription, 'active')
         
         messages.success(request, 'Your subscription has been cancelled.')
         return redirect('subscriptions')
@@ -321,13 +511,22 @@ def pay_invoice(request, uuid):
     
     if request.method == 'POST':
         # In a real application, you would process the payment here
-        invoice.status = 'paid'
-        invoice.save()
-        
-        # Send payment confirmation email
-        send_payment_confirmation_email(invoice)
+        with transaction.atomic():
+            # Locked and checked again, so concurrent pays move it into paid once
+            invoice = Invoice.objects.select_for_update().get(pk=invoice.pk)
+            if invoice.status == 'paid':
+                messages.error(request, 'This invoice is already paid.')
+                return redirect('invoice_detail', uuid=uuid)
+            
+            old_status = invoice.status
+            invoice.status = 'paid'
+            invoice.save()
+            record_status_change(invoice, old_status)
+            
+            # Queue payment confirmation email, sent by the outbox dispatcher
+            enqueue_email('payment_confirmation', invoice_id=invoice.id)
         
-        messages.success(request, 'Your payment has been processed successfully. A confirmation email has been sent.')
+        messages.success(request, 'Your payment has been processed successfully. A confirmation email is on its way.')
         return redirect('invoice_detail', uuid=uuid)
     
     return render(request, 'billing/pay_invoice.html', {'invoice': invoice})
@@ -392,6 +591,7 @@ class UserLoginAPIView(APIView):
         if serializer.is_valid():
             user = serializer.validated_data['user']
             refresh = RefreshToken.for_user(user)
+            record_last_login(user)
             
             response_data = {
                 'user': user,
@@ -414,7 +614,7 @@ class UserLogoutAPIView(APIView):
         try:
             refresh_token = request.data.get('refresh')
             if refresh_token:
-                token = RefreshToken(refresh_token)
+                token = CachedRefreshToken(refresh_token)
                 token.blacklist()
                 return Response({'detail': 'Successfully logged out'}, status=status.HTTP_200_OK)
             else:
@@ -422,6 +622,51 @@ class UserLogoutAPIView(APIView):
         except Exception as e:
             return Response({'detail': 'Invalid token'}, status=status.HTTP_400_BAD_REQUEST)
 
+class CohortAnalyticsAPIView(APIView):
+    """
+    API endpoint for cohort retention, churn and paid conversion (staff only)
+    Query params: months (retention horizon), refresh=1 to bypass the cache
+    """
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        try:
+            months = int(request.query_params.get('months', settings.ANALYTICS_COHORT_MONTHS))
+        except ValueError:
+            months = 0
+        if not 1 <= months <= 120:
+            return Response({'detail': 'months must be a number between 1 and 120'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        refresh = request.query_params.get('refresh') in ('1', 'true')
+        return Response(cached_cohort_analytics(months, refresh=refresh))
+
+class MrrAnalyticsAPIView(APIView):
+    """
+    API endpoint for the daily MRR / ARR series and a linear forecast (staff only)
+    Query params: from / to (YYYY-MM-DD, default the last 365 days), plan (id), forecast (days, default 30)
+    """
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        params = request.query_params
+        try:
+            end = date.fromisoformat(params['to']) if params.get('to') else timezone.localdate()
+            start = date.fromisoformat(params['from']) if params.get('from') else end - timedelta(days=365)
+            plan_id = int(params['plan']) if params.get('plan') else None
+            forecast_days = int(params.get('forecast', 30))
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 <= forecast_days <= 365:
+            return Response({'detail': 'forecast must be between 0 and 365 days'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        series = mrr_series(start, end, plan_id)
+        return Response({
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'series': series,
+            'forecast': mrr_forecast(series, forecast_days),
+        })
+
 class UserProfileAPIView(APIView):
     """
     API endpoint to get current user profile
@@ -453,7 +698,23 @@ def api_endpoints(request):
             'cancel_subscription': '/api/subscriptions/{id}/cancel/ (POST)',
             'invoices': '/api/invoices/',
             'pending_invoices': '/api/invoices/pending/',
+            'export_invoices': '/api/invoices/export/?output=csv|jsonl&from=YYYY-MM-DD&to=YYYY-MM-DD&status=paid',
+            'export_all_invoices': '/api/invoices/export-all/ (staff only, same params)',
             'pay_invoice': '/api/invoices/{id}/pay/ (POST)',
+            'pay_invoices_bulk': '/api/invoices/pay-bulk/ (POST {"invoice_uuids": [...], "all_or_nothing": false})',
+        },
+        'async': {
+            'plans': '/api/async/plans/',
+            'subscriptions': '/api/async/subscriptions/',
+            'subscription': '/api/async/subscriptions/{id}/',
+            'invoices': '/api/async/invoices/',
+            'invoice': '/api/async/invoices/{id}/',
+            'pending_invoices': '/api/async/invoices/pending/',
+            'profile': '/api/async/auth/profile/',
+        },
+        'analytics': {
+            'cohorts': '/api/analytics/cohorts/?months=12 (staff only)',
+            'mrr': '/api/analytics/mrr/?from=YYYY-MM-DD&to=YYYY-MM-DD&forecast=30 (staff only)',
         },
         'authentication_header': 'Authorization: Bearer <access_token>',
         'example_usage': {
@@ -30,6 +30,7 @@ INSTALLED_APPS = [
     'django_celery_results',
     'rest_framework',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
 ]
 
 MIDDLEWARE = [
@@ -77,6 +78,23 @@ else:
         }
     }
 
+# A shared cache (Redis) lets every web process see the others' user cache
+# invalidations and blacklisted tokens (see billing.authentication)
+if os.environ.get('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('CACHE_URL'),
+        }
+    }
+else:
+    # Per-process memory cache for local development
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -143,6 +161,16 @@ else:
 
 ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', 'admin@subscriptionbillingsystem.com')
 
+# Batch sends reuse one SMTP connection for this many messages before reconnecting
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 100))
+
+# Transactional email outbox drained by billing.tasks.dispatch_email_outbox
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', 100))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+EMAIL_OUTBOX_RETRY_DELAY = int(os.environ.get('EMAIL_OUTBOX_RETRY_DELAY', 60))  # seconds, doubled per attempt
+# Seconds after which an email still being sent is taken to be from a dead dispatcher
+EMAIL_OUTBOX_SENDING_TIMEOUT = int(os.environ.get('EMAIL_OUTBOX_SENDING_TIMEOUT', 600))
+
 # Celery Configuration
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6380/0')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'django-db')
@@ -151,6 +179,34 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Invoice generation: subscriptions fetched and invoices bulk-inserted per chunk
+BILLING_CHUNK_SIZE = int(os.environ.get('BILLING_CHUNK_SIZE', 1000))
+# Sharded generation: more than one shard (or a shard size) fans the run out to a chord
+BILLING_SHARD_COUNT = int(os.environ.get('BILLING_SHARD_COUNT', 1))
+BILLING_SHARD_SIZE = int(os.environ.get('BILLING_SHARD_SIZE', 0))
+# Monthly summaries: recipients rendered per chunk, split across this many subtasks
+BILLING_SUMMARY_CHUNK_SIZE = int(os.environ.get('BILLING_SUMMARY_CHUNK_SIZE', 200))
+BILLING_SUMMARY_WORKERS = int(os.environ.get('BILLING_SUMMARY_WORKERS', 1))
+# Invoice exports stream keyset pages of this many rows
+INVOICE_EXPORT_CHUNK_SIZE = int(os.environ.get('INVOICE_EXPORT_CHUNK_SIZE', 2000))
+# Cohort analytics: retention horizon in months, and how long results stay cached
+ANALYTICS_COHORT_MONTHS = int(os.environ.get('ANALYTICS_COHORT_MONTHS', 12))
+ANALYTICS_CACHE_TIMEOUT = int(os.environ.get('ANALYTICS_CACHE_TIMEOUT', 3600))  # seconds
+# MRR forecast: trailing days of the snapshot series the trend line is fitted to
+MRR_FORECAST_WINDOW = int(os.environ.get('MRR_FORECAST_WINDOW', 90))
+# Subscription imports: rows written per transaction
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 2000))
+# Most invoices one bulk pay request may settle
+BULK_PAY_MAX_INVOICES = int(os.environ.get('BULK_PAY_MAX_INVOICES', 100))
+# Plan catalog: seconds a process may serve its cached plans before rereading them
+PLAN_CATALOG_TIMEOUT = int(os.environ.get('PLAN_CATALOG_TIMEOUT', 300))
+
+# JWT authentication caches (see billing.authentication)
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_USER_CACHE_TIMEOUT', 60))  # seconds
+AUTH_BLACKLIST_REFRESH_INTERVAL = int(os.environ.get('AUTH_BLACKLIST_REFRESH_INTERVAL', 30))  # seconds
+LAST_LOGIN_BATCH_SIZE = int(os.environ.get('LAST_LOGIN_BATCH_SIZE', 100))
+LAST_LOGIN_FLUSH_INTERVAL = int(os.environ.get('LAST_LOGIN_FLUSH_INTERVAL', 60))  # seconds
+
 # Celery Beat Configuration
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
@@ -164,14 +220,18 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'billing.tasks.mark_overdue_invoices',
         'schedule': 86400,  # every 24 hours
     },
-    'send-payment-reminders-daily': {
-        'task': 'billing.tasks.send_payment_reminders',
+    'send-daily-billing-notices': {
+        'task': 'billing.tasks.send_daily_billing_notices',
         'schedule': 86400,  # every 24 hours
     },
-    'send-unpaid-invoice-reminders-daily': {
-        'task': 'billing.tasks.send_unpaid_invoice_reminders',
+    'snapshot-mrr-daily': {
+        'task': 'billing.tasks.snapshot_mrr',
         'schedule': 86400,  # every 24 hours
     },
+    'dispatch-email-outbox': {
+        'task': 'billing.tasks.dispatch_email_outbox',
+        'schedule': 30,  # every 30 seconds
+    },
 }
 
 # Logging Configuration
@@ -228,12 +288,22 @@ LOGGING = {
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'billing.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # orjson-backed when it is installed, DRF's JSON classes otherwise; same output either way
+    'DEFAULT_RENDERER_CLASSES': [
+        'billing.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'billing.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20
 }
@@ -246,7 +316,8 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
-    'UPDATE_LAST_LOGIN': True,
+    'UPDATE_LAST_LOGIN': True,  # written in batches by billing.authentication
+    'TOKEN_REFRESH_SERIALIZER': 'billing.authentication.CachedTokenRefreshSerializer',
     
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,